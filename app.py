@@ -1,30 +1,195 @@
-from flask import Flask, render_template, request, send_file, jsonify, url_for
+from flask import Flask, Response, render_template, request, send_file, jsonify, stream_with_context, url_for
+import copy
+import hashlib
+import hmac
+import json
+import mimetypes
 import os
 import re
-import requests
 import threading
-import uuid
-from typing import Any, Callable, Dict, Optional
-from urllib.parse import urlparse
-
-import yt_dlp
-
-from downloader_utils import resolve_download_path
-from ffmpeg_utils import ensure_ffmpeg, BIN_DIR
-from spotify import get_track_info, get_track_metadata, download_from_youtube
+import time
+import unicodedata
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlparse
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.wsgi import ClosingIterator
+
+import http_client
+import postprocess
+import segmented_download
+from download_cache import DownloadCache, make_cache_key, normalize_url
+from downloader_utils import resolve_download_path, yt_dlp
+from fair_share import BandwidthShaper, class_of, job_priority, parse_priority_class, priority_floor, throttled_hook
+from fallback import FALLBACK_HEDGE, StrategyMemory, domain_of, is_strategy_failure
+from ffmpeg_utils import BIN_DIR, start_ffmpeg_install, wait_for_ffmpeg
+from job_queue import JobDispatcher, JobScheduler, QueueFullError
+from job_store import TERMINAL_STATUSES, JobStore, SharedJobStore
+from passthrough import PassthroughStream
+from playlist import PLAYLIST_WORKERS, Playlist, run_bounded
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    DOWNLOAD_FALLBACKS,
+    DOWNLOAD_THROUGHPUT_BYTES,
+    EXTRACT_INFO_SECONDS,
+    TIME_TO_FIRST_BYTE_SECONDS,
+    Gauge,
+    render as render_metrics,
+)
+from progress import ProgressTracker, format_eta
+from storage_manager import StorageManager
+from spotify import (
+    download_from_youtube,
+    download_tracks,
+    get_collection,
+    get_track_metadata,
+    is_collection_url,
+    track_url,
+)
+from ttl_cache import TTLCache
+from zip_stream import stream_zip, unique_arcname
 
 app = Flask(__name__)
 DOWNLOAD_FOLDER = "downloads"
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
-ensure_ffmpeg()
-
 API_TOKEN = os.environ.get("NUBCODER_TOKEN", "CIMzU2EK0N")
-API_BASE_URL = "http://api.nubcoder.com"
+API_BASE_URL = os.environ.get("NUBCODER_API_URL", "http://api.nubcoder.com")
 API_FORMAT_ID = "api-direct"
-
-_download_jobs: Dict[str, Dict[str, Any]] = {}
-_download_lock = threading.Lock()
+API_DOWNLOAD_CONNECTIONS = int(os.environ.get("API_DOWNLOAD_CONNECTIONS", 4))
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 5))
+RETRY_BACKOFF_BASE = float(os.environ.get("RETRY_BACKOFF_BASE", 1.0))
+RETRY_BACKOFF_MAX = float(os.environ.get("RETRY_BACKOFF_MAX", 30.0))
+
+# Download slots only do network I/O; ffmpeg work runs on the post-processing
+# process pool (POSTPROCESS_WORKERS, default one per core).
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 8))
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get("DOWNLOAD_QUEUE_SIZE", 100))
+VIDEO_INFO_CACHE_SIZE = int(os.environ.get("VIDEO_INFO_CACHE_SIZE", 512))
+VIDEO_INFO_CACHE_TTL = float(os.environ.get("VIDEO_INFO_CACHE_TTL", 900))
+VIDEO_INFO_NEGATIVE_TTL = float(os.environ.get("VIDEO_INFO_NEGATIVE_TTL", 60))
+PREVIEW_INFO_CACHE_SIZE = int(os.environ.get("PREVIEW_INFO_CACHE_SIZE", 64))
+PREVIEW_INFO_TTL = float(os.environ.get("PREVIEW_INFO_TTL", 180))
+STATUS_LONG_POLL_MAX = float(os.environ.get("STATUS_LONG_POLL_MAX", 30))
+STATUS_STREAM_HEARTBEAT = float(os.environ.get("STATUS_STREAM_HEARTBEAT", 15))
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(DOWNLOAD_FOLDER, "jobs.sqlite3"))
+JOB_TTL = float(os.environ.get("JOB_TTL", 3600))
+JOB_STORE_MAX = int(os.environ.get("JOB_STORE_MAX", 10000))
+# With a job database, every process (e.g. each gunicorn worker) shares the
+# job registry and the download queue through it.
+SHARED_JOBS = bool(JOB_DB_PATH) and os.environ.get("SHARED_JOBS", "1") not in ("0", "false", "False")
+JOB_LEASE = float(os.environ.get("JOB_LEASE", 30))
+DISPATCH_POLL_INTERVAL = float(os.environ.get("DISPATCH_POLL_INTERVAL", 0.25))
+STORAGE_QUOTA_MB = float(os.environ.get("STORAGE_QUOTA_MB", 10240))
+STORAGE_ORPHAN_AGE = float(os.environ.get("STORAGE_ORPHAN_AGE", 3600))
+STORAGE_SWEEP_INTERVAL = float(os.environ.get("STORAGE_SWEEP_INTERVAL", 600))
+PREWARM_YT_DLP = os.environ.get("PREWARM_YT_DLP", "1") not in ("0", "false", "False")
+STREAM_PASSTHROUGH = os.environ.get("STREAM_PASSTHROUGH", "1") not in ("0", "false", "False")
+# "accel" hands finished files to a fronting nginx (X-Accel-Redirect),
+# "sendfile" to Apache/lighttpd (X-Sendfile); empty serves them from Python.
+FILE_OFFLOAD = os.environ.get("FILE_OFFLOAD", "").strip().lower()
+ACCEL_REDIRECT_PREFIX = os.environ.get("ACCEL_REDIRECT_PREFIX", "/protected-downloads/")
+BATCH_MAX_URLS = int(os.environ.get("BATCH_MAX_URLS", 50))
+# Extractions running at once for all batch previews together.
+BATCH_INFO_CONCURRENCY = int(os.environ.get("BATCH_INFO_CONCURRENCY", 4))
+# Download jobs one client (API token or IP address) may have running and
+# waiting at once; 0 disables either limit. Off by default: behind a proxy
+# without TRUST_PROXY every request comes from the proxy's address.
+CLIENT_MAX_ACTIVE = int(os.environ.get("CLIENT_MAX_ACTIVE", 0))
+CLIENT_MAX_QUEUED = int(os.environ.get("CLIENT_MAX_QUEUED", 0))
+# Download workers only interactive jobs may use, so they start right away
+# while batch and prefetch jobs keep the others busy.
+INTERACTIVE_RESERVED_WORKERS = int(os.environ.get("INTERACTIVE_RESERVED_WORKERS", 1))
+# Number of reverse proxies in front of the app. The client address is the
+# X-Forwarded-For entry the outermost of them appended; anything to its left
+# was sent by the client and is ignored.
+TRUST_PROXY = int(os.environ.get("TRUST_PROXY", 0))
+# Comma-separated API tokens that identify a client (X-Client-Token header)
+# in place of its address; other tokens are ignored.
+CLIENT_TOKENS = {token.strip() for token in os.environ.get("CLIENT_TOKENS", "").split(",") if token.strip()}
+# Bearer token for /admin/scheduler; the route is disabled without one.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+if TRUST_PROXY > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUST_PROXY)  # type: ignore[method-assign]
+
+if SHARED_JOBS:
+    _job_store: JobStore = SharedJobStore(JOB_DB_PATH, ttl=JOB_TTL, max_jobs=JOB_STORE_MAX, lease=JOB_LEASE)
+else:
+    _job_store = JobStore(db_path=JOB_DB_PATH or None, ttl=JOB_TTL, max_jobs=JOB_STORE_MAX)
+_scheduler = JobScheduler(
+    workers=DOWNLOAD_WORKERS,
+    max_queue=DOWNLOAD_QUEUE_SIZE,
+    client_limit=CLIENT_MAX_ACTIVE,
+    client_queue_limit=CLIENT_MAX_QUEUED,
+    reserved_workers=INTERACTIVE_RESERVED_WORKERS,
+    reserve_below=priority_floor("batch"),
+)
+_dispatcher: Optional[JobDispatcher] = None
+# Process that started the dispatcher and sweeper; see start_background_work.
+_background_pid: Optional[int] = None
+_background_lock = threading.Lock()
+_shaper = BandwidthShaper()
+postprocess.configure(while_waiting=_scheduler.blocking)
+http_client.configure(pool_size=max(http_client.HTTP_POOL_SIZE, DOWNLOAD_WORKERS * API_DOWNLOAD_CONNECTIONS))
+_download_cache = DownloadCache(DOWNLOAD_FOLDER)
+_storage = StorageManager(
+    DOWNLOAD_FOLDER,
+    quota_bytes=int(STORAGE_QUOTA_MB * 1024 * 1024),
+    orphan_age=STORAGE_ORPHAN_AGE,
+)
+_video_info_cache = TTLCache(
+    maxsize=VIDEO_INFO_CACHE_SIZE,
+    ttl=VIDEO_INFO_CACHE_TTL,
+    negative_ttl=VIDEO_INFO_NEGATIVE_TTL,
+)
+# Raw yt-dlp info dicts from /video_info, reused by the following download so
+# it can skip a second extraction. Kept short because stream URLs expire.
+_preview_info_cache = TTLCache(maxsize=PREVIEW_INFO_CACHE_SIZE, ttl=PREVIEW_INFO_TTL)
+_batch_info_executor = ThreadPoolExecutor(max_workers=max(1, BATCH_INFO_CONCURRENCY), thread_name_prefix="video-info")
+_strategy_memory = StrategyMemory()
+_api_probe_executor = ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_WORKERS), thread_name_prefix="api-probe")
+
+
+def _queued_jobs() -> int:
+    if _dispatcher is not None:
+        return _job_store.queued_count()
+    return _scheduler.queue_depth()
+
+
+# Gauges are read when /metrics is scraped, not maintained on the hot path.
+Gauge("downloader_queue_depth", "Download jobs waiting for a worker.", _queued_jobs)
+Gauge("downloader_active_jobs", "Download jobs running in this process.", lambda: _scheduler.active_count())
+Gauge(
+    "downloader_postprocess_queue_depth",
+    "Downloads waiting for a post-processing slot.",
+    lambda: postprocess.get_pool().queue_depth(),
+)
+Gauge(
+    "downloader_postprocess_active",
+    "Post-processing tasks running.",
+    lambda: postprocess.get_pool().active_count(),
+)
+Gauge("downloader_storage_bytes", "Size of the files in the downloads folder.", lambda: _storage.total_bytes())
+
+YTDLP_POSTPROCESSING = ["writethumbnail", "EmbedThumbnail"]
+SPOTIFY_POSTPROCESSING = ["FFmpegExtractAudio:mp3:192", "EmbedThumbnail"]
+PASSTHROUGH_POSTPROCESSING = ["passthrough"]
+# yt-dlp downloads made while ffmpeg is unavailable: no merge, no thumbnail.
+YTDLP_SINGLE_FILE_POSTPROCESSING = ["single-file"]
+
+# Pipeline stage reported alongside each job status.
+JOB_PHASES = {
+    "queued": "queue",
+    "starting": "download",
+    "downloading": "download",
+    "processing_queued": "postprocess",
+    "processing": "postprocess",
+    "completed": "done",
+    "error": "done",
+}
 
 
 def clamp_progress(value: Optional[float]) -> Optional[int]:
@@ -36,37 +201,67 @@ def clamp_progress(value: Optional[float]) -> Optional[int]:
         return None
 
 
-def create_job() -> str:
-    job_id = uuid.uuid4().hex
-    with _download_lock:
-        _download_jobs[job_id] = {
-            "status": "pending",
-            "progress": 0,
-            "message": "Queued",
-            "filepath": None,
-            "error": None,
-            "requested_format": None,
-            "source_url": None,
-        }
-    return job_id
+def create_job(**fields: Any) -> str:
+    return _job_store.create(**fields)
 
 
 def update_job(job_id: str, **fields: Any) -> None:
-    if not fields:
-        return
-    with _download_lock:
-        job = _download_jobs.get(job_id)
-        if not job:
-            return
-        job.update(fields)
+    _job_store.update(job_id, **fields)
+    if fields.get("status") in TERMINAL_STATUSES:
+        job = get_job(job_id)
+        if job and job.get("parent_id"):
+            refresh_batch_job(job["parent_id"])
 
 
-def get_job(job_id: str) -> Optional[Dict[str, Any]]:
-    with _download_lock:
-        job = _download_jobs.get(job_id)
-        if not job:
+def delete_job(job_id: str) -> None:
+    _job_store.delete(job_id)
+
+
+def is_batch_job(job: Dict[str, Any]) -> bool:
+    items = job.get("items")
+    return bool(items) and all("jobId" in item for item in items)
+
+
+def refresh_batch_job(parent_id: str) -> None:
+    """Recompute a batch's items and status from its child jobs.
+
+    Called whenever a child finishes; the batch completes once every child
+    has, and fails only if none of them produced a file.
+    """
+    def _summarize(parent: Dict[str, Any], children: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not is_batch_job(parent):
             return None
-        return dict(job)
+        items = []
+        completed = failed = 0
+        for item in parent["items"]:
+            child = children.get(item["jobId"]) or {"status": "error", "error": "Job expired"}
+            entry = {"jobId": item["jobId"], "url": item["url"], "status": child.get("status")}
+            if child.get("status") == "completed":
+                completed += 1
+            elif child.get("status") == "error":
+                failed += 1
+                entry["error"] = child.get("error")
+            items.append(entry)
+        total = len(items)
+        fields: Dict[str, Any] = {"items": items, "progress": int((completed + failed) * 100 / total)}
+        if completed + failed < total:
+            fields.update(status="downloading", message=f"{completed + failed}/{total} downloads finished")
+        elif completed:
+            message = "Batch ready" + (f" ({failed} failed)" if failed else "")
+            fields.update(status="completed", message=message)
+        else:
+            fields.update(status="error", error="All downloads failed", message="All downloads failed")
+        return fields
+
+    _job_store.update_parent(parent_id, _summarize)
+
+
+def wait_for_job_change(job_id: str, since: int, timeout: float) -> Optional[Dict[str, Any]]:
+    return _job_store.wait_for_change(job_id, since, timeout)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return _job_store.get(job_id)
 
 
 def report_job_progress(
@@ -75,10 +270,11 @@ def report_job_progress(
     progress: Optional[float] = None,
     message: Optional[str] = None,
     status: Optional[str] = None,
+    **transfer: Any,
 ) -> None:
     if not job_id:
         return
-    updates: Dict[str, Any] = {}
+    updates: Dict[str, Any] = dict(transfer)
     percent = clamp_progress(progress)
     if percent is not None:
         updates["progress"] = percent
@@ -90,38 +286,76 @@ def report_job_progress(
         update_job(job_id, **updates)
 
 
+def describe_transfer(label: str, tracker: ProgressTracker) -> str:
+    parts = [label]
+    if tracker.percent is not None:
+        parts.append(f"{tracker.percent:.1f}%")
+    if tracker.done:
+        parts.append(format_size(tracker.done) + (f" of {format_size(tracker.total)}" if tracker.total else ""))
+    if tracker.speed:
+        parts.append(f"{format_size(tracker.speed)}/s")
+    if tracker.total:
+        parts.append(f"ETA {format_eta(tracker.eta)}")
+    return " | ".join(parts)
+
+
 def make_progress_hook(job_id: str) -> Callable[[Dict[str, Any]], None]:
+    # yt-dlp calls the hook for every chunk; the tracker keeps the counts and
+    # only writes to the job store a few times per second.
+    tracker = ProgressTracker(
+        lambda t: report_job_progress(
+            job_id,
+            progress=max(1.0, t.percent or 0),
+            message=describe_transfer("Downloading", t),
+            status="downloading",
+            **t.fields(),
+        )
+    )
+    timing = {"started": time.monotonic(), "first_byte": False}
+
     def _hook(data: Dict[str, Any]) -> None:
         status = data.get("status")
         if status == "downloading":
+            if not timing["first_byte"]:
+                timing["first_byte"] = True
+                TIME_TO_FIRST_BYTE_SECONDS.observe(time.monotonic() - timing["started"])
             total = data.get("total_bytes") or data.get("total_bytes_estimate")
-            downloaded = data.get("downloaded_bytes") or 0
-            percent = None
-            if total:
-                try:
-                    percent = (downloaded / float(total)) * 100
-                except (TypeError, ValueError, ZeroDivisionError):
-                    percent = None
-            parts = ["Downloading"]
-            percent_text = data.get("_percent_str")
-            eta_text = data.get("_eta_str")
-            if percent_text:
-                parts.append(percent_text.strip())
-            if eta_text:
-                parts.append(f"ETA {eta_text.strip()}")
+            tracker.update(data.get("downloaded_bytes") or 0, int(total) if total else None)
+        elif status == "finished":
+            size, elapsed = data.get("total_bytes"), data.get("elapsed")
+            if size and elapsed:
+                DOWNLOAD_THROUGHPUT_BYTES.observe(size / elapsed)
             report_job_progress(
                 job_id,
-                progress=percent or 1,
-                message=" | ".join(parts),
+                progress=95,
+                message="Download finished",
                 status="downloading",
+                eta=0,
             )
-        elif status == "finished":
+        elif status == "postprocess_queued":
+            report_job_progress(
+                job_id,
+                progress=95,
+                message=f"Waiting to post-process (position {data.get('queue_position')})",
+                status="processing_queued",
+            )
+        elif status == "postprocessing":
             report_job_progress(job_id, progress=96, message="Post-processing...", status="processing")
         elif status == "error":
             error_msg = data.get("filename") or "Download error"
             report_job_progress(job_id, progress=0, message=error_msg, status="error")
 
-    return _hook
+    return throttled_hook(_hook, _shaper.throttle_for(job_id))
+
+
+def make_api_progress_callback(job_id: Optional[str]) -> Optional[Callable[..., None]]:
+    if not job_id:
+        return None
+
+    def _callback(percent: Optional[float], message: str, **transfer: Any) -> None:
+        report_job_progress(job_id, progress=percent, message=message, status="downloading", **transfer)
+
+    return _callback
 
 
 def is_spotify_url(url: str) -> bool:
@@ -136,6 +370,10 @@ def index():
     return render_template("index.html")
 
 
+def retry_backoff(attempt: int) -> float:
+    return min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** max(0, attempt - 1)))
+
+
 def format_size(bytes_val):
     if not bytes_val:
         return "N/A"
@@ -155,7 +393,7 @@ def sanitize_filename(name: str) -> str:
 
 def fetch_api_data(video_url: str):
     try:
-        response = requests.get(
+        response = http_client.get(
             f"{API_BASE_URL}/info",
             params={"token": API_TOKEN, "q": video_url},
             timeout=20,
@@ -169,21 +407,13 @@ def fetch_api_data(video_url: str):
     return None
 
 
-def download_via_api(
-    api_data: dict,
-    progress_callback: Optional[Callable[[Optional[float], str], None]] = None,
-):
-    if not api_data:
-        return None
-    download_url = api_data.get("url")
-    if not download_url:
-        return None
-
+def api_filename(api_data: dict) -> str:
     title = sanitize_filename(api_data.get("title") or api_data.get("video_id"))
-    parsed_ext = os.path.splitext(urlparse(download_url).path)[1] or ".mp4"
-    filename = f"{title}(-by Alex){parsed_ext}"
-    filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+    parsed_ext = os.path.splitext(urlparse(api_data.get("url") or "").path)[1] or ".mp4"
+    return f"{title}(-by Alex){parsed_ext}"
 
+
+def build_api_headers(api_data: dict) -> Dict[str, str]:
     headers = dict(api_data.get("headers") or {})
     headers.setdefault(
         "User-Agent",
@@ -198,56 +428,236 @@ def download_via_api(
     referer = api_data.get("referer") or api_data.get("origin") or api_data.get("page")
     if referer:
         headers.setdefault("Referer", referer)
+    return headers
 
-    try:
-        with requests.get(download_url, stream=True, headers=headers, timeout=60) as response:
-            response.raise_for_status()
-            total_bytes = int(response.headers.get("content-length") or 0)
-            downloaded = 0
-            with open(filepath, "wb") as fh:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if not chunk:
-                        continue
-                    fh.write(chunk)
-                    downloaded += len(chunk)
-                    if progress_callback:
-                        percent = None
-                        if total_bytes:
-                            try:
-                                percent = (downloaded / float(total_bytes)) * 100
-                            except (TypeError, ValueError, ZeroDivisionError):
-                                percent = None
-                        size_msg = f"Downloading via fallback {format_size(downloaded)}"
-                        if total_bytes:
-                            size_msg += f" of {format_size(total_bytes)}"
-                        progress_callback(percent, size_msg)
-    except Exception as exc:
-        print(f"API download failed: {exc}")
-        if progress_callback:
-            progress_callback(0, f"Fallback error: {exc}")
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except OSError:
-                pass
+
+def download_via_api(
+    api_data: dict,
+    progress_callback: Optional[Callable[..., None]] = None,
+    output_dir: str = DOWNLOAD_FOLDER,
+    throttle: Optional[Callable[[int], float]] = None,
+):
+    """Fetch the fallback API's file, reporting through ``progress_callback``.
+
+    The callback is called as ``(percent, message, **transfer)`` where
+    ``transfer`` holds the job-record byte counters, speed and ETA.
+    ``throttle`` paces the transfer to the job's bandwidth share.
+    """
+    if not api_data:
+        return None
+    download_url = api_data.get("url")
+    if not download_url:
         return None
 
+    filepath = os.path.join(output_dir, api_filename(api_data))
+    headers = build_api_headers(api_data)
+
+    tracker = ProgressTracker(
+        lambda t: progress_callback(t.percent, describe_transfer("Downloading via fallback", t), **t.fields())
+        if progress_callback
+        else None
+    )
+    timing: Dict[str, Any] = {"started": time.monotonic(), "first_byte": None, "first_done": 0}
+
+    def _on_progress(downloaded: int, total_bytes: int) -> None:
+        if timing["first_byte"] is None:
+            timing["first_byte"] = time.monotonic()
+            timing["first_done"] = downloaded
+            TIME_TO_FIRST_BYTE_SECONDS.observe(timing["first_byte"] - timing["started"])
+        tracker.update(downloaded, total_bytes)
+
+    # Partial data is kept in <file>.part between attempts, so each retry and
+    # any later job for the same cache key resumes instead of starting over.
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        try:
+            segmented_download.download_file(
+                download_url,
+                filepath,
+                headers=headers,
+                connections=API_DOWNLOAD_CONNECTIONS,
+                progress_callback=_on_progress,
+                throttle=throttle,
+            )
+            break
+        except Exception as exc:
+            print(f"API download failed (attempt {attempt}/{DOWNLOAD_RETRIES}): {exc}")
+            if attempt >= DOWNLOAD_RETRIES:
+                if progress_callback:
+                    progress_callback(0, f"Fallback error: {exc}")
+                return None
+            delay = retry_backoff(attempt)
+            if progress_callback:
+                progress_callback(None, f"Fallback interrupted, resuming in {delay:.0f}s...")
+            time.sleep(delay)
+
+    if timing["first_byte"] is not None:
+        elapsed = time.monotonic() - timing["first_byte"]
+        if elapsed > 0:
+            DOWNLOAD_THROUGHPUT_BYTES.observe((tracker.done - timing["first_done"]) / elapsed)
     if progress_callback:
-        progress_callback(100, "Download ready")
+        progress_callback(100, "Download ready", eta=0)
     return filepath
 
 
+def without_ffmpeg(ydl_opts: Dict[str, Any]) -> Dict[str, Any]:
+    """``ydl_opts`` cut down to a single-file format and no thumbnail embedding."""
+    options = dict(ydl_opts, writethumbnail=False, postprocessors=[])
+    # "bestvideo+bestaudio/best" -> "best", "<id>+bestaudio/<id>" -> "<id>".
+    options["format"] = options["format"].rsplit("/", 1)[-1]
+    return options
+
+
+def download_cache_key(url: str, selected_format: str, ffmpeg: bool = True) -> str:
+    if is_spotify_url(url):
+        postprocessing = SPOTIFY_POSTPROCESSING
+    elif selected_format == API_FORMAT_ID:
+        postprocessing = None
+    elif ffmpeg:
+        postprocessing = YTDLP_POSTPROCESSING
+    else:
+        postprocessing = YTDLP_SINGLE_FILE_POSTPROCESSING
+    return make_cache_key(url, selected_format, postprocessing)
+
+
 def perform_download(url: str, selected_format: str, job_id: Optional[str] = None) -> str:
     if not url:
         raise ValueError("URL is required")
 
+    key = download_cache_key(url, selected_format)
+
+    cached = _download_cache.lookup(key)
+    if cached:
+        report_job_progress(job_id, progress=100, message="Download ready (cached)", status="completed")
+        return cached
+
+    ffmpeg = True
+    if not is_spotify_url(url) and selected_format != API_FORMAT_ID:
+        # Merging and thumbnail embedding need ffmpeg; on a fresh host this
+        # waits for the background install started at boot. Without it the
+        # download is a different file and is cached under its own key.
+        ffmpeg = wait_for_ffmpeg()
+        if not ffmpeg:
+            print(f"ffmpeg is not available, downloading a single file without merging: {url}")
+            key = download_cache_key(url, selected_format, ffmpeg=False)
+            cached = _download_cache.lookup(key)
+            if cached:
+                report_job_progress(job_id, progress=100, message="Download ready (cached)", status="completed")
+                return cached
+
+    def _on_wait() -> None:
+        report_job_progress(
+            job_id,
+            progress=1,
+            message="Waiting for an identical download in progress...",
+            status="downloading",
+        )
+
+    output_dir = _download_cache.directory_for(key)
+    with _storage.pinned(output_dir):
+        filepath = _download_cache.fetch(
+            key,
+            lambda: _perform_download(url, selected_format, job_id, output_dir, ffmpeg),
+            on_wait=_on_wait,
+        )
+        # Indexed while still pinned, so the eviction it triggers spares it.
+        _storage.track(filepath)
+    report_job_progress(job_id, progress=100, message="Download ready", status="completed")
+    return filepath
+
+
+def download_spotify_track(track: Dict[str, Any], progress_hook: Optional[Callable] = None) -> Optional[str]:
+    """Download one track of a collection through the shared per-track cache."""
+    url = track_url(track["id"])
+    key = download_cache_key(url, "best")
+    output_dir = _download_cache.directory_for(key)
+    with _storage.pinned(output_dir):
+        filepath = _download_cache.fetch(
+            key,
+            lambda: download_from_youtube(
+                track["query"],
+                progress_hook=progress_hook,
+                output_dir=output_dir,
+                track_id=track["id"],
+            ),
+        )
+        if filepath:
+            _storage.track(filepath)
+    return filepath
+
+
+def write_zip(filepaths: List[str], zip_path: str) -> str:
+    """Bundle already-compressed media into an uncompressed ZIP archive."""
+    part = zip_path + ".part"
+    seen: Dict[str, int] = {}
+    with zipfile.ZipFile(part, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for filepath in filepaths:
+            archive.write(filepath, arcname=unique_arcname(filepath, seen))
+    os.replace(part, zip_path)
+    return zip_path
+
+
+def download_spotify_collection(url: str, job_id: Optional[str], output_dir: str) -> str:
+    report_job_progress(job_id, progress=1, message="Fetching Spotify tracklist...", status="starting")
+    collection = get_collection(url)
+    if not collection or not collection["tracks"]:
+        raise RuntimeError("Failed to fetch Spotify tracklist")
+    total = len(collection["tracks"])
+
+    def _on_update(items: List[Dict[str, Any]], status_changed: bool) -> None:
+        finished = sum(1 for item in items if item["status"] in ("completed", "error"))
+        overall = sum(item["progress"] for item in items) / float(total)
+        # The track list is a durable field; progress ticks only move the
+        # job's volatile progress and are picked up with the next state change.
+        if job_id and status_changed:
+            update_job(job_id, items=items)
+        report_job_progress(
+            job_id,
+            progress=max(1, min(97, overall)),
+            message=f"Downloading {collection['title']}: {finished}/{total} tracks",
+            status="downloading",
+        )
+
+    # Tracks download on their own threads; carry the job's bandwidth share
+    # and post-processing priority over to them.
+    throttle = _shaper.throttle_for(job_id) if job_id else None
+    priority = postprocess.current_priority()
+
+    def _download_track(track: Dict[str, Any], hook: Callable[[Dict[str, Any]], None]) -> Optional[str]:
+        with postprocess.job_priority(priority):
+            return download_spotify_track(track, throttled_hook(hook, throttle))
+
+    results = download_tracks(collection["tracks"], _download_track, on_update=_on_update)
+    filepaths = [path for path in results if path and os.path.exists(path)]
+    if not filepaths:
+        raise RuntimeError("Failed to download any Spotify tracks")
+
+    report_job_progress(job_id, progress=98, message="Packaging tracks...", status="processing")
+    zip_name = f"{sanitize_filename(collection['title'])}(-by Alex).zip"
+    zip_path = write_zip(filepaths, os.path.join(output_dir, zip_name))
+    failed = total - len(filepaths)
+    message = "Spotify download ready" + (f" ({failed} tracks failed)" if failed else "")
+    report_job_progress(job_id, progress=100, message=message, status="completed")
+    return zip_path
+
+
+def _perform_download(
+    url: str, selected_format: str, job_id: Optional[str], output_dir: str, ffmpeg: bool = True
+) -> str:
+    if is_spotify_url(url) and is_collection_url(url):
+        return download_spotify_collection(url, job_id, output_dir)
+
     if is_spotify_url(url):
         report_job_progress(job_id, progress=1, message="Fetching Spotify metadata...", status="starting")
         metadata = get_track_metadata(url)
         if not metadata:
             raise RuntimeError("Failed to fetch Spotify track metadata")
         hook = make_progress_hook(job_id) if job_id else None
-        track_path = download_from_youtube(metadata["query"], progress_hook=hook)
+        track_path = download_from_youtube(
+            metadata["query"],
+            progress_hook=hook,
+            output_dir=output_dir,
+            track_id=metadata.get("track_id"),
+        )
         if not track_path or not os.path.exists(track_path):
             raise RuntimeError("Failed to download Spotify track")
         report_job_progress(job_id, progress=100, message="Spotify download ready", status="completed")
@@ -258,30 +668,35 @@ def perform_download(url: str, selected_format: str, job_id: Optional[str] = Non
         api_data = fetch_api_data(url)
         if not api_data:
             raise RuntimeError("API fallback failed to fetch video")
-        progress_cb = (
-            (lambda pct, msg: report_job_progress(job_id, progress=pct, message=msg, status="downloading"))
-            if job_id
-            else None
+        progress_cb = make_api_progress_callback(job_id)
+        filepath = download_via_api(
+            api_data,
+            progress_callback=progress_cb,
+            output_dir=output_dir,
+            throttle=_shaper.throttle_for(job_id) if job_id else None,
         )
-        filepath = download_via_api(api_data, progress_callback=progress_cb)
         if not filepath or not os.path.exists(filepath):
             raise RuntimeError("API fallback failed to download video")
         report_job_progress(job_id, progress=100, message="Download ready", status="completed")
         return filepath
 
-    output_path = os.path.join(DOWNLOAD_FOLDER, "%(title)s(-by Alex).%(ext)s")
+    output_path = os.path.join(output_dir, "%(title)s(-by Alex).%(ext)s")
     ydl_opts: Dict[str, Any] = {
         "outtmpl": output_path,
         "noplaylist": True,
         "writethumbnail": True,
         "postprocessors": [{"key": "EmbedThumbnail"}],
         "overwrites": True,
+        "continuedl": True,
+        "retries": DOWNLOAD_RETRIES,
+        "fragment_retries": DOWNLOAD_RETRIES,
+        "retry_sleep_functions": {
+            "http": lambda n: retry_backoff(n + 1),
+            "fragment": lambda n: retry_backoff(n + 1),
+        },
         "ffmpeg_location": str(BIN_DIR),
     }
 
-    if os.path.exists("cookies.txt"):
-        ydl_opts["cookiefile"] = "cookies.txt"
-
     if selected_format == "best":
         ydl_opts["format"] = "bestvideo+bestaudio/best"
     else:
@@ -291,81 +706,382 @@ def perform_download(url: str, selected_format: str, job_id: Optional[str] = Non
         ydl_opts["progress_hooks"] = [make_progress_hook(job_id)]
         report_job_progress(job_id, progress=2, message="Starting download...", status="downloading")
 
+    # The preview's info dict is only trusted for the first attempt; retries
+    # re-extract in case its stream URLs were the reason for the failure.
+    preview = {"info": _preview_info_cache.get(normalize_url(url))}
+
     def run_download(options: Dict[str, Any]) -> str:
-        with yt_dlp.YoutubeDL(options) as ydl:
-            info_dict = ydl.extract_info(url, download=True)
+        with postprocess.deferred_youtube_dl(options) as ydl:
+            preview_info = preview.pop("info", None)
+            if preview_info is not None:
+                info_dict = ydl.process_ie_result(copy.deepcopy(preview_info), download=True)
+            else:
+                info_dict = ydl.extract_info(url, download=True)
+            # Merging and thumbnail embedding happen on the process pool.
+            postprocess.finish(ydl, options.get("progress_hooks"))
             filepath_local = resolve_download_path(info_dict, ydl, output_path)
             if not filepath_local or not os.path.exists(filepath_local):
                 raise FileNotFoundError(f"Download finished but file missing: {filepath_local or 'unknown'}")
             return filepath_local
 
-    try:
-        filepath = run_download(dict(ydl_opts))
-    except yt_dlp.utils.DownloadError as error:
-        cookiefile = ydl_opts.pop("cookiefile", None)
-        if cookiefile:
-            print(f"Download failed with cookies, retrying without... Error: {error}")
-            try:
-                filepath = run_download(dict(ydl_opts))
-            except yt_dlp.utils.DownloadError:
-                api_data = fetch_api_data(url)
-                if api_data:
+    def run_api() -> str:
+        if selected_format != "best":
+            # The API has a single MP4, not the requested format; it is
+            # cached under the API's own key instead of this one.
+            DOWNLOAD_FALLBACKS.inc(branch="api_fallback")
+            return perform_download(url, API_FORMAT_ID, job_id)
+        api_data = api_probe.result() if api_probe is not None else fetch_api_data(url)
+        if not api_data:
+            raise RuntimeError("API fallback failed to fetch video")
+        DOWNLOAD_FALLBACKS.inc(branch="api_fallback")
+        progress_cb = make_api_progress_callback(job_id)
+        filepath_local = download_via_api(
+            api_data,
+            progress_callback=progress_cb,
+            output_dir=output_dir,
+            throttle=_shaper.throttle_for(job_id) if job_id else None,
+        )
+        if not filepath_local or not os.path.exists(filepath_local):
+            raise RuntimeError("API fallback failed to download video")
+        return filepath_local
+
+    has_cookies = os.path.exists("cookies.txt")
+    domain = domain_of(url)
+    strategies = ["cookies", "no_cookies", "api"] if has_cookies else ["no_cookies", "api"]
+    plan, skipped = _strategy_memory.plan(domain, strategies)
+    if selected_format != "best":
+        # Whatever worked lately, the API ignores the format; keep it last.
+        plan = [name for name in plan if name != "api"] + [name for name in plan if name == "api"]
+    for _ in skipped:
+        DOWNLOAD_FALLBACKS.inc(branch="circuit_open")
+
+    # The /info probe is cheap, so unless yt-dlp is known to work here it
+    # runs alongside the extraction and the API path starts without a wait.
+    api_probe = None
+    if FALLBACK_HEDGE and "api" in plan[1:] and not _strategy_memory.recently_succeeded(domain, plan[0]):
+        api_probe = _api_probe_executor.submit(fetch_api_data, url)
+
+    ytdlp_error: Optional[BaseException] = None
+    last_error: Optional[BaseException] = None
+    for attempt, strategy in enumerate(plan):
+        try:
+            if strategy == "api":
+                if attempt:
                     report_job_progress(job_id, progress=10, message="Switching to fallback...", status="downloading")
-                    progress_cb = (
-                        (lambda pct, msg: report_job_progress(job_id, progress=pct, message=msg, status="downloading"))
-                        if job_id
-                        else None
-                    )
-                    filepath = download_via_api(api_data, progress_callback=progress_cb)
-                    if filepath and os.path.exists(filepath):
-                        report_job_progress(job_id, progress=100, message="Download ready", status="completed")
-                        return filepath
+                filepath = run_api()
+            else:
+                options = dict(ydl_opts)
+                if strategy == "cookies":
+                    options["cookiefile"] = "cookies.txt"
+                if not ffmpeg:
+                    options = without_ffmpeg(options)
+                filepath = run_download(options)
+        except (yt_dlp.utils.DownloadError, FileNotFoundError, RuntimeError) as exc:
+            # Only run_api signals a failed strategy with RuntimeError.
+            if isinstance(exc, RuntimeError) and strategy != "api":
                 raise
-            except FileNotFoundError as missing:
-                api_data = fetch_api_data(url)
-                if api_data:
-                    report_job_progress(job_id, progress=10, message="Switching to fallback...", status="downloading")
-                    progress_cb = (
-                        (lambda pct, msg: report_job_progress(job_id, progress=pct, message=msg, status="downloading"))
-                        if job_id
-                        else None
-                    )
-                    filepath = download_via_api(api_data, progress_callback=progress_cb)
-                    if filepath and os.path.exists(filepath):
-                        report_job_progress(job_id, progress=100, message="Download ready", status="completed")
-                        return filepath
-                raise RuntimeError(str(missing))
-        else:
-            api_data = fetch_api_data(url)
-            if api_data:
-                report_job_progress(job_id, progress=10, message="Switching to fallback...", status="downloading")
-                progress_cb = (
-                    (lambda pct, msg: report_job_progress(job_id, progress=pct, message=msg, status="downloading"))
-                    if job_id
-                    else None
-                )
-                filepath = download_via_api(api_data, progress_callback=progress_cb)
-                if filepath and os.path.exists(filepath):
-                    report_job_progress(job_id, progress=100, message="Download ready", status="completed")
-                    return filepath
-            raise error
-    except FileNotFoundError as missing:
+            # A video that is gone or private says nothing about the strategy.
+            if strategy == "api" or is_strategy_failure(exc):
+                _strategy_memory.record_failure(domain, strategy)
+            if isinstance(exc, FileNotFoundError):
+                DOWNLOAD_FALLBACKS.inc(branch="file_missing")
+            elif strategy == "cookies":
+                DOWNLOAD_FALLBACKS.inc(branch="cookie_failure")
+            elif strategy == "no_cookies" and has_cookies:
+                DOWNLOAD_FALLBACKS.inc(branch="no_cookie_retry")
+            print(f"Download via {strategy} failed for {domain or url}: {exc}")
+            last_error = exc
+            if strategy != "api":
+                ytdlp_error = exc
+            continue
+        _strategy_memory.record_success(domain, strategy)
+        report_job_progress(job_id, progress=100, message="Download ready", status="completed")
+        return filepath
+
+    # yt-dlp's message says more about the failure than the API's.
+    error = ytdlp_error or last_error
+    if isinstance(error, FileNotFoundError):
+        raise RuntimeError(str(error))
+    raise error or RuntimeError("No download strategy available")
+
+
+def offload_file(filepath: str) -> Response:
+    """Empty response telling the fronting web server to send ``filepath`` itself.
+
+    The server then handles Range, If-Range and ETag on its own. For nginx,
+    map ``ACCEL_REDIRECT_PREFIX`` to the downloads folder in an ``internal``
+    location.
+    """
+    filename = os.path.basename(filepath)
+    response = Response(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+    if FILE_OFFLOAD == "accel":
+        relative = os.path.relpath(filepath, os.path.abspath(DOWNLOAD_FOLDER)).replace(os.sep, "/")
+        response.headers["X-Accel-Redirect"] = ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative)
+    else:
+        response.headers["X-Sendfile"] = filepath
+    # Same header send_file would write, non-ASCII titles included.
+    fallback = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii").replace('"', "")
+    disposition = f'attachment; filename="{fallback}"'
+    if fallback != filename:
+        disposition += f"; filename*=UTF-8''{quote(filename, safe='')}"
+    response.headers["Content-Disposition"] = disposition
+    return response
+
+
+def use_sendfile_for_range(response: Response, filepath: str) -> None:
+    """Let gunicorn sendfile() a 206 body instead of copying it through Python.
+
+    werkzeug serves ranges through an iterator that gunicorn cannot hand to
+    the kernel. gunicorn sends a ``wsgi.file_wrapper`` with sendfile()
+    starting at the file's current offset and stops at Content-Length, so a
+    file positioned at the range start gives the same bytes.
+    """
+    wrapper = request.environ.get("wsgi.file_wrapper")
+    content_range = response.content_range
+    if response.status_code != 206 or wrapper is None or not content_range or content_range.start is None:
+        return
+    if not request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+        return
+    fh = open(filepath, "rb")
+    fh.seek(content_range.start)
+    ranged = response.response
+    response.response = wrapper(fh)
+    if hasattr(ranged, "close"):
+        ranged.close()
+
+
+def close_with(response: Response, callback: Callable[[], None]) -> None:
+    """Run ``callback`` once the server closes ``response``'s body.
+
+    send_file and direct_passthrough responses hand their body to the server
+    as is, so ``call_on_close`` never fires for them. A server file wrapper
+    is kept, with the callback chained to its ``close``, so it can still
+    sendfile() the body.
+    """
+    called = []
+
+    def _once() -> None:
+        if not called:
+            called.append(True)
+            callback()
+
+    body = response.response
+    wrapper = request.environ.get("wsgi.file_wrapper")
+    if isinstance(wrapper, type) and isinstance(body, wrapper):
+        close = getattr(body, "close", None)
+
+        def _close() -> None:
+            try:
+                if close is not None:
+                    close()
+            finally:
+                _once()
+
+        body.close = _close
+    else:
+        response.response = ClosingIterator(body, [_once])
+
+
+def serve_file(filepath: str) -> Response:
+    """send_file wrapper that keeps the file pinned until the response is closed.
+
+    GET and HEAD requests get Range, If-Range and ETag handling from
+    send_file, so clients can resume and seek.
+    """
+    filepath = os.path.abspath(filepath)
+    _storage.touch(filepath)
+    if FILE_OFFLOAD in ("accel", "sendfile"):
+        # The front server opens the file right after this response, so it
+        # is not pinned for the transfer; touch() keeps it last in the LRU.
+        return offload_file(filepath)
+    _storage.pin(filepath)
+    try:
+        response = send_file(filepath, as_attachment=True)
+        use_sendfile_for_range(response, filepath)
+        close_with(response, lambda: _storage.unpin(filepath))
+    except Exception:
+        _storage.unpin(filepath)
+        raise
+    return response
+
+
+def resolve_passthrough(url: str, selected_format: str) -> Optional[Tuple[str, Dict[str, str], str, str]]:
+    """Return ``(media_url, headers, filename, cache_key)`` if the format needs no muxing."""
+    if is_spotify_url(url):
+        return None
+
+    if selected_format == API_FORMAT_ID:
         api_data = fetch_api_data(url)
-        if api_data:
-            report_job_progress(job_id, progress=10, message="Switching to fallback...", status="downloading")
-            progress_cb = (
-                (lambda pct, msg: report_job_progress(job_id, progress=pct, message=msg, status="downloading"))
-                if job_id
-                else None
-            )
-            filepath = download_via_api(api_data, progress_callback=progress_cb)
-            if filepath and os.path.exists(filepath):
-                report_job_progress(job_id, progress=100, message="Download ready", status="completed")
-                return filepath
-        raise RuntimeError(str(missing))
+        if not api_data:
+            return None
+        key = download_cache_key(url, selected_format)
+        return api_data["url"], build_api_headers(api_data), api_filename(api_data), key
 
-    report_job_progress(job_id, progress=100, message="Download ready", status="completed")
-    return filepath
+    # "best" means bestvideo+bestaudio, which always goes through the merger.
+    if selected_format == "best":
+        return None
+
+    info = _preview_info_cache.get(normalize_url(url))
+    if info is None:
+        ydl_opts: Dict[str, Any] = {"quiet": True, "skip_download": True, "noplaylist": True}
+        if os.path.exists("cookies.txt"):
+            ydl_opts["cookiefile"] = "cookies.txt"
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl, EXTRACT_INFO_SECONDS.time():
+                info = ydl.extract_info(url, download=False)
+        except Exception as exc:
+            print(f"Passthrough extraction failed: {exc}")
+            return None
+        _preview_info_cache.set(normalize_url(url), info)
+
+    fmt = next((f for f in info.get("formats") or [] if f.get("format_id") == selected_format), None)
+    if not fmt or not fmt.get("url") or fmt.get("protocol") not in ("http", "https"):
+        return None
+    if fmt.get("acodec") == "none":
+        return None
+
+    filename = f"{sanitize_filename(info.get('title'))}(-by Alex).{fmt.get('ext') or 'mp4'}"
+    key = make_cache_key(url, selected_format, PASSTHROUGH_POSTPROCESSING)
+    return fmt["url"], dict(fmt.get("http_headers") or {}), filename, key
+
+
+def stream_passthrough(url: str, selected_format: str) -> Optional[Response]:
+    """Tee a single-file format straight into the response while caching it.
+
+    Returns ``None`` whenever the regular download-then-send path should be
+    used instead: the processed file is already cached, the format needs
+    muxing, or another request is already producing the same file.
+    """
+    if _download_cache.lookup(download_cache_key(url, selected_format)):
+        return None
+
+    target = resolve_passthrough(url, selected_format)
+    if not target:
+        return None
+    media_url, headers, filename, key = target
+
+    cached = _download_cache.lookup(key)
+    if cached:
+        return serve_file(cached)
+
+    # A producer in another worker holds the key's file lock; the regular
+    # path then waits for its file instead of writing the same .part.
+    flight = _download_cache.claim(key, across_processes=True)
+    if flight is None:
+        return None
+    cached = _download_cache.lookup(key)
+    if cached:
+        _download_cache.release(key, flight, result=cached)
+        return serve_file(cached)
+
+    output_dir = _download_cache.directory_for(key)
+
+    def _on_complete(path: str) -> None:
+        _download_cache.release(key, flight, result=path)
+        _storage.track(path)
+
+    _storage.pin(output_dir)
+    try:
+        stream = PassthroughStream(
+            media_url,
+            os.path.join(output_dir, filename),
+            headers=headers,
+            on_complete=_on_complete,
+            on_error=lambda exc: _download_cache.release(key, flight),
+        )
+    except Exception as exc:
+        print(f"Passthrough request failed: {exc}")
+        _download_cache.release(key, flight)
+        _storage.unpin(output_dir)
+        return None
+
+    response = Response(stream, mimetype=stream.content_type, direct_passthrough=True)
+    close_with(response, lambda: _storage.unpin(output_dir))
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if stream.content_length is not None:
+        response.headers["Content-Length"] = str(stream.content_length)
+    return response
+
+
+def form_flag(name: str) -> bool:
+    return (request.form.get(name) or "") not in ("", "0", "false", "False")
+
+
+def open_playlist(url: str) -> Playlist:
+    """Flat-extract ``url``, retrying without cookies like the single-video path."""
+    options: Dict[str, Any] = {}
+    if os.path.exists("cookies.txt"):
+        options["cookiefile"] = "cookies.txt"
+    try:
+        with EXTRACT_INFO_SECONDS.time():
+            return Playlist(url, options)
+    except Exception as exc:
+        if "cookiefile" not in options:
+            raise
+        print(f"Playlist extraction failed with cookies, retrying without... Error: {exc}")
+    with EXTRACT_INFO_SECONDS.time():
+        return Playlist(url)
+
+
+def download_playlist_files(playlist: Playlist, selected_format: str) -> Iterator[str]:
+    """Download the entries of ``playlist`` concurrently, yielding files as they finish.
+
+    Each file stays pinned until the consumer asks for the next one. Failed
+    entries are logged and skipped.
+    """
+    def _download(entry: Dict[str, Any]) -> str:
+        return perform_download(entry["url"], selected_format)
+
+    for entry, future in run_bounded(playlist, _download, workers=PLAYLIST_WORKERS):
+        try:
+            filepath = future.result()
+        except Exception as exc:
+            print(f"Playlist entry failed ({entry['title']}): {clean_error_message(str(exc))}")
+            continue
+        if not filepath or not os.path.exists(filepath):
+            print(f"Playlist entry failed ({entry['title']}): file missing")
+            continue
+        _storage.touch(filepath)
+        with _storage.pinned(filepath):
+            yield filepath
+
+
+def stream_playlist(url: str, selected_format: str) -> Tuple[Response, int]:
+    """Respond with a ZIP of every playlist entry, each added as soon as it is downloaded.
+
+    The response starts once the first entry is ready, so a playlist where
+    nothing downloads can still get an error status.
+    """
+    try:
+        playlist = open_playlist(url)
+    except Exception as exc:
+        return Response(clean_error_message(str(exc))), 500
+
+    files = download_playlist_files(playlist, selected_format)
+    try:
+        first = next(files, None)
+    except Exception as exc:
+        playlist.close()
+        return Response(clean_error_message(str(exc))), 500
+    if first is None:
+        playlist.close()
+        return Response("Failed to download any playlist entries"), 500
+
+    def _files() -> Iterator[str]:
+        yield first
+        yield from files
+
+    def _on_close() -> None:
+        # Stops queued entries and releases the pin when the client leaves early.
+        files.close()
+        playlist.close()
+
+    filename = f"{sanitize_filename(playlist.title or 'Playlist')}(-by Alex).zip"
+    response = Response(stream_zip(_files()), mimetype="application/zip", direct_passthrough=True)
+    close_with(response, _on_close)
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response.headers["X-Accel-Buffering"] = "no"
+    return response, 200
 
 
 @app.route("/download", methods=["POST"])
@@ -376,6 +1092,14 @@ def download():
 
     selected_format = request.form.get("format", "best")
 
+    if form_flag("playlist") and not is_spotify_url(url):
+        return stream_playlist(url, selected_format)
+
+    if STREAM_PASSTHROUGH:
+        streamed = stream_passthrough(url, selected_format)
+        if streamed is not None:
+            return streamed
+
     try:
         filepath = perform_download(url, selected_format, job_id=None)
     except yt_dlp.utils.DownloadError as err:
@@ -386,12 +1110,21 @@ def download():
     if not filepath or not os.path.exists(filepath):
         return "Download finished but file missing", 500
 
-    return send_file(filepath, as_attachment=True)
+    return serve_file(filepath)
 
 
-def process_download_job(job_id: str, url: str, selected_format: str) -> None:
+def process_download_job(
+    job_id: str,
+    url: str,
+    selected_format: str,
+    priority: int = 0,
+    client_id: Optional[str] = None,
+) -> None:
+    report_job_progress(job_id, progress=1, message="Preparing download...", status="starting")
     try:
-        filepath = perform_download(url, selected_format, job_id=job_id)
+        # The job's bandwidth share and its place in the post-processing queue.
+        with _shaper.flow(job_id, client_id, class_of(priority)), postprocess.job_priority(priority):
+            filepath = perform_download(url, selected_format, job_id=job_id)
         if filepath and os.path.exists(filepath):
             update_job(job_id, filepath=filepath)
             report_job_progress(job_id, progress=100, message="Download ready", status="completed")
@@ -403,6 +1136,119 @@ def process_download_job(job_id: str, url: str, selected_format: str) -> None:
         update_job(job_id, error=message)
 
 
+def run_dispatched_job(job: Dict[str, Any]) -> None:
+    process_download_job(
+        job["job_id"],
+        job["source_url"],
+        job.get("requested_format") or "best",
+        job.get("priority") or 0,
+        job.get("client_id"),
+    )
+
+
+def parse_priority(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def request_client_id() -> str:
+    """Who a request counts against for quotas and bandwidth: a known token, else its address."""
+    token = request.headers.get("X-Client-Token", "")
+    if token in CLIENT_TOKENS:
+        return "token:" + hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+    # With TRUST_PROXY, ProxyFix has already put the forwarded address here.
+    return f"ip:{request.remote_addr or 'unknown'}"
+
+
+def is_admin_request() -> bool:
+    supplied = request.headers.get("Authorization", "")
+    if not ADMIN_TOKEN or not supplied.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(supplied[7:].strip(), ADMIN_TOKEN)
+
+
+def request_priority(options: Any, server_class: str) -> int:
+    """Queue priority for a job the server put in ``server_class``.
+
+    Only clients with a ``CLIENT_TOKENS`` token or the admin token may pick
+    another class or a priority within it through the ``class`` and
+    ``priority`` fields; anyone could claim to be interactive otherwise.
+    """
+    if request.headers.get("X-Client-Token", "") not in CLIENT_TOKENS and not is_admin_request():
+        return job_priority(server_class)
+    priority_class = parse_priority_class(options.get("class"), server_class)
+    return job_priority(priority_class, parse_priority(options.get("priority")))
+
+
+def enqueue_download(
+    url: str,
+    selected_format: str,
+    priority: int = 0,
+    parent_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+) -> Tuple[Dict[str, Any], int]:
+    """Create a queued download job; returns the response payload and status code."""
+    fields = dict(
+        source_url=url,
+        requested_format=selected_format,
+        priority=priority,
+        parent_id=parent_id,
+        client_id=client_id,
+    )
+    if _dispatcher is not None:
+        if _job_store.queued_count() >= DOWNLOAD_QUEUE_SIZE:
+            return {"error": "Download queue is full, try again later"}, 429
+        if client_id and CLIENT_MAX_QUEUED and _job_store.queued_count(client_id) >= CLIENT_MAX_QUEUED:
+            return {"error": "Too many queued downloads for this client, try again later"}, 429
+        job_id = create_job(status="queued", **fields)
+        _dispatcher.wake()
+        position = _job_store.queue_position(job_id)
+        return {"jobId": job_id, "status": "queued", "queuePosition": position or 1}, 200
+
+    job_id = create_job()
+    update_job(job_id, status="queued", **fields)
+
+    try:
+        position = _scheduler.submit(
+            job_id,
+            process_download_job,
+            job_id,
+            url,
+            selected_format,
+            priority,
+            client_id,
+            priority=priority,
+            client=client_id,
+        )
+    except QueueFullError as exc:
+        delete_job(job_id)
+        return {"error": str(exc)}, 429
+
+    return {"jobId": job_id, "status": "queued", "queuePosition": position}, 200
+
+
+def request_urls() -> List[str]:
+    """URLs of a batch request: a JSON ``urls`` list, or ``url``/``urls`` form fields."""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        raw = data.get("urls") or []
+        if not isinstance(raw, list):
+            raw = [raw]
+    else:
+        raw = request.form.getlist("url") + (request.form.get("urls") or "").splitlines()
+    return [str(url).strip() for url in raw if str(url).strip()]
+
+
+def batch_request_error(urls: List[str]) -> Optional[Tuple[Response, int]]:
+    if not urls:
+        return jsonify({"error": "No URLs provided"}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({"error": f"Too many URLs (at most {BATCH_MAX_URLS} per batch)"}), 400
+    return None
+
+
 @app.route("/start_download", methods=["POST"])
 def start_download():
     url = (request.form.get("url") or "").strip()
@@ -410,35 +1256,226 @@ def start_download():
         return jsonify({"error": "URL is required"}), 400
 
     selected_format = request.form.get("format", "best")
-    job_id = create_job()
-    update_job(job_id, source_url=url, requested_format=selected_format)
-    report_job_progress(job_id, progress=1, message="Preparing download...", status="starting")
+    priority = request_priority(request.form, "interactive")
+    payload, status_code = enqueue_download(url, selected_format, priority, client_id=request_client_id())
+    return jsonify(payload), status_code
+
+
+@app.route("/start_download/batch", methods=["POST"])
+def start_download_batch():
+    """Queue one child job per URL under a parent job that tracks them all."""
+    urls = request_urls()
+    error = batch_request_error(urls)
+    if error:
+        return error
+
+    data = request.get_json(silent=True)
+    options = data if isinstance(data, dict) else request.form
+    selected_format = options.get("format") or "best"
+    priority = request_priority(options, "batch")
+    client_id = request_client_id()
+
+    parent_id = create_job(status="downloading", message=f"Queued {len(urls)} downloads")
+    children = []
+    for url in urls:
+        payload, status_code = enqueue_download(
+            url, selected_format, priority, parent_id=parent_id, client_id=client_id
+        )
+        children.append(dict(payload, url=url))
 
-    worker = threading.Thread(target=process_download_job, args=(job_id, url, selected_format), daemon=True)
-    worker.start()
+    queued = [child for child in children if "jobId" in child]
+    if not queued:
+        delete_job(parent_id)
+        return jsonify({"error": children[0].get("error"), "children": children}), 429
 
-    return jsonify({"jobId": job_id})
+    update_job(parent_id, items=[{"jobId": child["jobId"], "url": child["url"], "status": "queued"} for child in queued])
+    # Children that already finished before the parent listed them.
+    refresh_batch_job(parent_id)
+    return jsonify({"jobId": parent_id, "status": "downloading", "children": children})
 
 
-@app.route("/download_status/<job_id>")
-def download_status(job_id: str):
-    job = get_job(job_id)
-    if not job:
-        return jsonify({"error": "Invalid job id"}), 404
-
+def build_status_payload(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
     response = {
         "status": job.get("status", "pending"),
         "progress": job.get("progress", 0),
         "message": job.get("message") or "",
+        "version": job.get("version", 0),
     }
 
+    phase = JOB_PHASES.get(response["status"])
+    if phase:
+        response["phase"] = phase
+
     if job.get("error"):
         response["error"] = job["error"]
 
+    if job.get("status") == "queued":
+        if _dispatcher is not None:
+            position = _job_store.queue_position(job_id)
+        else:
+            position = _scheduler.position(job_id)
+        if position is not None:
+            response["queuePosition"] = position
+            response["message"] = f"Queued (position {position})"
+
+    if is_batch_job(job):
+        response["batch"] = True
+        response["items"] = [
+            dict(item, downloadUrl=url_for("download_file", job_id=item["jobId"]))
+            if item.get("status") == "completed"
+            else item
+            for item in job["items"]
+        ]
+    elif job.get("items"):
+        response["items"] = job["items"]
+
+    if job.get("bytes_done") is not None:
+        response["bytesDone"] = job["bytes_done"]
+        response["bytesTotal"] = job.get("bytes_total")
+        response["speed"] = job.get("speed")
+        response["eta"] = job.get("eta")
+
     if job.get("status") == "completed" and job.get("filepath"):
         response["downloadUrl"] = url_for("download_file", job_id=job_id)
 
-    return jsonify(response)
+    return response
+
+
+def is_terminal_status(payload: Dict[str, Any]) -> bool:
+    if payload.get("batch"):
+        return payload.get("status") in TERMINAL_STATUSES
+    return payload.get("status") == "error" or bool(payload.get("downloadUrl"))
+
+
+def requeue_interrupted_jobs() -> None:
+    batches = []
+    for job in _job_store.interrupted():
+        job_id = job["job_id"]
+        if is_batch_job(job):
+            # Follows its children, which are re-queued below.
+            batches.append(job_id)
+            continue
+        if not job.get("source_url"):
+            update_job(job_id, status="error", error="Interrupted by restart", message="Interrupted by restart")
+            continue
+        update_job(job_id, status="queued", progress=0, message="Re-queued after restart")
+        try:
+            _scheduler.submit(
+                job_id,
+                process_download_job,
+                job_id,
+                job["source_url"],
+                job.get("requested_format") or "best",
+                job.get("priority") or 0,
+                job.get("client_id"),
+                priority=job.get("priority") or 0,
+                client=job.get("client_id"),
+            )
+        except QueueFullError as exc:
+            update_job(job_id, status="error", error=str(exc), message=str(exc))
+    # Children may all have finished before the parent was last written.
+    for job_id in batches:
+        refresh_batch_job(job_id)
+
+
+@app.route("/metrics")
+def metrics():
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+def scheduler_snapshot() -> Dict[str, Any]:
+    """Running and queued jobs per client, with this process's bandwidth shares."""
+    flows = {flow["flow"]: flow for flow in _shaper.snapshot()}
+    clients: Dict[str, Dict[str, Any]] = {}
+    for job in _job_store.interrupted():
+        if is_batch_job(job):
+            continue
+        client = job.get("client_id") or "unknown"
+        entry = clients.setdefault(client, {"client": client, "running": 0, "queued": 0, "bandwidth": 0, "jobs": []})
+        entry["queued" if job.get("status") == "queued" else "running"] += 1
+        flow = flows.get(job["job_id"])
+        rate = flow["rate"] if flow else None
+        entry["bandwidth"] += rate or 0
+        entry["jobs"].append(
+            {
+                "jobId": job["job_id"],
+                "status": job.get("status"),
+                "class": class_of(job.get("priority") or 0),
+                "priority": job.get("priority") or 0,
+                "rate": rate,
+                "url": job.get("source_url"),
+            }
+        )
+    pool = postprocess.get_pool()
+    return {
+        "limits": {
+            "clientMaxActive": CLIENT_MAX_ACTIVE or None,
+            "clientMaxQueued": CLIENT_MAX_QUEUED or None,
+            "bandwidth": _shaper.limit or None,
+            "clientBandwidth": _shaper.client_limit or None,
+        },
+        "downloads": {
+            "workers": DOWNLOAD_WORKERS,
+            "reservedForInteractive": _scheduler.reserved_workers,
+            "active": _scheduler.active_count(),
+            "queued": _queued_jobs(),
+        },
+        "postprocess": {"workers": pool.workers, "active": pool.active_count(), "queued": pool.queue_depth()},
+        "clients": sorted(clients.values(), key=lambda entry: (-entry["running"], -entry["queued"], entry["client"])),
+    }
+
+
+@app.route("/admin/scheduler")
+def admin_scheduler():
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(scheduler_snapshot())
+
+
+@app.route("/download_status/<job_id>")
+def download_status(job_id: str):
+    since = request.args.get("since", type=int)
+    if since is not None:
+        wait = min(request.args.get("wait", default=STATUS_LONG_POLL_MAX, type=float), STATUS_LONG_POLL_MAX)
+        job = wait_for_job_change(job_id, since, wait)
+    else:
+        job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Invalid job id"}), 404
+
+    return jsonify(build_status_payload(job_id, job))
+
+
+@app.route("/download_events/<job_id>")
+def download_events(job_id: str):
+    if not get_job(job_id):
+        return jsonify({"error": "Invalid job id"}), 404
+
+    def _stream():
+        version = -1
+        last_payload = None
+        while True:
+            job = wait_for_job_change(job_id, version, STATUS_STREAM_HEARTBEAT)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Invalid job id'})}\n\n"
+                return
+            version = job.get("version", 0)
+            payload = build_status_payload(job_id, job)
+            if payload != last_payload:
+                last_payload = payload
+                yield f"data: {json.dumps(payload)}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+            if is_terminal_status(payload):
+                return
+
+    return Response(
+        stream_with_context(_stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/download_file/<job_id>")
@@ -454,7 +1491,7 @@ def download_file(job_id: str):
     if not filepath or not os.path.exists(filepath):
         return "File not found", 404
 
-    return send_file(filepath, as_attachment=True)
+    return serve_file(filepath)
 
 
 def clean_error_message(error_str):
@@ -462,23 +1499,37 @@ def clean_error_message(error_str):
     return ansi_escape.sub("", error_str)
 
 
-@app.route("/video_info", methods=["POST"])
-def video_info():
-    url = request.form.get("url")
-    if not url:
-        return jsonify({"error": "No URL provided"}), 400
+def extract_video_info(url: str) -> Tuple[Dict[str, Any], int]:
+    if is_spotify_url(url) and is_collection_url(url):
+        try:
+            collection = get_collection(url)
+        except Exception as exc:
+            return {"error": clean_error_message(str(exc))}, 500
+        if not collection:
+            return {"error": "Failed to fetch Spotify tracklist"}, 500
+        return (
+            {
+                "title": collection["title"],
+                "thumbnail": collection.get("thumbnail"),
+                "formats": [],
+                "isSpotify": True,
+                "trackCount": len(collection["tracks"]),
+            },
+            200,
+        )
 
     if is_spotify_url(url):
         metadata = get_track_metadata(url)
         if not metadata:
-            return jsonify({"error": "Failed to fetch Spotify metadata"}), 500
-        return jsonify(
+            return {"error": "Failed to fetch Spotify metadata"}, 500
+        return (
             {
                 "title": metadata["title"],
                 "thumbnail": metadata.get("thumbnail"),
                 "formats": [],
                 "isSpotify": True,
-            }
+            },
+            200,
         )
 
     ydl_opts = {
@@ -494,7 +1545,7 @@ def video_info():
     last_error = None
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl, EXTRACT_INFO_SECONDS.time():
             info = ydl.extract_info(url, download=False)
     except Exception as exc:
         last_error = exc
@@ -502,12 +1553,14 @@ def video_info():
             try:
                 opts_no_cookie = dict(ydl_opts)
                 opts_no_cookie.pop("cookiefile", None)
-                with yt_dlp.YoutubeDL(opts_no_cookie) as ydl_no_cookie:
+                with yt_dlp.YoutubeDL(opts_no_cookie) as ydl_no_cookie, EXTRACT_INFO_SECONDS.time():
                     info = ydl_no_cookie.extract_info(url, download=False)
             except Exception as exc_no_cookie:
                 last_error = exc_no_cookie
 
     if info:
+        _preview_info_cache.set(normalize_url(url), info)
+
         def get_fmt_size(fmt):
             size = fmt.get("filesize") or fmt.get("filesize_approx")
             return format_size(size)
@@ -548,28 +1601,131 @@ def video_info():
             if api_data:
                 formats_list.append({"id": API_FORMAT_ID, "label": "Direct MP4 (API fallback)"})
 
-        return jsonify(
+        return (
             {
                 "title": info.get("title"),
                 "thumbnail": info.get("thumbnail"),
                 "formats": formats_list,
-            }
+            },
+            200,
         )
 
     api_data = fetch_api_data(url)
     if api_data:
-        return jsonify(
+        return (
             {
                 "title": api_data.get("title"),
                 "thumbnail": api_data.get("thumbnail"),
                 "formats": [{"id": API_FORMAT_ID, "label": "Direct MP4 (API fallback)"}],
                 "apiFallback": True,
-            }
+            },
+            200,
         )
 
     error_msg = clean_error_message(str(last_error)) if last_error else "Unknown error"
     print(f"Error extracting info: {error_msg}")
-    return jsonify({"error": error_msg}), 500
+    return {"error": error_msg}, 500
+
+
+def extract_playlist_info(url: str) -> Tuple[Dict[str, Any], int]:
+    try:
+        playlist = open_playlist(url)
+    except Exception as exc:
+        return {"error": clean_error_message(str(exc))}, 500
+    try:
+        entries = list(playlist)
+    except Exception as exc:
+        return {"error": clean_error_message(str(exc))}, 500
+    finally:
+        playlist.close()
+    if not entries:
+        return {"error": "Playlist has no entries"}, 500
+    return (
+        {
+            "title": playlist.title,
+            "thumbnail": playlist.thumbnail,
+            "formats": [{"id": "best", "label": "Best Quality (Auto)"}],
+            "isPlaylist": playlist.is_playlist,
+            "entryCount": len(entries),
+            "entryLimit": playlist.limit,
+            "entries": entries,
+        },
+        200,
+    )
+
+
+def lookup_video_info(url: str, playlist: bool = False) -> Tuple[Dict[str, Any], int]:
+    """extract_video_info (or extract_playlist_info) through the preview cache, failures included."""
+    playlist = playlist and not is_spotify_url(url)
+    cache_key = ("playlist:" if playlist else "") + normalize_url(url)
+    found, _, cached = _video_info_cache.lookup(cache_key)
+    if found:
+        return cached
+
+    try:
+        payload, status_code = extract_playlist_info(url) if playlist else extract_video_info(url)
+    except Exception as exc:
+        payload, status_code = {"error": clean_error_message(str(exc))}, 500
+    if status_code == 200:
+        _video_info_cache.set(cache_key, (payload, status_code))
+    else:
+        _video_info_cache.set_negative(cache_key, (payload, status_code))
+    return payload, status_code
+
+
+@app.route("/video_info", methods=["POST"])
+def video_info():
+    url = (request.form.get("url") or "").strip()
+    if not url:
+        return jsonify({"error": "No URL provided"}), 400
+
+    payload, status_code = lookup_video_info(url, playlist=form_flag("playlist"))
+    return jsonify(payload), status_code
+
+
+@app.route("/video_info/batch", methods=["POST"])
+def video_info_batch():
+    """Preview many URLs at once, streaming one JSON line per URL as it resolves.
+
+    Each line carries the URL's ``index`` in the request, the ``url`` and the
+    ``statusCode`` that ``/video_info`` would have answered with, alongside
+    the usual payload. Lines arrive in completion order.
+    """
+    urls = request_urls()
+    error = batch_request_error(urls)
+    if error:
+        return error
+
+    def _line(index: int, url: str, result: Tuple[Dict[str, Any], int]) -> str:
+        payload, status_code = result
+        return json.dumps(dict(payload, index=index, url=url, statusCode=status_code)) + "\n"
+
+    def _stream():
+        pending: Dict[str, Any] = {}
+        waiting: Dict[Any, List[Tuple[int, str]]] = {}
+        for index, url in enumerate(urls):
+            found, _, cached = _video_info_cache.lookup(normalize_url(url))
+            if found:
+                yield _line(index, url, cached)
+                continue
+            # Duplicate URLs in one batch share a single extraction.
+            future = pending.get(normalize_url(url))
+            if future is None:
+                future = pending[normalize_url(url)] = _batch_info_executor.submit(lookup_video_info, url)
+            waiting.setdefault(future, []).append((index, url))
+        try:
+            for future in as_completed(waiting):
+                for index, url in waiting[future]:
+                    yield _line(index, url, future.result())
+        finally:
+            for future in waiting:
+                future.cancel()
+
+    return Response(
+        stream_with_context(_stream()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/spotify", methods=["POST"])
@@ -578,13 +1734,58 @@ def spotify_download():
     if not spotify_url:
         return "No Spotify URL provided", 400
 
-    query = get_track_info(spotify_url)
-    if query:
-        filepath = download_from_youtube(query)
-        if os.path.exists(filepath):
-            return send_file(filepath, as_attachment=True)
-        return render_template("index.html", message="Failed to locate Spotify download")
-    return render_template("index.html", message="Failed to download Spotify song")
+    try:
+        filepath = perform_download(spotify_url, "best")
+    except Exception as exc:
+        print(f"Spotify download failed: {exc}")
+        return render_template("index.html", message="Failed to download Spotify song")
+    if filepath and os.path.exists(filepath):
+        return serve_file(filepath)
+    return render_template("index.html", message="Failed to locate Spotify download")
+
+
+def start_background_work() -> None:
+    """Start this process's job dispatcher, storage sweeper and ffmpeg install, once."""
+    global _background_pid, _dispatcher
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    if SHARED_JOBS:
+        # Jobs of a crashed worker come back through lease expiry instead.
+        _dispatcher = JobDispatcher(
+            _job_store,
+            _scheduler,
+            run_dispatched_job,
+            poll_interval=DISPATCH_POLL_INTERVAL,
+            client_limit=CLIENT_MAX_ACTIVE,
+        )
+        _dispatcher.start()
+    else:
+        requeue_interrupted_jobs()
+    _storage.start_sweeper(STORAGE_SWEEP_INTERVAL)
+    start_ffmpeg_install()
+    if PREWARM_YT_DLP:
+        yt_dlp.prewarm()
+
+
+@app.before_request
+def ensure_background_work() -> None:
+    if _background_pid != os.getpid():
+        start_background_work()
+
+
+# Under the debug reloader only the serving child process resumes jobs.
+# Post-processing workers re-import the main script as __mp_main__; they must
+# not start a dispatcher or sweeper of their own. gunicorn may import the app
+# in its master and fork the workers from it (--preload), and threads do not
+# survive a fork, so there each worker starts its own on its first request.
+if (
+    __name__ != "__mp_main__"
+    and (__name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true")
+    and not os.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn")
+):
+    start_background_work()
 
 
 if __name__ == "__main__":
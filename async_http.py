@@ -0,0 +1,277 @@
+import asyncio
+import os
+import ssl
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+from urllib.parse import urljoin, urlsplit
+
+from requests.utils import default_user_agent
+
+from http_client import HTTP_RETRIES, HTTP_RETRY_BACKOFF
+
+# "asyncio" multiplexes direct downloads on one event-loop thread; "threads"
+# keeps the previous requests-based thread-per-connection transfers.
+TRANSFER_ENGINE = os.environ.get("TRANSFER_ENGINE", "asyncio").strip().lower()
+ASYNC_READ_CHUNK = int(os.environ.get("ASYNC_READ_CHUNK", 256 * 1024))
+ASYNC_WRITE_BUFFER = int(os.environ.get("ASYNC_WRITE_BUFFER", 1024 * 1024))
+ASYNC_WRITE_THREADS = int(os.environ.get("ASYNC_WRITE_THREADS", 2))
+MAX_REDIRECTS = 5
+MAX_HEADER_BYTES = 64 * 1024
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+T = TypeVar("T")
+
+# Direct transfers cost a socket and a buffer on this one loop instead of a
+# blocked thread each. File writes and progress callbacks leave the loop
+# through two small fixed pools, so neither the disk nor the job registry
+# can stall the other transfers.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_writer = ThreadPoolExecutor(max_workers=max(1, ASYNC_WRITE_THREADS), thread_name_prefix="transfer-write")
+# One thread, so callbacks for a transfer arrive in order.
+_bridge = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transfer-progress")
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+class HTTPError(IOError):
+    def __init__(self, status: int, reason: str, url: str) -> None:
+        super().__init__(f"{status} {reason} for url: {url}")
+        self.status = status
+
+
+def is_enabled(url: str) -> bool:
+    """Whether ``url`` goes through the event loop rather than requests.
+
+    Proxied URLs stay on requests, which knows how to use the proxy.
+    """
+    if TRANSFER_ENGINE != "asyncio":
+        return False
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    proxies = urllib.request.getproxies()
+    return not (proxies.get(parts.scheme) or proxies.get("all")) or bool(urllib.request.proxy_bypass(parts.hostname))
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="transfer-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Run ``coro`` on the shared loop and wait for its result."""
+    loop = _get_loop()
+    future = asyncio.run_coroutine_threadsafe(coro, loop)  # type: ignore[arg-type]
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+async def write_at(fd: int, data: bytes, offset: int) -> None:
+    """``os.pwrite`` all of ``data`` from the writer pool."""
+    loop = asyncio.get_running_loop()
+    view = memoryview(data)
+    while view:
+        written = await loop.run_in_executor(_writer, os.pwrite, fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def bridge(callback: Callable[..., Any], *args: Any) -> None:
+    _bridge.submit(callback, *args)
+
+
+def wait_for_bridge() -> None:
+    """Block until every progress callback queued so far has run."""
+    _bridge.submit(lambda: None).result()
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    global _ssl_context
+    if _ssl_context is None:
+        try:
+            import certifi
+
+            _ssl_context = ssl.create_default_context(cafile=certifi.where())
+        except ImportError:
+            _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+class Response:
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        reason: str,
+        headers: Dict[str, str],
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        timeout: float,
+    ) -> None:
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+
+    @property
+    def content_length(self) -> Optional[int]:
+        value = self.headers.get("content-length")
+        if value is None or "chunked" in self.headers.get("transfer-encoding", "").lower():
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return None
+
+    async def _read(self, size: int) -> bytes:
+        return await asyncio.wait_for(self._reader.read(size), self._timeout)
+
+    async def iter_chunks(self, size: int = ASYNC_READ_CHUNK) -> AsyncIterator[bytes]:
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            async for chunk in self._iter_chunked(size):
+                yield chunk
+            return
+        remaining = self.content_length
+        while remaining is None or remaining > 0:
+            data = await self._read(size if remaining is None else min(size, remaining))
+            if not data:
+                if remaining:
+                    raise IOError(f"Connection closed with {remaining} bytes left")
+                return
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+    async def _iter_chunked(self, size: int) -> AsyncIterator[bytes]:
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(), self._timeout)
+            if not line:
+                raise IOError("Connection closed inside a chunked body")
+            length = int(line.split(b";", 1)[0].strip() or b"0", 16)
+            if length == 0:
+                return
+            while length > 0:
+                data = await self._read(min(size, length))
+                if not data:
+                    raise IOError("Connection closed inside a chunk")
+                length -= len(data)
+                yield data
+            await asyncio.wait_for(self._reader.readexactly(2), self._timeout)
+
+    def close(self) -> None:
+        self._writer.close()
+
+    async def __aenter__(self) -> "Response":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+async def _send(url: str, headers: Dict[str, str], timeout: float) -> Response:
+    parts = urlsplit(url)
+    secure = parts.scheme == "https"
+    port = parts.port or (443 if secure else 80)
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(
+            parts.hostname,
+            port,
+            ssl=_get_ssl_context() if secure else None,
+            server_hostname=parts.hostname if secure else None,
+            limit=max(ASYNC_READ_CHUNK, MAX_HEADER_BYTES),
+        ),
+        timeout,
+    )
+    try:
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        host = parts.hostname if parts.port is None else f"{parts.hostname}:{parts.port}"
+        if ":" in (parts.hostname or ""):
+            host = f"[{parts.hostname}]" + (f":{parts.port}" if parts.port else "")
+        # Same default agent as the requests engine, so servers see no difference.
+        defaults = {"User-Agent": default_user_agent(), "Accept": "*/*", "Accept-Encoding": "identity"}
+        merged = {name.lower(): (name, value) for name, value in defaults.items()}
+        merged.update((name.lower(), (name, value)) for name, value in headers.items())
+        # One request per connection: ranges already get a connection each.
+        merged["host"] = ("Host", host)
+        merged["connection"] = ("Connection", "close")
+        lines = [f"GET {target} HTTP/1.1"] + [f"{name}: {value}" for name, value in merged.values()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await asyncio.wait_for(writer.drain(), timeout)
+
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        version, status, *reason = status_line.split(" ", 2)
+        if not version.startswith("HTTP/"):
+            raise IOError(f"Malformed status line from {parts.hostname}: {status_line!r}")
+        response_headers: Dict[str, str] = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                name = name.strip().lower()
+                value = value.strip()
+                # Repeated headers are joined as in RFC 9110; only a few matter here.
+                response_headers[name] = f"{response_headers[name]}, {value}" if name in response_headers else value
+        return Response(url, int(status), reason[0] if reason else "", response_headers, reader, writer, timeout)
+    except BaseException:
+        writer.close()
+        raise
+
+
+async def open_url(url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 60) -> Response:
+    """GET ``url``, following redirects and retrying like ``http_client``.
+
+    Connection errors and 429/5xx answers are retried ``HTTP_RETRIES``
+    times with exponential backoff; other error statuses raise
+    ``HTTPError``. The caller owns the returned response and must close it.
+    """
+    headers = dict(headers or {})
+    attempt = 0
+    redirects = 0
+    while True:
+        try:
+            response = await _send(url, headers, timeout)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as exc:
+            if attempt >= HTTP_RETRIES:
+                raise IOError(f"Request to {url} failed: {exc}") from exc
+            attempt += 1
+            await asyncio.sleep(HTTP_RETRY_BACKOFF * 2 ** (attempt - 1))
+            continue
+
+        if response.status in _REDIRECT_STATUSES and response.headers.get("location"):
+            response.close()
+            redirects += 1
+            if redirects > MAX_REDIRECTS:
+                raise IOError(f"Too many redirects for {url}")
+            target = urljoin(url, response.headers["location"])
+            if urlsplit(target).netloc != urlsplit(url).netloc:
+                headers.pop("Authorization", None)
+                headers.pop("Cookie", None)
+            url = target
+            continue
+        if response.status in _RETRY_STATUSES and attempt < HTTP_RETRIES:
+            response.close()
+            attempt += 1
+            retry_after = response.headers.get("retry-after", "")
+            delay = float(retry_after) if retry_after.isdigit() else HTTP_RETRY_BACKOFF * 2 ** (attempt - 1)
+            await asyncio.sleep(delay)
+            continue
+        if response.status >= 400:
+            response.close()
+            raise HTTPError(response.status, response.reason, url)
+        return response
+
@@ -0,0 +1,225 @@
+"""Local stand-ins for everything the app talks to over the network.
+
+One threaded HTTP server provides:
+
+* ``/media/<name>``: deterministic media bytes. ``?size=`` sets the size in
+  bytes and ``?rate=`` limits each connection to that many bytes per second.
+  Single byte ranges, ETag and Last-Modified are supported.
+* ``/watch/<id>``: an HTML page with a ``<video>`` tag for yt-dlp's generic
+  extractor.
+* ``/playlist/<id>``: an RSS feed of ``?count=`` (default 8) ``/watch``
+  pages, which the generic extractor treats as a playlist.
+* ``/info``: the nubcoder ``/info`` API, pointing at ``/media``.
+* ``/oembed``: Spotify's oEmbed endpoint.
+
+Anything else (including the ffmpeg release archive) answers 404.
+
+    python benchmarks/fake_services.py --port 8765
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from email.utils import formatdate
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, quote, urlparse
+
+DEFAULT_MEDIA_SIZE = 8 * 1024 * 1024
+WRITE_CHUNK = 64 * 1024
+LAST_MODIFIED = formatdate(0, usegmt=True)
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+_PATTERN = bytes(range(256)) * (WRITE_CHUNK // 256)
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    match = _RANGE_RE.match((header or "").strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeServices"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False) -> None:
+        parsed = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        if parsed.path.startswith("/media/"):
+            self._media(parsed.path, query, head)
+        elif parsed.path.startswith("/watch/"):
+            self._watch(parsed.path.rsplit("/", 1)[-1], query)
+        elif parsed.path.startswith("/playlist/"):
+            self._playlist(parsed.path.rsplit("/", 1)[-1], query)
+        elif parsed.path == "/info":
+            self._info(query)
+        elif parsed.path == "/oembed":
+            self._oembed(query)
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload: dict) -> None:
+        self._send(200, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _media(self, path: str, query: dict, head: bool) -> None:
+        size = int(query.get("size") or self.server.media_size)
+        rate = float(query.get("rate") or self.server.rate)
+        etag = '"' + hashlib.md5(f"{path}:{size}".encode("utf-8")).hexdigest() + '"'
+        try:
+            byte_range = _parse_range(self.headers.get("Range"), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if byte_range and self.headers.get("If-Range") not in (None, etag, LAST_MODIFIED):
+            byte_range = None
+        start, end = byte_range or (0, size - 1)
+
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", "video/mp4" if path.endswith(".mp4") else "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head:
+            return
+
+        started = time.monotonic()
+        sent = 0
+        position = start
+        try:
+            while position <= end:
+                offset = position % 256
+                count = min(WRITE_CHUNK - offset, end - position + 1)
+                self.wfile.write(_PATTERN[offset:offset + count])
+                position += count
+                sent += count
+                if rate > 0:
+                    delay = sent / rate - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _watch(self, video_id: str, query: dict) -> None:
+        media = f"/media/{quote(video_id)}.mp4"
+        if query:
+            media += "?" + "&".join(f"{key}={quote(str(value))}" for key, value in query.items())
+        body = (
+            "<!DOCTYPE html><html><head>"
+            f"<title>Benchmark clip {video_id}</title>"
+            f'<meta property="og:title" content="Benchmark clip {video_id}">'
+            "</head><body>"
+            f'<video controls><source src="{media}" type="video/mp4"></video>'
+            "</body></html>"
+        )
+        self._send(200, body.encode("utf-8"), "text/html; charset=utf-8")
+
+    def _playlist(self, playlist_id: str, query: dict) -> None:
+        count = int(query.pop("count", None) or 8)
+        suffix = "?" + "&".join(f"{key}={quote(str(value))}" for key, value in query.items()) if query else ""
+        items = "".join(
+            f"<item><title>Benchmark clip {playlist_id}-{index}</title>"
+            f"<link>{self.server.base_url}/watch/{quote(playlist_id)}-{index}{escape(suffix)}</link></item>"
+            for index in range(count)
+        )
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+            f"<title>Benchmark playlist {playlist_id}</title>{items}</channel></rss>"
+        )
+        self._send(200, body.encode("utf-8"), "application/rss+xml")
+
+    def _info(self, query: dict) -> None:
+        target = query.get("q") or ""
+        video_id = hashlib.sha1(target.encode("utf-8")).hexdigest()[:12]
+        self._send_json(
+            {
+                "url": f"{self.server.base_url}/media/{video_id}.mp4",
+                "title": f"Benchmark clip {video_id}",
+                "video_id": video_id,
+                "thumbnail": None,
+            }
+        )
+
+    def _oembed(self, query: dict) -> None:
+        track = (query.get("url") or "").rstrip("/").rsplit("/", 1)[-1]
+        self._send_json({"title": f"Benchmark Artist - Track {track}", "thumbnail_url": None})
+
+
+class FakeServices(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections once a run opens hundreds at once.
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, media_size: int = DEFAULT_MEDIA_SIZE, rate: float = 0) -> None:
+        super().__init__(("127.0.0.1", port), FakeServiceHandler)
+        self.media_size = int(media_size)
+        self.rate = float(rate)
+        self._thread: Optional[threading.Thread] = None
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients drop idle keep-alive connections; that is not an error here.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakeServices":
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--media-size", type=int, default=DEFAULT_MEDIA_SIZE, help="default media size in bytes")
+    parser.add_argument("--rate", type=float, default=0, help="per-connection bytes/s limit (0 = unlimited)")
+    args = parser.parse_args()
+    services = FakeServices(args.port, args.media_size, args.rate)
+    print(f"Serving fake services on {services.base_url}")
+    try:
+        services.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
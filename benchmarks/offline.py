@@ -0,0 +1,316 @@
+"""Offline load benchmark for the download and job paths.
+
+Starts the stand-ins from ``fake_services.py`` and, for every scenario and
+concurrency level, a fresh interpreter that imports ``app`` in an empty
+working directory with the nubcoder API, Spotify oEmbed and ffmpeg download
+pointed at them. No request leaves the machine. Each run reports
+operations per second, transfer throughput, p50/p99 latency and the peak
+RSS of the process that ran the app.
+
+    python benchmarks/offline.py --concurrency 1,4,16 --requests 32
+    python benchmarks/offline.py --scenarios jobs --media-size 33554432 --rate 4194304
+    TRANSFER_ENGINE=threads python benchmarks/offline.py --scenarios download_via_api
+
+Scenarios:
+
+* ``download_via_api``: the nubcoder fallback, ``fetch_api_data`` plus the
+  segmented download.
+* ``perform_download``: yt-dlp's generic extractor and download through the
+  cache, without the job machinery.
+* ``video_info`` and ``video_info_spotify``: ``POST /video_info`` for a page
+  and for a Spotify track (oEmbed).
+* ``jobs``: ``POST /start_download``, long-polling ``/download_status`` and
+  ``GET /download_file``, failing if the served file stays pinned.
+* ``playlist``: ``POST /download`` in playlist mode for a four-entry feed,
+  reading the streamed ZIP.
+* ``fair_share``: the ``jobs`` round trip for small interactive downloads,
+  each from its own client address, after four other clients queued
+  ``BULK_JOBS`` batch-class downloads of eight times the media size, with
+  ``CLIENT_MAX_ACTIVE=2`` unless set. Run with ``BANDWIDTH_LIMIT`` set to
+  see the bandwidth shares at work.
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_services import DEFAULT_MEDIA_SIZE, FakeServices  # noqa: E402
+
+SCENARIOS = (
+    "download_via_api",
+    "perform_download",
+    "video_info",
+    "video_info_spotify",
+    "jobs",
+    "playlist",
+    "fair_share",
+)
+BULK_JOBS = 16
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)]
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def build_operation(name: str, base_url: str, media_size: int = DEFAULT_MEDIA_SIZE) -> Callable[[int], int]:
+    """The scenario's unit of work; returns the number of bytes it produced."""
+    import app
+
+    client = app.app.test_client()
+
+    def download_via_api(index: int) -> int:
+        api_data = app.fetch_api_data(f"{base_url}/watch/api-{index}")
+        if not api_data:
+            raise RuntimeError("fake /info returned nothing")
+        output_dir = tempfile.mkdtemp(dir=app.DOWNLOAD_FOLDER)
+        filepath = app.download_via_api(api_data, output_dir=output_dir)
+        if not filepath:
+            raise RuntimeError("download_via_api failed")
+        return os.path.getsize(filepath)
+
+    def perform_download(index: int) -> int:
+        return os.path.getsize(app.perform_download(f"{base_url}/watch/pd-{index}", "best"))
+
+    def video_info(index: int) -> int:
+        response = client.post("/video_info", data={"url": f"{base_url}/watch/vi-{index}"})
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json())
+        return 0
+
+    def video_info_spotify(index: int) -> int:
+        track_id = f"bench{index:017d}"
+        response = client.post("/video_info", data={"url": f"https://open.spotify.com/track/{track_id}"})
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json())
+        return 0
+
+    def run_job(url: str, remote_addr: str = "127.0.0.1") -> int:
+        response = client.post("/start_download", data={"url": url}, environ_base={"REMOTE_ADDR": remote_addr})
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json())
+        job_id = response.get_json()["jobId"]
+        version = -1
+        while True:
+            status = client.get(f"/download_status/{job_id}?since={version}&wait=10").get_json()
+            if status.get("status") == "error":
+                raise RuntimeError(status.get("error"))
+            if status.get("downloadUrl"):
+                break
+            version = status.get("version", version)
+        response = client.get(f"/download_file/{job_id}")
+        size = len(response.get_data())
+        response.close()
+        # A pin left behind would keep the file from ever being evicted.
+        if app._storage.is_pinned(app.get_job(job_id)["filepath"]):
+            raise RuntimeError("Served file is still pinned after the response closed")
+        return size
+
+    def jobs(index: int) -> int:
+        return run_job(f"{base_url}/watch/job-{index}")
+
+    bulk_lock = threading.Lock()
+    bulk_submitted = []
+
+    def submit_bulk_jobs() -> None:
+        # The batch endpoint is what makes them batch-class jobs.
+        for owner in range(4):
+            urls = [f"{base_url}/watch/bulk-{index}?size={media_size * 8}" for index in range(owner, BULK_JOBS, 4)]
+            response = client.post(
+                "/start_download/batch",
+                json={"urls": urls},
+                environ_base={"REMOTE_ADDR": f"10.0.0.{owner + 1}"},
+            )
+            if response.status_code != 200:
+                raise RuntimeError(response.get_json())
+
+    def fair_share(index: int) -> int:
+        # The load starts with the first timed operation, after the warmup.
+        if index >= 0:
+            with bulk_lock:
+                if not bulk_submitted:
+                    submit_bulk_jobs()
+                    bulk_submitted.append(True)
+        return run_job(f"{base_url}/watch/small-{index}", f"10.1.{index // 250 % 250}.{index % 250 + 1}")
+
+    def playlist(index: int) -> int:
+        response = client.post("/download", data={"url": f"{base_url}/playlist/pl-{index}?count=4", "playlist": "1"})
+        if response.status_code != 200:
+            raise RuntimeError(response.get_data(as_text=True))
+        size = len(response.get_data())
+        response.close()
+        return size
+
+    return {
+        "download_via_api": download_via_api,
+        "perform_download": perform_download,
+        "video_info": video_info,
+        "video_info_spotify": video_info_spotify,
+        "jobs": jobs,
+        "playlist": playlist,
+        "fair_share": fair_share,
+    }[name]
+
+
+def run_child(args: argparse.Namespace) -> Dict[str, Any]:
+    operation = build_operation(args.scenario, args.base_url, args.media_size)
+    for index in range(args.warmup):
+        operation(-1 - index)
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    transferred = [0]
+    lock = threading.Lock()
+
+    def _timed(index: int) -> None:
+        started = time.perf_counter()
+        try:
+            size = operation(index)
+        except Exception as exc:
+            with lock:
+                errors.append(str(exc))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            transferred[0] += size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(_timed, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    return {
+        "scenario": args.scenario,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_seconds": wall,
+        "ops_per_second": len(latencies) / wall if wall else 0.0,
+        "bytes_per_second": transferred[0] / wall if wall else 0.0,
+        "p50_seconds": percentile(latencies, 50),
+        "p99_seconds": percentile(latencies, 99),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def run_scenario(services: FakeServices, scenario: str, concurrency: int, args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as workdir:
+        output = os.path.join(workdir, "result.json")
+        log_path = os.path.join(workdir, "child.log")
+        env = dict(os.environ)
+        env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+        env["NUBCODER_API_URL"] = services.base_url
+        env["SPOTIFY_OEMBED_URL"] = f"{services.base_url}/oembed"
+        # No ffmpeg: the install attempt gets a 404 from the fake server.
+        env["FFMPEG_URL"] = f"{services.base_url}/ffmpeg-release-amd64-static.tar.xz"
+        env["FFMPEG_CACHE_DIR"] = os.path.join(workdir, "ffmpeg-cache")
+        env["DOWNLOAD_QUEUE_SIZE"] = str(max(100, args.requests))
+        if scenario == "fair_share":
+            env.setdefault("CLIENT_MAX_ACTIVE", "2")
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--child",
+            "--scenario", scenario,
+            "--base-url", services.base_url,
+            "--concurrency", str(concurrency),
+            "--requests", str(args.requests),
+            "--warmup", str(args.warmup),
+            "--media-size", str(args.media_size),
+            "--output", output,
+        ]
+        # Output goes to a file: post-processing workers inherit the child's
+        # stdout, so a pipe would not see EOF until they exit too.
+        with open(log_path, "w+", encoding="utf-8") as log:
+            returncode = subprocess.run(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+            if returncode != 0:
+                log.seek(0)
+                raise RuntimeError(f"{scenario} x{concurrency} failed:\n{log.read()[-2000:]}")
+        with open(output, encoding="utf-8") as fh:
+            return json.load(fh)
+
+
+def format_row(row: Dict[str, Any]) -> str:
+    return (
+        f"{row['scenario']:<20} {row['concurrency']:>4} {row['requests'] - row['errors']:>5} {row['errors']:>4} "
+        f"{row['ops_per_second']:>8.1f} {row['bytes_per_second'] / 1048576:>8.1f} "
+        f"{row['p50_seconds'] * 1000:>9.1f} {row['p99_seconds'] * 1000:>9.1f} "
+        f"{row['peak_rss_bytes'] / 1048576:>8.1f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="operations per scenario and level")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed operations before measuring")
+    parser.add_argument("--media-size", type=int, default=DEFAULT_MEDIA_SIZE, help="media file size in bytes")
+    parser.add_argument("--rate", type=float, default=0, help="per-connection bytes/s limit (0 = unlimited)")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.concurrency = int(args.concurrency)
+        result = run_child(args)
+        import postprocess
+
+        postprocess.get_pool().shutdown()
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(result, fh)
+        # Skip interpreter teardown; daemon threads may still hold sockets.
+        os._exit(0)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = sorted(set(scenarios) - set(SCENARIOS))
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    services = FakeServices(media_size=args.media_size, rate=args.rate).start()
+    results = []
+    print(f"{'scenario':<20} {'conc':>4} {'ok':>5} {'err':>4} {'ops/s':>8} {'MB/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>8}")
+    try:
+        for scenario in scenarios:
+            for level in levels:
+                row = run_scenario(services, scenario, level, args)
+                results.append(row)
+                print(format_row(row), flush=True)
+                if row["first_error"]:
+                    print(f"  first error: {row['first_error']}")
+    finally:
+        services.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
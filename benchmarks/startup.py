@@ -0,0 +1,76 @@
+"""Cold-start benchmark: how long a fresh interpreter takes to serve a request.
+
+Each run starts a new Python process in an empty working directory, imports
+``app`` the way a gunicorn worker would and issues ``GET /`` through the test
+client. Import time and time-to-first-response are reported separately.
+
+    python benchmarks/startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get("/")
+served = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "first_response": served - started,
+    "status": response.status_code,
+}))
+"""
+
+
+def run_once(prewarm: bool) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ)
+        env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+        env["PYTHONDONTWRITEBYTECODE"] = "1"
+        env["PREWARM_YT_DLP"] = "1" if prewarm else "0"
+        # Keep any background ffmpeg fetch away from the real archive cache.
+        env["FFMPEG_CACHE_DIR"] = os.path.join(workdir, "ffmpeg-cache")
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=workdir,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(label: str, values: list) -> str:
+    values = sorted(values)
+    return (
+        f"{label:<16} min {values[0] * 1000:7.1f} ms  "
+        f"median {statistics.median(values) * 1000:7.1f} ms  "
+        f"max {values[-1] * 1000:7.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-prewarm", action="store_true", help="disable the background yt-dlp import")
+    args = parser.parse_args()
+
+    results = [run_once(prewarm=not args.no_prewarm) for _ in range(max(1, args.runs))]
+    if any(result["status"] != 200 for result in results):
+        raise SystemExit(f"Unexpected status codes: {[result['status'] for result in results]}")
+    print(summarize("import app", [result["import"] for result in results]))
+    print(summarize("first response", [result["first_response"] for result in results]))
+
+
+if __name__ == "__main__":
+    main()
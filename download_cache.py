@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import IO, Any, Callable, Dict, Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+MARKER_NAME = ".complete"
+LOCK_NAME = ".lock"
+TRACKING_PARAMS = ("utm_", "si", "feature", "fbclid", "gclid", "igshid", "pp")
+SPOTIFY_PATH_RE = re.compile(r"^/(?:intl-[a-z-]+/)?(track|album|playlist)/([A-Za-z0-9]+)", re.IGNORECASE)
+YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be")
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of ``url`` so trivially different links share a cache entry."""
+    if not url:
+        return ""
+    raw = url.strip()
+    if raw.lower().startswith("spotify:"):
+        kind, _, item_id = raw[len("spotify:"):].partition(":")
+        return f"spotify:{kind.lower()}:{item_id}"
+    parsed = urlparse(raw)
+    host = (parsed.hostname or "").lower()
+
+    if host == "open.spotify.com":
+        match = SPOTIFY_PATH_RE.match(parsed.path)
+        if match:
+            return f"spotify:{match.group(1).lower()}:{match.group(2)}"
+
+    if host in YOUTUBE_HOSTS:
+        video_id = None
+        if host == "youtu.be":
+            video_id = parsed.path.strip("/").split("/")[0]
+        elif parsed.path.startswith("/shorts/") or parsed.path.startswith("/live/"):
+            video_id = parsed.path.split("/")[2]
+        else:
+            video_id = dict(parse_qsl(parsed.query)).get("v")
+        if video_id:
+            return f"youtube:{video_id}"
+
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not any(key == param or (param.endswith("_") and key.startswith(param)) for param in TRACKING_PARAMS)
+    ]
+    query.sort()
+    path = parsed.path.rstrip("/") or "/"
+    return urlunparse(((parsed.scheme or "https").lower(), host, path, "", urlencode(query), ""))
+
+
+def make_cache_key(url: str, selected_format: str, postprocessing: Any = None) -> str:
+    payload = json.dumps(
+        [normalize_url(url), selected_format or "best", postprocessing],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        # Held file lock of a claim made with ``across_processes``.
+        self.lock_file: Optional[IO[str]] = None
+
+
+class DownloadCache:
+    """Maps cache keys to finished files and coalesces concurrent misses.
+
+    Each key owns its own directory under ``root``; a marker file records the
+    finished media so entries survive restarts.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._entries: Dict[str, str] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def directory_for(self, key: str) -> str:
+        return os.path.join(self.root, key[:16])
+
+    def lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            path = self._entries.get(key)
+        if path and os.path.exists(path):
+            return path
+
+        marker = os.path.join(self.directory_for(key), MARKER_NAME)
+        try:
+            with open(marker, "r", encoding="utf-8") as fh:
+                path = os.path.join(self.directory_for(key), fh.read().strip())
+        except OSError:
+            path = None
+
+        with self._lock:
+            if path and os.path.exists(path):
+                self._entries[key] = path
+                return path
+            self._entries.pop(key, None)
+        return None
+
+    def store(self, key: str, filepath: str) -> None:
+        """Record ``filepath`` for ``key``; files outside the key's directory are not cached."""
+        directory = self.directory_for(key)
+        if os.path.dirname(os.path.abspath(filepath)) != os.path.abspath(directory):
+            return
+        with open(os.path.join(directory, MARKER_NAME), "w", encoding="utf-8") as fh:
+            fh.write(os.path.basename(filepath))
+        with self._lock:
+            self._entries[key] = filepath
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        try:
+            os.remove(os.path.join(self.directory_for(key), MARKER_NAME))
+        except OSError:
+            pass
+
+    def claim(self, key: str, across_processes: bool = False) -> Optional[_Flight]:
+        """Register the caller as the producer for ``key``.
+
+        Returns ``None`` when another producer is already running; otherwise
+        the caller must hand the returned flight back to :meth:`release`.
+        With ``across_processes``, a producer in another process sharing
+        ``root`` (holding the key's file lock) also counts; the lock is then
+        held until :meth:`release`.
+        """
+        with self._lock:
+            if key in self._flights:
+                return None
+            flight = _Flight()
+            self._flights[key] = flight
+        os.makedirs(self.directory_for(key), exist_ok=True)
+        if across_processes and fcntl is not None:
+            path = os.path.join(self.directory_for(key), LOCK_NAME)
+            fh = open(path, "a")
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fh.close()
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.event.set()
+                return None
+            os.utime(path)
+            flight.lock_file = fh
+        return flight
+
+    def release(
+        self,
+        key: str,
+        flight: _Flight,
+        result: Optional[str] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        if error is None and result and os.path.exists(result):
+            self.store(key, result)
+        flight.result = result
+        flight.error = error
+        if flight.lock_file is not None:
+            fcntl.flock(flight.lock_file, fcntl.LOCK_UN)
+            flight.lock_file.close()
+            flight.lock_file = None
+        with self._lock:
+            if self._flights.get(key) is flight:
+                self._flights.pop(key, None)
+        flight.event.set()
+
+    @contextmanager
+    def _process_lock(self, key: str) -> Iterator[None]:
+        """Exclusive lock on the key's directory shared with other processes."""
+        if fcntl is None:
+            yield
+            return
+        path = os.path.join(self.directory_for(key), LOCK_NAME)
+        with open(path, "a") as fh:
+            os.utime(path)
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def fetch(
+        self,
+        key: str,
+        producer: Callable[[], str],
+        on_wait: Optional[Callable[[], None]] = None,
+    ) -> str:
+        """Return the cached file for ``key`` or run ``producer`` exactly once.
+
+        Concurrent callers for a key that is already being produced block until
+        the running producer finishes and share its result or exception. A
+        file lock extends this to other processes using the same ``root``:
+        they wait for the producer and then pick up its finished file.
+        """
+        cached = self.lookup(key)
+        if cached:
+            return cached
+
+        with self._lock:
+            flight = self._flights.get(key)
+        if flight is None:
+            flight = self.claim(key)
+            if flight is not None:
+                result: Optional[str] = None
+                try:
+                    with self._process_lock(key):
+                        result = self.lookup(key) or producer()
+                except BaseException as exc:
+                    self.release(key, flight, error=exc)
+                    raise
+                self.release(key, flight, result=result)
+                return result
+            with self._lock:
+                flight = self._flights.get(key)
+            if flight is None:
+                return self.fetch(key, producer, on_wait)
+
+        if on_wait:
+            on_wait()
+        flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        if flight.result is None:
+            # The producer gave up without a result (e.g. a streaming client
+            # disconnected); take over instead of failing.
+            return self.fetch(key, producer, on_wait)
+        return flight.result
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._flights
@@ -1,4 +1,36 @@
+import importlib
 import os
+import threading
+
+
+class LazyModule:
+    """Module proxy that performs the real import on first attribute access.
+
+    ``prewarm`` starts that import on a daemon thread so the first request
+    does not pay for it, without holding up process startup.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def prewarm(self):
+        if self._module is None:
+            threading.Thread(target=self.load, name=f"import-{self._name}", daemon=True).start()
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+yt_dlp = LazyModule("yt_dlp")
 
 def resolve_download_path(info_dict, ydl_instance, template_path=None):
     """Return the best-guess absolute path for the file produced by yt-dlp."""
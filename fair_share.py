@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Total bytes/s for job downloads in this process and the most one client's
+# jobs may use together; 0 leaves either unlimited.
+BANDWIDTH_LIMIT = float(os.environ.get("BANDWIDTH_LIMIT", 0))
+CLIENT_BANDWIDTH_LIMIT = float(os.environ.get("CLIENT_BANDWIDTH_LIMIT", 0))
+# Seconds of a flow's rate it may send in one burst after idling.
+BANDWIDTH_BURST = float(os.environ.get("BANDWIDTH_BURST", 0.5))
+# A flow that received nothing for this long stops holding a share.
+BANDWIDTH_IDLE = float(os.environ.get("BANDWIDTH_IDLE", 2.0))
+
+# Classes are bands of the job priority, so both queues order interactive
+# work before batch work before prefetching without a second sort key.
+# A requested priority only moves a job within its class's band.
+PRIORITY_CLASSES = {"interactive": 0, "batch": 1000, "prefetch": 2000}
+PRIORITY_CLASS_SPAN = 1000
+# Relative bandwidth share of a running download in each class.
+CLASS_WEIGHTS = {"interactive": 4, "batch": 2, "prefetch": 1}
+
+Throttle = Callable[[int], float]
+
+
+def parse_priority_class(value: Any, default: str = "interactive") -> str:
+    name = str(value or "").strip().lower()
+    return name if name in PRIORITY_CLASSES else default
+
+
+def job_priority(priority_class: str, requested: int = 0) -> int:
+    """Queue priority for a job of ``priority_class`` asking for ``requested``."""
+    half = PRIORITY_CLASS_SPAN // 2 - 1
+    return PRIORITY_CLASSES[priority_class] + max(-half, min(half, int(requested)))
+
+
+def priority_floor(priority_class: str) -> int:
+    """Lowest priority value in ``priority_class``'s band."""
+    return PRIORITY_CLASSES[priority_class] - PRIORITY_CLASS_SPAN // 2
+
+
+def class_of(priority: int) -> str:
+    """The class whose band contains ``priority``."""
+    for name in sorted(PRIORITY_CLASSES, key=PRIORITY_CLASSES.__getitem__, reverse=True):
+        if priority >= priority_floor(name):
+            return name
+    return min(PRIORITY_CLASSES, key=PRIORITY_CLASSES.__getitem__)
+
+
+class _Flow:
+    __slots__ = ("client", "priority_class", "weight", "rate", "tokens", "updated", "resumes_at", "active")
+
+    def __init__(self, client: str, priority_class: str, now: float) -> None:
+        self.client = client
+        self.priority_class = priority_class
+        self.weight = CLASS_WEIGHTS.get(priority_class, 1)
+        self.rate = float("inf")
+        # Capped to one burst once the flow has a rate.
+        self.tokens = float("inf")
+        self.updated = now
+        # End of the pause handed out last; a paused flow is not idle.
+        self.resumes_at = now
+        self.active = False
+
+
+class BandwidthShaper:
+    """Token buckets that split a bandwidth budget between running downloads.
+
+    Each active flow (one job's transfers) gets a rate by weighted max-min
+    fairness: ``limit`` is divided in proportion to the class weights, no
+    flow gets more than its share of its client's ``client_limit``, and
+    what a capped client cannot use goes to the others. A flow counts as
+    active from its first byte until it has been quiet for ``idle``
+    seconds, so jobs that are extracting, waiting for an identical download
+    or post-processing leave their share to the others. Rates are
+    recomputed whenever the set of active flows changes.
+
+    :meth:`consume` charges bytes already received and returns how long the
+    caller should pause, so the same bucket paces threads (``time.sleep``)
+    and coroutines (``asyncio.sleep``) without blocking either.
+    """
+
+    def __init__(
+        self,
+        limit: float = BANDWIDTH_LIMIT,
+        client_limit: float = CLIENT_BANDWIDTH_LIMIT,
+        burst: float = BANDWIDTH_BURST,
+        idle: float = BANDWIDTH_IDLE,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.limit = max(0.0, float(limit))
+        self.client_limit = max(0.0, float(client_limit))
+        self.burst = max(0.01, float(burst))
+        self.idle = max(0.1, float(idle))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flows: Dict[str, _Flow] = {}
+        self._idle_checked = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limit or self.client_limit)
+
+    def open(self, flow_id: str, client: Optional[str], priority_class: str) -> None:
+        with self._lock:
+            # Jobs without a client are their own client.
+            self._flows[flow_id] = _Flow(client or flow_id, priority_class, self._clock())
+
+    def close(self, flow_id: str) -> None:
+        with self._lock:
+            flow = self._flows.pop(flow_id, None)
+            if flow is not None and flow.active:
+                self._rebalance_locked()
+
+    @contextmanager
+    def flow(self, flow_id: str, client: Optional[str], priority_class: str) -> Iterator[None]:
+        self.open(flow_id, client, priority_class)
+        try:
+            yield
+        finally:
+            self.close(flow_id)
+
+    def _rebalance_locked(self) -> None:
+        active = {flow_id: flow for flow_id, flow in self._flows.items() if flow.active}
+        client_weights: Dict[str, float] = defaultdict(float)
+        for flow in active.values():
+            client_weights[flow.client] += flow.weight
+        unlimited = float("inf")
+        caps = {
+            flow_id: self.client_limit * flow.weight / client_weights[flow.client] if self.client_limit else unlimited
+            for flow_id, flow in active.items()
+        }
+        rates = dict(caps)
+        if self.limit:
+            remaining = self.limit
+            pending = set(active)
+            while pending:
+                share = remaining / sum(active[flow_id].weight for flow_id in pending)
+                capped = [flow_id for flow_id in pending if caps[flow_id] < share * active[flow_id].weight]
+                if not capped:
+                    for flow_id in pending:
+                        rates[flow_id] = share * active[flow_id].weight
+                    break
+                for flow_id in capped:
+                    remaining -= caps[flow_id]
+                    pending.discard(flow_id)
+        now = self._clock()
+        for flow_id, flow in active.items():
+            self._refill(flow, now)
+            flow.rate = rates[flow_id]
+            flow.tokens = min(flow.tokens, self._burst_bytes(flow))
+
+    def _expire_idle_locked(self, now: float) -> None:
+        if now - self._idle_checked < self.idle / 2:
+            return
+        self._idle_checked = now
+        expired = False
+        for flow in self._flows.values():
+            if flow.active and now - max(flow.updated, flow.resumes_at) >= self.idle:
+                flow.active = False
+                expired = True
+        if expired:
+            self._rebalance_locked()
+
+    def _burst_bytes(self, flow: _Flow) -> float:
+        return flow.rate * self.burst
+
+    def _refill(self, flow: _Flow, now: float) -> None:
+        if flow.rate != float("inf"):
+            flow.tokens = min(self._burst_bytes(flow), flow.tokens + (now - flow.updated) * flow.rate)
+        flow.updated = now
+
+    def consume(self, flow_id: str, count: int) -> float:
+        """Charge ``count`` received bytes to ``flow_id``; returns seconds to pause."""
+        with self._lock:
+            flow = self._flows.get(flow_id)
+            if flow is None:
+                return 0.0
+            now = self._clock()
+            self._expire_idle_locked(now)
+            if not flow.active:
+                flow.active = True
+                self._rebalance_locked()
+            if flow.rate == float("inf"):
+                flow.updated = now
+                return 0.0
+            self._refill(flow, now)
+            # Tokens may go negative: the debt is paid off by the pause.
+            flow.tokens -= count
+            pause = -flow.tokens / flow.rate if flow.tokens < 0 and flow.rate > 0 else 0.0
+            flow.resumes_at = now + pause
+            return pause
+
+    def throttle_for(self, flow_id: str) -> Optional[Throttle]:
+        """``consume`` bound to ``flow_id``, or ``None`` when nothing is limited."""
+        if not self.enabled:
+            return None
+        return lambda count: self.consume(flow_id, count)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "flow": flow_id,
+                    "client": flow.client,
+                    "class": flow.priority_class,
+                    "active": flow.active,
+                    "rate": None if not flow.active or flow.rate == float("inf") else round(flow.rate),
+                }
+                for flow_id, flow in self._flows.items()
+            ]
+
+
+def throttled_hook(
+    hook: Callable[[Dict[str, Any]], None],
+    throttle: Optional[Throttle],
+) -> Callable[[Dict[str, Any]], None]:
+    """Wrap a yt-dlp progress hook so it pauses the download to ``throttle``'s pace.
+
+    yt-dlp calls progress hooks from its download loop after every block,
+    so sleeping here holds back the next read.
+    """
+    if throttle is None:
+        return hook
+    seen: Dict[str, int] = {}
+
+    def _hook(data: Dict[str, Any]) -> None:
+        hook(data)
+        if data.get("status") != "downloading":
+            return
+        name = data.get("tmpfilename") or data.get("filename") or ""
+        done = data.get("downloaded_bytes") or 0
+        last = seen.get(name, 0)
+        # A new file (the audio after the video) or a restart starts over.
+        delta = done - last if done >= last else done
+        seen[name] = done
+        if delta > 0:
+            delay = throttle(delta)
+            if delay > 0:
+                time.sleep(delay)
+
+    return _hook
@@ -0,0 +1,154 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+# How long a success (counted from the first of a run) or a failure reorders
+# the strategies tried for a domain.
+FALLBACK_MEMORY_TTL = float(os.environ.get("FALLBACK_MEMORY_TTL", 1800))
+# Consecutive failures that open a strategy's circuit for a domain, and how
+# long it then stays skipped before one trial attempt is let through.
+FALLBACK_FAILURE_THRESHOLD = int(os.environ.get("FALLBACK_FAILURE_THRESHOLD", 3))
+FALLBACK_COOLDOWN = float(os.environ.get("FALLBACK_COOLDOWN", 300))
+FALLBACK_MEMORY_DOMAINS = int(os.environ.get("FALLBACK_MEMORY_DOMAINS", 1024))
+# Fire the API /info probe alongside yt-dlp unless yt-dlp is known to work.
+FALLBACK_HEDGE = os.environ.get("FALLBACK_HEDGE", "1") not in ("0", "false", "False")
+
+# Errors that mean the site refuses the strategy (sign-in walls, bot checks,
+# blocks and rate limits), as opposed to errors about the URL itself.
+STRATEGY_ERROR_RE = re.compile(
+    r"sign in|log ?in|cookies|\bbot\b|captcha|HTTP Error 40[13]|HTTP Error 429|forbidden|too many requests|rate.?limit",
+    re.IGNORECASE,
+)
+URL_ERROR_RE = re.compile(
+    r"unavailable|not available|private video|confirm your age|been removed|does not exist|unsupported url"
+    r"|not a valid url|HTTP Error 404",
+    re.IGNORECASE,
+)
+
+
+def domain_of(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            return host[len(prefix):]
+    return host
+
+
+def is_strategy_failure(error: BaseException) -> bool:
+    """Whether ``error`` counts against the strategy rather than the URL."""
+    message = str(error)
+    return bool(STRATEGY_ERROR_RE.search(message)) and not URL_ERROR_RE.search(message)
+
+
+class _State:
+    __slots__ = ("succeeded_at", "failed_at", "failures", "open_until")
+
+    def __init__(self) -> None:
+        # Start of the current run of successes, not the latest one, so a
+        # learned preference expires and the default order gets re-tried.
+        self.succeeded_at: Optional[float] = None
+        self.failed_at: Optional[float] = None
+        self.failures = 0
+        self.open_until = 0.0
+
+
+class StrategyMemory:
+    """Per-domain record of which download strategies worked lately.
+
+    ``plan`` orders strategies as: those on a run of successes that started
+    within ``ttl`` (newest first), those with no recent record (in the
+    caller's order), then those whose latest result within ``ttl`` was a
+    failure. A strategy that failed ``failure_threshold`` times in a row for
+    a domain has its circuit opened and is left out of plans for
+    ``cooldown`` seconds; after that a single attempt decides whether it
+    closes again. State is kept per process for the ``max_domains`` most
+    recently used domains.
+    """
+
+    def __init__(
+        self,
+        ttl: float = FALLBACK_MEMORY_TTL,
+        failure_threshold: int = FALLBACK_FAILURE_THRESHOLD,
+        cooldown: float = FALLBACK_COOLDOWN,
+        max_domains: int = FALLBACK_MEMORY_DOMAINS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.max_domains = max(1, max_domains)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._domains: "OrderedDict[str, Dict[str, _State]]" = OrderedDict()
+
+    def _states(self, domain: str) -> Dict[str, _State]:
+        states = self._domains.get(domain)
+        if states is None:
+            states = self._domains[domain] = {}
+            while len(self._domains) > self.max_domains:
+                self._domains.popitem(last=False)
+        else:
+            self._domains.move_to_end(domain)
+        return states
+
+    def _standing(self, state: Optional[_State], now: float) -> int:
+        """0 = recently working, 1 = unknown, 2 = recently failing."""
+        if state is None:
+            return 1
+        if (
+            state.failed_at is not None
+            and now - state.failed_at < self.ttl
+            and (state.succeeded_at is None or state.failed_at > state.succeeded_at)
+        ):
+            return 2
+        if state.succeeded_at is not None and now - state.succeeded_at < self.ttl:
+            return 0
+        return 1
+
+    def plan(self, domain: str, strategies: Sequence[str]) -> Tuple[List[str], List[str]]:
+        """Return ``(ordered, skipped)`` for ``strategies`` on ``domain``.
+
+        If every circuit is open, the plan falls back to the full order
+        rather than giving up without an attempt.
+        """
+        now = self._clock()
+        with self._lock:
+            states = self._states(domain)
+            skipped = [name for name in strategies if name in states and states[name].open_until > now]
+            ordered = [name for name in strategies if name not in skipped]
+            if not ordered:
+                ordered, skipped = list(strategies), []
+
+            def _key(name: str) -> Tuple[int, float]:
+                state = states.get(name)
+                standing = self._standing(state, now)
+                return standing, -state.succeeded_at if standing == 0 and state else 0.0
+
+            # sorted() is stable, so ties keep the caller's order.
+            return sorted(ordered, key=_key), skipped
+
+    def recently_succeeded(self, domain: str, strategy: str) -> bool:
+        with self._lock:
+            return self._standing(self._domains.get(domain, {}).get(strategy), self._clock()) == 0
+
+    def record_success(self, domain: str, strategy: str) -> None:
+        now = self._clock()
+        with self._lock:
+            state = self._states(domain).setdefault(strategy, _State())
+            if state.succeeded_at is None or state.failures or now - state.succeeded_at >= self.ttl:
+                state.succeeded_at = now
+            state.failures = 0
+            state.open_until = 0.0
+
+    def record_failure(self, domain: str, strategy: str) -> None:
+        now = self._clock()
+        with self._lock:
+            state = self._states(domain).setdefault(strategy, _State())
+            state.failed_at = now
+            state.failures += 1
+            if state.failures >= self.failure_threshold:
+                state.open_until = now + self.cooldown
@@ -1,11 +1,20 @@
+import lzma
 import os
+import posixpath
+import shutil
 import stat
 import tarfile
-import shutil
-import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator, Optional
+
+import segmented_download
 
-import requests
+try:
+    import fcntl
+except ImportError:  # Windows: no auto-install there anyway
+    fcntl = None
 
 BASE_DIR = Path(__file__).resolve().parent
 BIN_DIR = BASE_DIR / "bin"
@@ -19,64 +28,148 @@ if IS_WINDOWS:
 else:
     FFMPEG_BINARY = "ffmpeg"
     FFPROBE_BINARY = "ffprobe"
-    FFMPEG_URL = "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-amd64-static.tar.xz"
+    FFMPEG_URL = os.environ.get(
+        "FFMPEG_URL", "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-amd64-static.tar.xz"
+    )
 
 FFMPEG_PATH = BIN_DIR / FFMPEG_BINARY
 FFPROBE_PATH = BIN_DIR / FFPROBE_BINARY
 
+# The release tarball is kept here so a redeploy with an empty bin/ does not
+# download it again. Point it at a persistent volume in containers.
+FFMPEG_CACHE_DIR = Path(os.environ.get("FFMPEG_CACHE_DIR", Path.home() / ".cache" / "downloader"))
+FFMPEG_ARCHIVE_PATH = FFMPEG_CACHE_DIR / "ffmpeg-release-amd64-static.tar.xz"
+FFMPEG_LOCK_PATH = FFMPEG_CACHE_DIR / "ffmpeg-install.lock"
 
-def _download_ffmpeg(archive_path: Path) -> None:
-    if not FFMPEG_URL:
-        raise RuntimeError("Automatic ffmpeg setup not supported on this platform")
+_install_lock = threading.Lock()
+_installer_lock = threading.Lock()
+_installer: Optional[threading.Thread] = None
 
-    response = requests.get(FFMPEG_URL, stream=True, timeout=60)
-    response.raise_for_status()
 
-    with archive_path.open("wb") as fh:
-        for chunk in response.iter_content(chunk_size=1024 * 512):
-            if chunk:
-                fh.write(chunk)
+def _add_bin_to_path() -> None:
+    os.environ.setdefault("PATH", "")
+    if str(BIN_DIR) not in os.environ["PATH"]:
+        os.environ["PATH"] = f"{BIN_DIR}{os.pathsep}" + os.environ["PATH"]
 
 
-def _extract_and_install(archive_path: Path) -> None:
-    with tarfile.open(archive_path, mode="r:xz") as tar:
-        with tempfile.TemporaryDirectory(dir=BASE_DIR) as tmp_dir:
-            tar.extractall(tmp_dir)
-            tmp_path = Path(tmp_dir)
-            candidates = [d for d in tmp_path.iterdir() if d.is_dir() and d.name.startswith("ffmpeg-")]
-            if not candidates:
-                raise RuntimeError("Failed to locate extracted ffmpeg directory")
-            source_dir = candidates[0]
-            ffmpeg_src = source_dir / FFMPEG_BINARY
-            ffprobe_src = source_dir / FFPROBE_BINARY
-            if not ffmpeg_src.exists() or not ffprobe_src.exists():
-                raise RuntimeError("Extracted ffmpeg binaries not found")
-            BIN_DIR.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(ffmpeg_src), FFMPEG_PATH)
-            shutil.move(str(ffprobe_src), FFPROBE_PATH)
-
-    archive_path.unlink(missing_ok=True)
-
-    os.chmod(FFMPEG_PATH, stat.S_IRWXU)
-    os.chmod(FFPROBE_PATH, stat.S_IRWXU)
+def is_installed() -> bool:
+    return FFMPEG_PATH.exists() and FFPROBE_PATH.exists()
 
 
-def ensure_ffmpeg() -> None:
-    if FFMPEG_PATH.exists() and FFPROBE_PATH.exists():
-        os.environ.setdefault("PATH", "")
-        if str(BIN_DIR) not in os.environ["PATH"]:
-            os.environ["PATH"] = f"{BIN_DIR}{os.pathsep}" + os.environ["PATH"]
-        return
+def _download_ffmpeg(archive_path: Path) -> None:
+    if not FFMPEG_URL:
+        raise RuntimeError("Automatic ffmpeg setup not supported on this platform")
 
-    if IS_WINDOWS:
-        # Windows deployments should bundle ffmpeg manually; skip auto-install.
-        return
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    # Goes through <archive>.part like before, and resumes it where the
+    # server allows ranges.
+    segmented_download.download_file(FFMPEG_URL, str(archive_path), connections=1, timeout=60)
 
-    archive_path = BASE_DIR / "ffmpeg.tar.xz"
 
-    _download_ffmpeg(archive_path)
-    _extract_and_install(archive_path)
+def _extract_and_install(archive_path: Path) -> None:
+    """Stream through the archive and write out only the two binaries."""
+    targets = {FFMPEG_BINARY: FFMPEG_PATH, FFPROBE_BINARY: FFPROBE_PATH}
+    installed = set()
+    BIN_DIR.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(archive_path, mode="r|xz") as tar:
+        for member in tar:
+            name = posixpath.basename(member.name)
+            # Binaries sit directly under the top-level ffmpeg-<version>/ folder.
+            if not member.isfile() or member.name.count("/") != 1 or name not in targets:
+                continue
+            source = tar.extractfile(member)
+            if source is None:
+                continue
+            target = targets[name]
+            tmp_path = target.with_name(target.name + ".part")
+            with tmp_path.open("wb") as fh:
+                shutil.copyfileobj(source, fh, 1024 * 1024)
+            os.chmod(tmp_path, stat.S_IRWXU)
+            os.replace(tmp_path, target)
+            installed.add(name)
+            if len(installed) == len(targets):
+                break
+
+    if len(installed) != len(targets):
+        raise RuntimeError("Extracted ffmpeg binaries not found")
+
+
+@contextmanager
+def _process_lock() -> Iterator[None]:
+    """Exclusive lock shared by every process installing into the same paths."""
+    if fcntl is None:
+        yield
+        return
+    FFMPEG_LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with FFMPEG_LOCK_PATH.open("a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
 
-    os.environ.setdefault("PATH", "")
-    if str(BIN_DIR) not in os.environ["PATH"]:
-        os.environ["PATH"] = f"{BIN_DIR}{os.pathsep}" + os.environ["PATH"]
+
+def ensure_ffmpeg() -> None:
+    """Install ffmpeg/ffprobe into ``BIN_DIR`` if missing; blocks until done.
+
+    Other processes (e.g. the other gunicorn workers) wait on a file lock
+    and then find the binaries already installed.
+    """
+    with _install_lock:
+        if is_installed():
+            _add_bin_to_path()
+            return
+
+        if IS_WINDOWS:
+            # Windows deployments should bundle ffmpeg manually; skip auto-install.
+            return
+
+        with _process_lock():
+            if not is_installed():
+                _install()
+        _add_bin_to_path()
+
+
+def _install() -> None:
+    cached = FFMPEG_ARCHIVE_PATH.exists()
+    if not cached:
+        _download_ffmpeg(FFMPEG_ARCHIVE_PATH)
+    try:
+        _extract_and_install(FFMPEG_ARCHIVE_PATH)
+    except (tarfile.TarError, lzma.LZMAError, EOFError, RuntimeError):
+        if not cached:
+            raise
+        # A truncated or stale cached archive: fetch a fresh copy once.
+        FFMPEG_ARCHIVE_PATH.unlink(missing_ok=True)
+        _download_ffmpeg(FFMPEG_ARCHIVE_PATH)
+        _extract_and_install(FFMPEG_ARCHIVE_PATH)
+
+
+def _install_in_background() -> None:
+    global _installer
+    try:
+        ensure_ffmpeg()
+    except Exception as exc:
+        print(f"ffmpeg setup failed: {exc}")
+        with _installer_lock:
+            # Let the next caller start a fresh attempt.
+            _installer = None
+
+
+def start_ffmpeg_install() -> threading.Thread:
+    """Provision ffmpeg on a daemon thread; repeated calls share one attempt."""
+    global _installer
+    with _installer_lock:
+        if _installer is None:
+            _installer = threading.Thread(target=_install_in_background, name="ffmpeg-install", daemon=True)
+            _installer.start()
+        return _installer
+
+
+def wait_for_ffmpeg(timeout: Optional[float] = None) -> bool:
+    """Block until the background install finishes; returns whether ffmpeg is usable."""
+    if is_installed():
+        _add_bin_to_path()
+        return True
+    start_ffmpeg_install().join(timeout)
+    return is_installed()
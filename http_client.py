@@ -0,0 +1,89 @@
+import os
+import threading
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 32))
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", 16))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 3))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", 0.5))
+
+_config_lock = threading.Lock()
+_adapter: Optional[HTTPAdapter] = None
+_generation = 0
+_local = threading.local()
+
+
+def _build_adapter(pool_size: int, pool_hosts: int, retries: int, backoff: float) -> HTTPAdapter:
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    return HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=retry, pool_block=False)
+
+
+def configure(
+    pool_size: Optional[int] = None,
+    pool_hosts: Optional[int] = None,
+    retries: Optional[int] = None,
+    backoff: Optional[float] = None,
+) -> None:
+    """Rebuild the shared connection pools, e.g. to match the worker count.
+
+    ``pool_size`` is the number of keep-alive connections kept per host and
+    ``pool_hosts`` the number of distinct hosts with a pool.
+    """
+    global _adapter, _generation
+    adapter = _build_adapter(
+        pool_size or HTTP_POOL_SIZE,
+        pool_hosts or HTTP_POOL_HOSTS,
+        HTTP_RETRIES if retries is None else retries,
+        HTTP_RETRY_BACKOFF if backoff is None else backoff,
+    )
+    with _config_lock:
+        previous = _adapter
+        _adapter = adapter
+        _generation += 1
+    if previous is not None:
+        previous.close()
+
+
+def _shared_adapter() -> Tuple[HTTPAdapter, int]:
+    with _config_lock:
+        if _adapter is not None:
+            return _adapter, _generation
+    configure()
+    with _config_lock:
+        return _adapter, _generation
+
+
+def get_session() -> requests.Session:
+    """Return this thread's session, mounted on the process-wide connection pools.
+
+    Sessions are per thread because cookie and header state on
+    ``requests.Session`` is not thread-safe; the urllib3 pools behind the
+    shared adapter are, so every thread reuses the same keep-alive sockets.
+    """
+    adapter, generation = _shared_adapter()
+    session = getattr(_local, "session", None)
+    if session is None or getattr(_local, "generation", None) != generation:
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+        _local.generation = generation
+    return session
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return get_session().get(url, **kwargs)
@@ -0,0 +1,285 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class JobScheduler:
+    """Fixed-size worker pool fed from a bounded priority queue.
+
+    Lower ``priority`` values run first; among equal priorities, jobs of the
+    client with the fewest running jobs go first, then FIFO. With
+    ``client_limit`` set, a client's queued jobs wait while it already has
+    that many running, and ``client_queue_limit`` caps how many it may have
+    queued. ``reserved_workers`` slots are kept for jobs with a priority
+    below ``reserve_below``, so those start at once even while lower
+    priority work would fill every worker. A worker that waits on another
+    stage inside :meth:`blocking` lends its slot to a temporary extra
+    thread, so ``workers`` jobs keep making progress.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queue: int = 100,
+        name: str = "download-worker",
+        client_limit: int = 0,
+        client_queue_limit: int = 0,
+        reserved_workers: int = 0,
+        reserve_below: int = 0,
+    ) -> None:
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.name = name
+        self.client_limit = max(0, int(client_limit))
+        self.client_queue_limit = max(0, int(client_queue_limit))
+        self.reserved_workers = max(0, min(self.workers - 1, int(reserved_workers)))
+        self.reserve_below = int(reserve_below)
+        self._queue: List[Tuple[int, int, str, Optional[str], Callable[..., Any], Tuple[Any, ...]]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._active: Dict[str, Optional[str]] = {}
+        self._client_active: Dict[str, int] = {}
+        self._threads: List[threading.Thread] = []
+        self._thread_counter = itertools.count()
+        self._borrowed = 0
+        self._started = False
+
+    def _spawn_locked(self) -> None:
+        thread = threading.Thread(target=self._run, name=f"{self.name}-{next(self._thread_counter)}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def start(self) -> None:
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.workers):
+                self._spawn_locked()
+
+    @contextmanager
+    def blocking(self) -> Iterator[None]:
+        """Release the calling worker's slot while it waits on another stage.
+
+        Outside this scheduler's worker threads this does nothing.
+        """
+        with self._cond:
+            owned = threading.current_thread() in self._threads
+            if owned:
+                self._borrowed += 1
+                if len(self._threads) < self.workers + self._borrowed:
+                    self._spawn_locked()
+        try:
+            yield
+        finally:
+            if owned:
+                with self._cond:
+                    self._borrowed -= 1
+                    self._cond.notify_all()
+
+    def submit(
+        self,
+        job_id: str,
+        func: Callable[..., Any],
+        *args: Any,
+        priority: int = 0,
+        client: Optional[str] = None,
+    ) -> int:
+        """Queue ``func(*args)`` and return the job's 1-based queue position."""
+        self.start()
+        with self._cond:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                raise QueueFullError("Download queue is full, try again later")
+            limit = self.client_queue_limit
+            if client is not None and limit and self._queued_locked(client) >= limit:
+                raise QueueFullError("Too many queued downloads for this client, try again later")
+            self._queue.append((int(priority), next(self._counter), job_id, client, func, args))
+            self._cond.notify()
+            return self._position_locked(job_id) or 1
+
+    def cancel(self, job_id: str) -> bool:
+        with self._cond:
+            for index, entry in enumerate(self._queue):
+                if entry[2] == job_id:
+                    self._queue.pop(index)
+                    return True
+        return False
+
+    def position(self, job_id: str) -> Optional[int]:
+        with self._cond:
+            return self._position_locked(job_id)
+
+    def _position_locked(self, job_id: str) -> Optional[int]:
+        target = None
+        for entry in self._queue:
+            if entry[2] == job_id:
+                target = entry[:2]
+                break
+        if target is None:
+            return None
+        return 1 + sum(1 for entry in self._queue if entry[:2] < target)
+
+    def _queued_locked(self, client: str) -> int:
+        return sum(1 for entry in self._queue if entry[3] == client)
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def active_count(self) -> int:
+        with self._cond:
+            return len(self._active)
+
+    def idle_slots(self, priority: Optional[int] = None) -> int:
+        """Workers that would pick up a newly submitted job (of ``priority``) right away."""
+        with self._cond:
+            idle = self.workers + self._borrowed - len(self._active) - len(self._queue)
+            if priority is not None and priority >= self.reserve_below:
+                idle -= self.reserved_workers
+            return max(0, idle)
+
+    def _retire_if_surplus_locked(self) -> bool:
+        if len(self._threads) > self.workers + self._borrowed:
+            self._threads.remove(threading.current_thread())
+            if self._queue:
+                # Pass on a wake-up meant for a worker that takes the job.
+                self._cond.notify()
+            return True
+        return False
+
+    def _take_locked(self) -> Optional[Tuple[int, int, str, Optional[str], Callable[..., Any], Tuple[Any, ...]]]:
+        """Remove and return the next job whose client is under its limit."""
+        best = None
+        # Slots taken by jobs that are not waiting inside blocking().
+        busy = len(self._active) - self._borrowed
+        for index, entry in enumerate(self._queue):
+            if entry[0] >= self.reserve_below and busy >= self.workers - self.reserved_workers:
+                continue
+            client = entry[3]
+            running = self._client_active.get(client, 0) if client is not None else 0
+            if self.client_limit and client is not None and running >= self.client_limit:
+                continue
+            key = (entry[0], running, entry[1])
+            if best is None or key < best[0]:
+                best = (key, index)
+        return self._queue.pop(best[1]) if best is not None else None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._retire_if_surplus_locked():
+                    return
+                entry = self._take_locked()
+                while entry is None:
+                    self._cond.wait()
+                    if self._retire_if_surplus_locked():
+                        return
+                    entry = self._take_locked()
+                _, _, job_id, client, func, args = entry
+                self._active[job_id] = client
+                if client is not None:
+                    self._client_active[client] = self._client_active.get(client, 0) + 1
+            try:
+                func(*args)
+            except Exception as exc:
+                print(f"Worker error for job {job_id}: {exc}")
+            finally:
+                with self._cond:
+                    self._active.pop(job_id, None)
+                    if client is not None:
+                        self._client_active[client] -= 1
+                        if not self._client_active[client]:
+                            del self._client_active[client]
+                    if self._queue:
+                        # Jobs held back by a client limit or the reserved
+                        # slots may run now.
+                        self._cond.notify_all()
+
+
+class JobDispatcher:
+    """Feeds a local :class:`JobScheduler` from a queue shared between processes.
+
+    ``store`` is a :class:`job_store.SharedJobStore`. A process only claims
+    queued jobs while it has idle workers, so downloads spread across all
+    processes instead of piling up on the one that accepted the request.
+    Leases on claimed jobs are renewed until ``handler(job)`` returns.
+    ``client_limit`` is the most jobs one client may run across all
+    processes; the store skips that client's queued jobs until one ends.
+    """
+
+    def __init__(
+        self,
+        store: Any,
+        scheduler: JobScheduler,
+        handler: Callable[[Dict[str, Any]], None],
+        poll_interval: float = 0.25,
+        client_limit: int = 0,
+    ) -> None:
+        self.store = store
+        self.scheduler = scheduler
+        self.handler = handler
+        self.poll_interval = max(0.01, float(poll_interval))
+        self.client_limit = max(0, int(client_limit))
+        self._claimed: Set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="job-dispatcher", daemon=True)
+            self._thread.start()
+
+    def wake(self) -> None:
+        """Check the shared queue now instead of at the next poll."""
+        self._wake.set()
+
+    def _run_job(self, job: Dict[str, Any]) -> None:
+        try:
+            self.handler(job)
+        finally:
+            with self._lock:
+                self._claimed.discard(job["job_id"])
+            self.wake()
+
+    def dispatch(self) -> int:
+        """Claim as many queued jobs as there are idle local workers."""
+        claimed = 0
+        while self.scheduler.idle_slots() > 0:
+            # Only jobs that may use the reserved workers fill the last slots.
+            reserve_below = self.scheduler.reserve_below
+            below = None if self.scheduler.idle_slots(reserve_below) > 0 else reserve_below
+            job = self.store.claim_next(client_limit=self.client_limit, priority_below=below)
+            if job is None:
+                break
+            with self._lock:
+                self._claimed.add(job["job_id"])
+            self.scheduler.submit(job["job_id"], self._run_job, job, priority=job.get("priority") or 0)
+            claimed += 1
+        return claimed
+
+    def _loop(self) -> None:
+        last_renew = 0.0
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                now = time.monotonic()
+                if now - last_renew >= self.store.lease / 3:
+                    last_renew = now
+                    with self._lock:
+                        claimed = list(self._claimed)
+                    if claimed:
+                        self.store.renew(claimed)
+                    self.store.reclaim_expired()
+                self.dispatch()
+            except Exception as exc:
+                print(f"Job dispatch failed: {exc}")
@@ -0,0 +1,635 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+TERMINAL_STATUSES = ("completed", "error")
+
+# Fields copied to SQLite. Progress, message and the transfer counters
+# change on every chunk, so they stay in memory and are only written
+# alongside a durable change.
+DURABLE_FIELDS = (
+    "status",
+    "filepath",
+    "error",
+    "requested_format",
+    "source_url",
+    "priority",
+    "client_id",
+    "parent_id",
+    "items",
+)
+VOLATILE_FIELDS = ("progress", "message", "bytes_done", "bytes_total", "speed", "eta")
+
+RECORD_FIELDS = (
+    "status",
+    "progress",
+    "message",
+    "filepath",
+    "error",
+    "requested_format",
+    "source_url",
+    "priority",
+    "client_id",
+    "parent_id",
+    "items",
+    "bytes_done",
+    "bytes_total",
+    "speed",
+    "eta",
+    "version",
+    "created_at",
+    "updated_at",
+)
+
+
+_JOB_COLUMNS = (
+    ("status", "TEXT"),
+    ("progress", "INTEGER"),
+    ("message", "TEXT"),
+    ("filepath", "TEXT"),
+    ("error", "TEXT"),
+    ("requested_format", "TEXT"),
+    ("source_url", "TEXT"),
+    ("priority", "INTEGER"),
+    ("created_at", "REAL"),
+    ("updated_at", "REAL"),
+    ("items", "TEXT"),
+    ("version", "INTEGER DEFAULT 0"),
+    ("owner", "TEXT"),
+    ("lease_until", "REAL"),
+    ("bytes_done", "INTEGER"),
+    ("bytes_total", "INTEGER"),
+    ("speed", "REAL"),
+    ("eta", "REAL"),
+    ("parent_id", "TEXT"),
+    ("client_id", "TEXT"),
+)
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    """Open the jobs database, creating or upgrading the ``jobs`` table."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    columns = ", ".join(f"{name} {kind}" for name, kind in _JOB_COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, {columns})")
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for name, kind in _JOB_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, owner, priority, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client_id, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_parent ON jobs (parent_id)")
+    return conn
+
+
+Summarize = Callable[[Dict[str, Any], Dict[str, Dict[str, Any]]], Optional[Dict[str, Any]]]
+
+
+class JobRecord:
+    __slots__ = RECORD_FIELDS + ("condition",)
+
+    def __init__(self, condition: threading.Condition, **fields: Any) -> None:
+        now = time.time()
+        self.status = "pending"
+        self.progress = 0
+        self.message = "Queued"
+        self.filepath: Optional[str] = None
+        self.error: Optional[str] = None
+        self.requested_format: Optional[str] = None
+        self.source_url: Optional[str] = None
+        self.priority = 0
+        self.client_id: Optional[str] = None
+        self.parent_id: Optional[str] = None
+        self.items: Optional[List[Dict[str, Any]]] = None
+        self.bytes_done: Optional[int] = None
+        self.bytes_total: Optional[int] = None
+        self.speed: Optional[float] = None
+        self.eta: Optional[float] = None
+        self.version = 0
+        self.created_at = now
+        self.updated_at = now
+        self.condition = condition
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in RECORD_FIELDS}
+
+
+class JobStore:
+    """Bounded registry of download jobs with optional SQLite persistence.
+
+    Finished jobs are evicted ``ttl`` seconds after their last update, and the
+    store never holds more than ``max_jobs`` entries (oldest finished jobs go
+    first). With ``db_path`` set, durable fields are written to a WAL-mode
+    SQLite database so jobs and their result files survive a restart.
+    """
+
+    SWEEP_INTERVAL = 30.0
+
+    def __init__(self, db_path: Optional[str] = None, ttl: float = 3600.0, max_jobs: int = 10000) -> None:
+        self.ttl = float(ttl)
+        self.max_jobs = max(1, int(max_jobs))
+        self._jobs: Dict[str, JobRecord] = {}
+        self._lock = threading.Lock()
+        self._parent_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._open_db(db_path)
+            self._load()
+
+    def _open_db(self, db_path: str) -> None:
+        self._db = _connect(db_path)
+
+    def _load(self) -> None:
+        cutoff = time.time() - self.ttl
+        with self._db_lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*TERMINAL_STATUSES, cutoff),
+            )
+            rows = self._db.execute(
+                "SELECT job_id, status, progress, message, filepath, error, requested_format,"
+                " source_url, priority, client_id, parent_id, items, created_at, updated_at FROM jobs"
+            ).fetchall()
+        with self._lock:
+            for row in rows:
+                job_id, status, progress, message, filepath, error, fmt, url, priority, client = row[:10]
+                parent_id, items, created, updated = row[10:]
+                self._jobs[job_id] = JobRecord(
+                    threading.Condition(self._lock),
+                    status=status,
+                    progress=progress or 0,
+                    message=message or "",
+                    filepath=filepath,
+                    error=error,
+                    requested_format=fmt,
+                    source_url=url,
+                    priority=priority or 0,
+                    client_id=client,
+                    parent_id=parent_id,
+                    items=json.loads(items) if items else None,
+                    created_at=created,
+                    updated_at=updated,
+                )
+
+    def _persist(self, job_id: str, data: Dict[str, Any]) -> None:
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, status, progress, message, filepath, error,"
+                " requested_format, source_url, priority, client_id, parent_id, items, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    data["status"],
+                    data["progress"],
+                    data["message"],
+                    data["filepath"],
+                    data["error"],
+                    data["requested_format"],
+                    data["source_url"],
+                    data["priority"],
+                    data["client_id"],
+                    data["parent_id"],
+                    json.dumps(data["items"]) if data["items"] is not None else None,
+                    data["created_at"],
+                    data["updated_at"],
+                ),
+            )
+
+    def _forget(self, job_ids: List[str]) -> None:
+        if self._db is None or not job_ids:
+            return
+        with self._db_lock:
+            self._db.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+
+    def create(self, **fields: Any) -> str:
+        job_id = uuid.uuid4().hex
+        self.sweep()
+        with self._lock:
+            record = JobRecord(threading.Condition(self._lock), **fields)
+            self._jobs[job_id] = record
+            self._persist(job_id, record.as_dict())
+        return job_id
+
+    def update(self, job_id: str, **fields: Any) -> bool:
+        if not fields:
+            return False
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return False
+            changed = durable = False
+            for key, value in fields.items():
+                if getattr(record, key) != value:
+                    setattr(record, key, value)
+                    changed = True
+                    durable = durable or key in DURABLE_FIELDS
+            if not changed:
+                return False
+            record.version += 1
+            record.updated_at = time.time()
+            record.condition.notify_all()
+            # Written under the store lock so snapshots reach SQLite in order.
+            if durable:
+                self._persist(job_id, record.as_dict())
+        return True
+
+    def update_parent(self, parent_id: str, summarize: Summarize) -> bool:
+        """Recompute a parent job from its children as one atomic step.
+
+        ``summarize(parent, children)`` gets the parent and its child jobs
+        keyed by job id, and returns the fields to update or ``None``.
+        """
+        with self._parent_lock:
+            parent = self.get(parent_id)
+            if parent is None:
+                return False
+            with self._lock:
+                children = {
+                    job_id: record.as_dict() for job_id, record in self._jobs.items() if record.parent_id == parent_id
+                }
+            fields = summarize(parent, children)
+            return bool(fields) and self.update(parent_id, **fields)
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            record = self._jobs.pop(job_id, None)
+            if record is not None:
+                record.condition.notify_all()
+        self._forget([job_id])
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._jobs.get(job_id)
+            return record.as_dict() if record is not None else None
+
+    def wait_for_change(self, job_id: str, since: int, timeout: float) -> Optional[Dict[str, Any]]:
+        """Block until the job's version moves past ``since`` or ``timeout`` expires."""
+        deadline = time.monotonic() + max(0.0, timeout)
+        with self._lock:
+            record = self._jobs.get(job_id)
+            while record is not None and record.version <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                record.condition.wait(remaining)
+                record = self._jobs.get(job_id)
+            return record.as_dict() if record is not None else None
+
+    def interrupted(self) -> List[Dict[str, Any]]:
+        """Jobs that were still queued or running, e.g. when the process died."""
+        with self._lock:
+            return [
+                dict(record.as_dict(), job_id=job_id)
+                for job_id, record in self._jobs.items()
+                if record.status not in TERMINAL_STATUSES
+            ]
+
+    def sweep(self, force: bool = False) -> int:
+        """Evict expired finished jobs and enforce ``max_jobs``; returns the count."""
+        now = time.time()
+        if not force and now - self._last_sweep < self.SWEEP_INTERVAL and len(self._jobs) < self.max_jobs:
+            return 0
+        self._last_sweep = now
+        cutoff = now - self.ttl
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, record in self._jobs.items()
+                if record.status in TERMINAL_STATUSES and record.updated_at < cutoff
+            ]
+            overflow = len(self._jobs) - len(expired) - (self.max_jobs - 1)
+            if overflow > 0:
+                finished = sorted(
+                    (record.updated_at, job_id)
+                    for job_id, record in self._jobs.items()
+                    if record.status in TERMINAL_STATUSES and job_id not in expired
+                )
+                expired.extend(job_id for _, job_id in finished[:overflow])
+            for job_id in expired:
+                self._jobs.pop(job_id).condition.notify_all()
+        self._forget(expired)
+        return len(expired)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+
+class SharedJobStore(JobStore):
+    """Job registry kept entirely in SQLite so several processes can share it.
+
+    Every gunicorn worker opens the same database file: any worker can answer
+    status and file requests for any job. Queued jobs double as a work queue;
+    :meth:`claim_next` hands each one to exactly one process together with a
+    lease that the owner renews while the job runs. Jobs whose lease lapses
+    (the owning worker died) are put back in the queue by
+    :meth:`reclaim_expired`.
+
+    Progress-only updates are coalesced to one write per
+    ``PROGRESS_FLUSH_INTERVAL``; repeating the status this process last
+    wrote still counts as progress-only. Waiters in other processes poll
+    every ``POLL_INTERVAL``.
+    """
+
+    PROGRESS_FLUSH_INTERVAL = 0.5
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, db_path: str, ttl: float = 3600.0, max_jobs: int = 10000, lease: float = 30.0) -> None:
+        self.db_path = db_path
+        self.lease = float(lease)
+        self._pid = 0
+        self._changed = threading.Condition()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._flushed_at: Dict[str, float] = {}
+        self._statuses: Dict[str, str] = {}
+        super().__init__(db_path=None, ttl=ttl, max_jobs=max_jobs)
+        self._conn()
+
+    @property
+    def owner(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _conn(self) -> sqlite3.Connection:
+        # SQLite handles must not cross fork(); reopen in each worker process.
+        if self._db is None or self._pid != os.getpid():
+            self._db = _connect(self.db_path)
+            self._pid = os.getpid()
+        return self._db
+
+    def _execute(self, sql: str, params: Iterable[Any] = ()) -> int:
+        with self._db_lock:
+            return self._conn().execute(sql, tuple(params)).rowcount
+
+    def _query(self, sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+        with self._db_lock:
+            return self._conn().execute(sql, tuple(params)).fetchall()
+
+    def _row_to_dict(self, row: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(zip(RECORD_FIELDS, row))
+        job["items"] = json.loads(job["items"]) if job["items"] else None
+        job["progress"] = job["progress"] or 0
+        job["message"] = job["message"] or ""
+        job["priority"] = job["priority"] or 0
+        job["version"] = job["version"] or 0
+        return job
+
+    def _notify(self) -> None:
+        with self._changed:
+            self._changed.notify_all()
+
+    def create(self, **fields: Any) -> str:
+        job_id = uuid.uuid4().hex
+        self.sweep()
+        record = JobRecord(self._changed, **fields).as_dict()
+        record["items"] = json.dumps(record["items"]) if record["items"] is not None else None
+        self._execute(
+            f"INSERT INTO jobs (job_id, {', '.join(RECORD_FIELDS)})"
+            f" VALUES (?, {', '.join('?' for _ in RECORD_FIELDS)})",
+            [job_id] + [record[field] for field in RECORD_FIELDS],
+        )
+        return job_id
+
+    def update(self, job_id: str, **fields: Any) -> bool:
+        if not fields:
+            return False
+        for key in fields:
+            if key not in RECORD_FIELDS or key in ("version", "created_at", "updated_at"):
+                raise AttributeError(key)
+        now = time.monotonic()
+        with self._lock:
+            # Progress hooks pass the job's status with every tick.
+            if "status" in fields and fields["status"] == self._statuses.get(job_id):
+                fields = {key: value for key, value in fields.items() if key != "status"}
+                if not fields:
+                    return False
+            if all(key in VOLATILE_FIELDS for key in fields):
+                self._pending.setdefault(job_id, {}).update(fields)
+                if now - self._flushed_at.get(job_id, 0.0) < self.PROGRESS_FLUSH_INTERVAL:
+                    return True
+            fields = dict(self._pending.pop(job_id, {}), **fields)
+            if fields.get("status") in TERMINAL_STATUSES:
+                self._flushed_at.pop(job_id, None)
+                self._statuses.pop(job_id, None)
+            else:
+                self._flushed_at[job_id] = now
+                if "status" in fields:
+                    self._statuses[job_id] = fields["status"]
+        with self._db_lock:
+            changed = self._write_locked(self._conn(), job_id, fields)
+        if changed <= 0:
+            return False
+        self._notify()
+        return True
+
+    def _write_locked(self, conn: sqlite3.Connection, job_id: str, fields: Dict[str, Any]) -> int:
+        if "items" in fields and fields["items"] is not None:
+            fields = dict(fields, items=json.dumps(fields["items"]))
+        keys = list(fields)
+        # One statement: only bumps the version when a value actually differs.
+        return conn.execute(
+            f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in keys)},"
+            " version = version + 1, updated_at = ?"
+            f" WHERE job_id = ? AND NOT ({' AND '.join(f'{key} IS ?' for key in keys)})",
+            [fields[key] for key in keys] + [time.time(), job_id] + [fields[key] for key in keys],
+        ).rowcount
+
+    def update_parent(self, parent_id: str, summarize: Summarize) -> bool:
+        # Read and written in one write transaction, so processes finishing
+        # sibling jobs at the same time cannot overwrite each other.
+        columns = ", ".join(RECORD_FIELDS)
+        changed = 0
+        with self._db_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(f"SELECT {columns} FROM jobs WHERE job_id = ?", (parent_id,)).fetchone()
+                if row is not None:
+                    rows = conn.execute(f"SELECT job_id, {columns} FROM jobs WHERE parent_id = ?", (parent_id,))
+                    children = {child[0]: self._row_to_dict(child[1:]) for child in rows}
+                    fields = summarize(self._row_to_dict(row), children)
+                    if fields:
+                        changed = self._write_locked(conn, parent_id, fields)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if changed <= 0:
+            return False
+        self._notify()
+        return True
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            self._pending.pop(job_id, None)
+            self._flushed_at.pop(job_id, None)
+            self._statuses.pop(job_id, None)
+        self._execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        self._notify()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query(f"SELECT {', '.join(RECORD_FIELDS)} FROM jobs WHERE job_id = ?", (job_id,))
+        return self._row_to_dict(rows[0]) if rows else None
+
+    def wait_for_change(self, job_id: str, since: int, timeout: float) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["version"] > since or remaining <= 0:
+                return job
+            # Local writers notify immediately; other processes are polled.
+            with self._changed:
+                self._changed.wait(min(remaining, self.POLL_INTERVAL))
+
+    def interrupted(self) -> List[Dict[str, Any]]:
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        rows = self._query(
+            f"SELECT job_id, {', '.join(RECORD_FIELDS)} FROM jobs WHERE status NOT IN ({placeholders})",
+            TERMINAL_STATUSES,
+        )
+        return [dict(self._row_to_dict(row[1:]), job_id=row[0]) for row in rows]
+
+    def claim_next(self, client_limit: int = 0, priority_below: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Take ownership of the highest-priority queued job, if any.
+
+        Among equal priorities, the job of the client with the fewest
+        running jobs wins; with ``client_limit`` set, clients already
+        running that many jobs are passed over. ``priority_below`` limits
+        the claim to jobs with a lower priority value.
+        """
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        running = (
+            "(SELECT COUNT(*) FROM jobs AS running WHERE running.client_id = jobs.client_id"
+            f" AND running.owner IS NOT NULL AND running.status NOT IN ({placeholders}))"
+        )
+        where = "jobs.status = 'queued' AND jobs.owner IS NULL"
+        params: List[Any] = []
+        if client_limit > 0:
+            where += f" AND (jobs.client_id IS NULL OR {running} < ?)"
+            params += [*TERMINAL_STATUSES, client_limit]
+        if priority_below is not None:
+            where += " AND jobs.priority < ?"
+            params.append(priority_below)
+        with self._db_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    f"SELECT job_id, {', '.join(RECORD_FIELDS)} FROM jobs WHERE {where}"
+                    f" ORDER BY jobs.priority, CASE WHEN jobs.client_id IS NULL THEN 0 ELSE {running} END,"
+                    " jobs.created_at LIMIT 1",
+                    params + list(TERMINAL_STATUSES),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET owner = ?, lease_until = ? WHERE job_id = ?",
+                        (self.owner, time.time() + self.lease, row[0]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = dict(self._row_to_dict(row[1:]), job_id=row[0])
+        with self._lock:
+            self._statuses[job["job_id"]] = job["status"]
+        return job
+
+    def renew(self, job_ids: Iterable[str]) -> None:
+        lease_until = time.time() + self.lease
+        with self._db_lock:
+            self._conn().executemany(
+                "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND owner = ?",
+                [(lease_until, job_id, self.owner) for job_id in job_ids],
+            )
+
+    def reclaim_expired(self) -> int:
+        """Re-queue jobs whose owner stopped renewing its lease; returns the count."""
+        now = time.time()
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        # Batch parents never have an owner; they finish with their children.
+        stale = (
+            f"status NOT IN ({placeholders}) AND ("
+            " (owner IS NOT NULL AND lease_until < ?)"
+            " OR (owner IS NULL AND status != 'queued' AND updated_at < ?"
+            " AND NOT EXISTS (SELECT 1 FROM jobs AS child WHERE child.parent_id = jobs.job_id)))"
+        )
+        params = [*TERMINAL_STATUSES, now, now - self.lease]
+        with self._db_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                failed = conn.execute(
+                    "UPDATE jobs SET status = 'error', error = 'Interrupted by restart',"
+                    " message = 'Interrupted by restart', owner = NULL,"
+                    f" version = version + 1, updated_at = ? WHERE source_url IS NULL AND {stale}",
+                    [now] + params,
+                ).rowcount
+                requeued = conn.execute(
+                    "UPDATE jobs SET status = 'queued', progress = 0, message = 'Re-queued after restart',"
+                    f" owner = NULL, version = version + 1, updated_at = ? WHERE {stale}",
+                    [now] + params,
+                ).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if failed or requeued:
+            self._notify()
+        return failed + requeued
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        rows = self._query(
+            "SELECT COUNT(*) FROM jobs AS ahead, jobs AS target"
+            " WHERE target.job_id = ? AND target.status = 'queued' AND target.owner IS NULL"
+            " AND ahead.status = 'queued' AND ahead.owner IS NULL"
+            " AND (ahead.priority < target.priority"
+            " OR (ahead.priority = target.priority AND ahead.created_at <= target.created_at))",
+            (job_id,),
+        )
+        return rows[0][0] or None
+
+    def queued_count(self, client_id: Optional[str] = None) -> int:
+        if client_id is not None:
+            return self._query(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND owner IS NULL AND client_id = ?",
+                (client_id,),
+            )[0][0]
+        return self._query("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND owner IS NULL")[0][0]
+
+    def sweep(self, force: bool = False) -> int:
+        now = time.time()
+        if not force and now - self._last_sweep < self.SWEEP_INTERVAL:
+            return 0
+        self._last_sweep = now
+        placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+        removed = self._execute(
+            f"DELETE FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+            [*TERMINAL_STATUSES, now - self.ttl],
+        )
+        overflow = len(self) - (self.max_jobs - 1)
+        if overflow > 0:
+            removed += self._execute(
+                "DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs"
+                f" WHERE status IN ({placeholders}) ORDER BY updated_at LIMIT ?)",
+                [*TERMINAL_STATUSES, overflow],
+            )
+        return removed
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM jobs")[0][0]
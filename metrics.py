@@ -0,0 +1,176 @@
+import abc
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Each metric has its own lock, held only to bump a number.
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Exposition lines for the metric's current values."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """A value read from ``func`` each time the metrics are rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]) -> None:
+        super().__init__(name, documentation)
+        self.func = func
+
+    def samples(self) -> List[str]:
+        try:
+            value = float(self.func())
+        except Exception as exc:
+            print(f"Metric {self.name} failed: {exc}")
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float]) -> None:
+        super().__init__(name, documentation)
+        self.buckets = sorted(float(bound) for bound in buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + [math.inf], counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+def exponential_buckets(start: float, factor: float, count: int) -> List[float]:
+    return [start * factor ** index for index in range(count)]
+
+
+def render(metrics: Optional[Sequence[_Metric]] = None) -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    if metrics is None:
+        with _registry_lock:
+            metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+EXTRACT_INFO_SECONDS = Histogram(
+    "downloader_extract_info_seconds",
+    "Time spent in yt-dlp metadata extraction.",
+    exponential_buckets(0.05, 2, 10),
+)
+TIME_TO_FIRST_BYTE_SECONDS = Histogram(
+    "downloader_time_to_first_byte_seconds",
+    "Time from the start of a download job to its first received byte.",
+    exponential_buckets(0.05, 2, 10),
+)
+DOWNLOAD_THROUGHPUT_BYTES = Histogram(
+    "downloader_download_throughput_bytes_per_second",
+    "Average transfer rate of finished downloads.",
+    exponential_buckets(64 * 1024, 4, 9),
+)
+POSTPROCESS_SECONDS = Histogram(
+    "downloader_postprocess_seconds",
+    "Time spent running ffmpeg post-processing, excluding the wait for a slot.",
+    exponential_buckets(0.1, 2, 10),
+)
+DOWNLOAD_FALLBACKS = Counter(
+    "downloader_fallbacks_total",
+    "Fallback branches taken by perform_download.",
+    ("branch",),
+)
+for _branch in ("cookie_failure", "no_cookie_retry", "api_fallback", "file_missing", "circuit_open"):
+    DOWNLOAD_FALLBACKS.inc(0, branch=_branch)
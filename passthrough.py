@@ -0,0 +1,93 @@
+import mimetypes
+import os
+from typing import Callable, Dict, Iterator, Optional
+
+import http_client
+
+PASSTHROUGH_CHUNK_SIZE = 256 * 1024
+
+
+class PassthroughStream:
+    """Streams an upstream HTTP body to the client while saving it to disk.
+
+    The upstream request is opened in the constructor so callers can copy its
+    length and type into their own response headers before iterating. The
+    body is written to ``<filepath>.part`` and renamed into place only after
+    the last byte arrived; ``on_complete`` or ``on_error`` is then called
+    exactly once.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        filepath: str,
+        headers: Optional[Dict[str, str]] = None,
+        on_complete: Optional[Callable[[str], None]] = None,
+        on_error: Optional[Callable[[BaseException], None]] = None,
+        timeout: float = 60,
+    ) -> None:
+        self.filepath = filepath
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self._finished = False
+        self.response = http_client.get(url, headers=headers or {}, stream=True, timeout=timeout)
+        try:
+            self.response.raise_for_status()
+        except Exception:
+            self.response.close()
+            raise
+
+    @property
+    def content_length(self) -> Optional[int]:
+        value = self.response.headers.get("Content-Length")
+        if value and "Content-Encoding" not in self.response.headers:
+            try:
+                return int(value)
+            except ValueError:
+                return None
+        return None
+
+    @property
+    def content_type(self) -> str:
+        guessed, _ = mimetypes.guess_type(self.filepath)
+        return guessed or self.response.headers.get("Content-Type") or "application/octet-stream"
+
+    def __iter__(self) -> Iterator[bytes]:
+        part = self.filepath + ".part"
+        written = 0
+        try:
+            with open(part, "wb") as fh:
+                for chunk in self.response.iter_content(chunk_size=PASSTHROUGH_CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    fh.write(chunk)
+                    written += len(chunk)
+                    yield chunk
+            expected = self.content_length
+            if expected is not None and written != expected:
+                raise IOError(f"Upstream closed after {written} of {expected} bytes")
+            os.replace(part, self.filepath)
+        except BaseException as exc:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+            self._finish(error=exc)
+            raise
+        self._finish()
+
+    def close(self) -> None:
+        # Called by the WSGI server even if the body was never iterated.
+        if not self._finished:
+            self._finish(error=ConnectionAbortedError("Client went away before streaming started"))
+
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        self.response.close()
+        if error is None:
+            if self.on_complete:
+                self.on_complete(self.filepath)
+        elif self.on_error:
+            self.on_error(error)
@@ -0,0 +1,120 @@
+import itertools
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from downloader_utils import yt_dlp
+
+PLAYLIST_WORKERS = int(os.environ.get("PLAYLIST_WORKERS", 3))
+PLAYLIST_MAX_ENTRIES = int(os.environ.get("PLAYLIST_MAX_ENTRIES", 200))
+
+# Entries that point at another list rather than a video, e.g. the
+# Videos/Shorts tabs yt-dlp returns for a bare YouTube channel URL.
+_NESTED_IE_SUFFIXES = ("Tab", "Playlist", "Channel")
+_MAX_DEPTH = 2
+
+
+def _is_nested(entry: Dict[str, Any]) -> bool:
+    if entry.get("entries") is not None:
+        return True
+    return entry.get("_type") == "url" and (entry.get("ie_key") or "").endswith(_NESTED_IE_SUFFIXES)
+
+
+class Playlist:
+    """A playlist or channel extracted flat, with entries fetched while iterated.
+
+    Only the first page is requested up front; iterating yields
+    ``{"url", "title"}`` for each video, paging through the listing and
+    descending into nested lists (channel tabs) as needed, up to ``limit``
+    entries. A URL that is not a list yields itself as its only entry.
+    """
+
+    def __init__(self, url: str, ydl_opts: Optional[Dict[str, Any]] = None, limit: int = PLAYLIST_MAX_ENTRIES) -> None:
+        options = dict(ydl_opts or {})
+        options.update(quiet=True, skip_download=True, extract_flat="in_playlist", lazy_playlist=True)
+        options.pop("noplaylist", None)
+        self.url = url
+        self.limit = max(1, limit)
+        self._ydl = yt_dlp.YoutubeDL(options)
+        try:
+            self.info = self._extract(url)
+        except Exception:
+            self.close()
+            raise
+
+    def _extract(self, url: str) -> Dict[str, Any]:
+        info = self._ydl.extract_info(url, download=False, process=False)
+        # Short links and embeds resolve to another URL before the listing.
+        for _ in range(3):
+            if not info or info.get("_type") not in ("url", "url_transparent") or _is_nested(info):
+                break
+            info = self._ydl.extract_info(info["url"], download=False, process=False, ie_key=info.get("ie_key"))
+        return info or {}
+
+    @property
+    def is_playlist(self) -> bool:
+        return self.info.get("entries") is not None
+
+    @property
+    def title(self) -> Optional[str]:
+        return self.info.get("title")
+
+    @property
+    def thumbnail(self) -> Optional[str]:
+        thumbnails = self.info.get("thumbnails") or []
+        return self.info.get("thumbnail") or (thumbnails[-1].get("url") if thumbnails else None)
+
+    def _walk(self, info: Dict[str, Any], depth: int) -> Iterator[Dict[str, Any]]:
+        for _, entry in yt_dlp.utils.PlaylistEntries(self._ydl, info).get_requested_items():
+            if not entry:
+                continue
+            if _is_nested(entry) and depth < _MAX_DEPTH:
+                nested = entry if entry.get("entries") is not None else self._extract(entry["url"])
+                if nested.get("entries") is not None:
+                    yield from self._walk(nested, depth + 1)
+                continue
+            url = entry.get("webpage_url") or entry.get("url")
+            if url:
+                yield {"url": url, "title": entry.get("title") or url}
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if not self.is_playlist:
+            return iter([{"url": self.info.get("webpage_url") or self.url, "title": self.title or self.url}])
+        return itertools.islice(self._walk(self.info, 0), self.limit)
+
+    def close(self) -> None:
+        self._ydl.close()
+
+
+def run_bounded(
+    items: Iterable[Any],
+    func: Callable[[Any], Any],
+    workers: int = PLAYLIST_WORKERS,
+) -> Iterator[Tuple[Any, "Future[Any]"]]:
+    """Run ``func`` over ``items`` on ``workers`` threads, yielding in completion order.
+
+    ``items`` is only advanced when a worker is free, so a lazy playlist is
+    paged through at the pace of the downloads. Yields ``(item, future)``;
+    closing the iterator cancels everything not yet started.
+    """
+    workers = max(1, workers)
+    source = iter(items)
+    pending: Dict["Future[Any]", Any] = {}
+    exhausted = False
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="playlist-entry")
+    try:
+        while True:
+            while not exhausted and len(pending) < workers:
+                item = next(source, None)
+                if item is None:
+                    exhausted = True
+                    break
+                pending[pool.submit(func, item)] = item
+            if not pending:
+                return
+            done: Set["Future[Any]"]
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,228 @@
+import bisect
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+from downloader_utils import yt_dlp
+from metrics import POSTPROCESS_SECONDS
+
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", 0)) or os.cpu_count() or 1
+
+# Options that hold callables or only matter while downloading; everything
+# else is handed to the post-processing process unchanged.
+_DOWNLOAD_ONLY_OPTIONS = ("progress_hooks", "postprocessor_hooks", "retry_sleep_functions", "logger", "match_filter")
+
+ProgressHook = Callable[[Dict[str, Any]], None]
+
+
+def _picklable_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: value
+        for key, value in options.items()
+        if key not in _DOWNLOAD_ONLY_OPTIONS and not callable(value)
+    }
+
+
+def _run_postprocessors(
+    options: Dict[str, Any],
+    filename: str,
+    info: Dict[str, Any],
+    files_to_move: Dict[str, Any],
+    extra_pps: List[str],
+) -> Dict[str, Any]:
+    """Process-pool entry point: yt-dlp's post-processing for one download."""
+    from yt_dlp import postprocessor
+
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info["__postprocessors"] = [getattr(postprocessor, name)(ydl) for name in extra_pps]
+        result = ydl.post_process(filename, info, files_to_move)
+    result.pop("__postprocessors", None)
+    return yt_dlp.YoutubeDL.sanitize_info(result)
+
+
+class PostProcessPool:
+    """Process pool for ffmpeg work with its own priority queue.
+
+    At most ``workers`` jobs are handed to the executor at a time; callers
+    beyond that wait ordered by ``priority`` (lower first), then submission
+    order, and learn their position through ``on_queued``. The executor uses
+    ``forkserver`` so workers are not forked from a process full of threads.
+    """
+
+    def __init__(self, workers: int = POSTPROCESS_WORKERS) -> None:
+        self.workers = max(1, int(workers))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cond = threading.Condition()
+        self._waiting: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._running = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._cond:
+            if self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def run(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        on_queued: Optional[Callable[[int], None]] = None,
+        on_started: Optional[Callable[[], None]] = None,
+        priority: int = 0,
+    ) -> Any:
+        with self._cond:
+            ticket = (int(priority), next(self._counter))
+            bisect.insort(self._waiting, ticket)
+            position = self._waiting.index(ticket) + 1
+            if self._running < self.workers and len(self._waiting) == 1:
+                position = 0
+        if position and on_queued:
+            on_queued(position)
+        with self._cond:
+            while self._running >= self.workers or self._waiting[0] != ticket:
+                self._cond.wait()
+            self._waiting.pop(0)
+            self._running += 1
+        try:
+            if on_started:
+                on_started()
+            executor = self._get_executor()
+            try:
+                return executor.submit(func, *args).result()
+            except BrokenProcessPool:
+                with self._cond:
+                    if self._executor is executor:
+                        self._executor = None
+                raise
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+    def active_count(self) -> int:
+        with self._cond:
+            return self._running
+
+    def shutdown(self) -> None:
+        """Stop the worker processes; the next :meth:`run` starts new ones."""
+        with self._cond:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+_pool = PostProcessPool()
+_while_waiting: Callable[[], ContextManager[Any]] = nullcontext
+_local = threading.local()
+
+
+def configure(workers: int = POSTPROCESS_WORKERS, while_waiting: Optional[Callable[[], ContextManager[Any]]] = None) -> None:
+    """Resize the shared pool; ``while_waiting()`` wraps each wait for a result.
+
+    The app passes its download scheduler's ``blocking`` here so a download
+    slot is free for the next job while this one is being transcoded.
+    """
+    global _pool, _while_waiting
+    _pool = PostProcessPool(workers)
+    _while_waiting = while_waiting or nullcontext
+
+
+def get_pool() -> PostProcessPool:
+    return _pool
+
+
+@contextmanager
+def job_priority(priority: int) -> Iterator[None]:
+    """Queue this thread's :func:`finish` calls at ``priority`` on the pool."""
+    previous = getattr(_local, "priority", 0)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority() -> int:
+    return getattr(_local, "priority", 0)
+
+
+_deferring_class = None
+
+
+def deferred_youtube_dl(options: Dict[str, Any]) -> Any:
+    """A ``YoutubeDL`` that downloads but leaves post-processing for :func:`finish`.
+
+    Merging, audio extraction, thumbnail embedding and fixups are recorded
+    instead of run, so the calling thread only does network I/O.
+    """
+    global _deferring_class
+    if _deferring_class is None:
+
+        class DeferredPostProcessYoutubeDL(yt_dlp.YoutubeDL):
+            def __init__(self, params: Optional[Dict[str, Any]] = None, *args: Any, **kwargs: Any) -> None:
+                super().__init__(params, *args, **kwargs)
+                self.postprocess_options = _picklable_options(params or {})
+                self.deferred: List[Tuple[Dict[str, Any], Tuple[Any, ...]]] = []
+
+            def post_process(self, filename, info, files_to_move=None):
+                info["filepath"] = filename
+                extra_pps = [type(pp).__name__ for pp in info.pop("__postprocessors", None) or []]
+                task = (filename, self.sanitize_info(dict(info)), dict(files_to_move or {}), extra_pps)
+                self.deferred.append((info, task))
+                return info
+
+        _deferring_class = DeferredPostProcessYoutubeDL
+    return _deferring_class(options)
+
+
+def finish(ydl: Any, progress_hooks: Optional[List[ProgressHook]] = None) -> None:
+    """Run the post-processing recorded by ``ydl`` on the shared process pool.
+
+    Hooks receive ``{"status": "postprocess_queued", "queue_position": n}``
+    while waiting for a slot and ``{"status": "postprocessing"}`` once
+    started. The recorded info dicts are updated in place with the results.
+    """
+    tasks, ydl.deferred = ydl.deferred, []
+
+    def _emit(data: Dict[str, Any]) -> None:
+        for hook in progress_hooks or []:
+            hook(dict(data))
+
+    started: List[float] = []
+
+    def _on_started() -> None:
+        started.append(time.perf_counter())
+        _emit({"status": "postprocessing"})
+
+    for info, task in tasks:
+        started.clear()
+        with _while_waiting():
+            try:
+                result = _pool.run(
+                    _run_postprocessors,
+                    ydl.postprocess_options,
+                    *task,
+                    on_queued=lambda position: _emit({"status": "postprocess_queued", "queue_position": position}),
+                    on_started=_on_started,
+                    priority=current_priority(),
+                )
+            except Exception as err:
+                raise yt_dlp.utils.DownloadError(f"Postprocessing: {err}") from err
+            finally:
+                if started:
+                    POSTPROCESS_SECONDS.observe(time.perf_counter() - started[0])
+        info.clear()
+        info.update(result)
@@ -0,0 +1,106 @@
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+PROGRESS_PUBLISH_INTERVAL = float(os.environ.get("PROGRESS_PUBLISH_INTERVAL", 0.25))
+# Time constant of the throughput average: samples older than this count
+# for roughly a third of the reported speed.
+THROUGHPUT_WINDOW = float(os.environ.get("THROUGHPUT_WINDOW", 3.0))
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+class ProgressTracker:
+    """Byte counter for one job that publishes a throttled summary.
+
+    ``update`` runs on every chunk, possibly from several download threads;
+    it records the counts and returns straight away unless ``interval`` has
+    passed since the last publication. Publishing takes a sample, folds it
+    into a time-weighted moving average of the throughput and hands the
+    tracker to ``publish``. A thread that finds another one publishing
+    skips instead of waiting.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[["ProgressTracker"], None],
+        interval: float = PROGRESS_PUBLISH_INTERVAL,
+        window: float = THROUGHPUT_WINDOW,
+    ) -> None:
+        self.publish = publish
+        self.interval = max(0.0, float(interval))
+        self.window = max(0.001, float(window))
+        self.done = 0
+        self.total: Optional[int] = None
+        self.speed: Optional[float] = None
+        self._lock = threading.Lock()
+        self._published_at = 0.0
+        self._sample_at: Optional[float] = None
+        self._sample_done = 0
+
+    @property
+    def percent(self) -> Optional[float]:
+        if not self.total:
+            return None
+        return min(100.0, self.done * 100.0 / self.total)
+
+    @property
+    def eta(self) -> Optional[float]:
+        if not self.total or not self.speed:
+            return None
+        return max(0.0, (self.total - self.done) / self.speed)
+
+    def fields(self) -> Dict[str, Any]:
+        """The job-record fields describing this transfer."""
+        eta = self.eta
+        return {
+            "bytes_done": self.done,
+            "bytes_total": self.total,
+            "speed": round(self.speed, 1) if self.speed is not None else None,
+            "eta": round(eta, 1) if eta is not None else None,
+        }
+
+    def update(self, done: int, total: Optional[int] = None) -> None:
+        self.done = done
+        if total:
+            self.total = total
+        now = time.monotonic()
+        finished = bool(self.total) and done >= self.total
+        if not finished and now - self._published_at < self.interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._sample(now)
+            self._published_at = now
+            self.publish(self)
+        finally:
+            self._lock.release()
+
+    def _sample(self, now: float) -> None:
+        done = self.done
+        if self._sample_at is None or done < self._sample_done:
+            # First sample, or yt-dlp moved on to the next file of a merge.
+            self._sample_at, self._sample_done = now, done
+            return
+        elapsed = now - self._sample_at
+        if elapsed <= 0:
+            return
+        rate = (done - self._sample_done) / elapsed
+        if self.speed is None:
+            self.speed = rate
+        else:
+            weight = 1.0 - math.exp(-elapsed / self.window)
+            self.speed += weight * (rate - self.speed)
+        self._sample_at, self._sample_done = now, done
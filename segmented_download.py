@@ -0,0 +1,557 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+import async_http
+import http_client
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+MIN_SEGMENT_SIZE = 2 * 1024 * 1024
+STATE_SAVE_INTERVAL = 1.0
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+ProgressCallback = Callable[[int, int], None]
+# Called with each chunk's size; returns seconds to pause before the next read.
+Throttle = Callable[[int], float]
+
+_CONTENT_RANGE_RE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class ResourceChanged(Exception):
+    pass
+
+
+def part_path(filepath: str) -> str:
+    return filepath + PART_SUFFIX
+
+
+def state_path(filepath: str) -> str:
+    return filepath + STATE_SUFFIX
+
+
+def probe(url: str, headers: Dict[str, str], timeout: float = 30) -> Tuple[int, bool, Dict[str, str]]:
+    """Return ``(total_bytes, supports_ranges, validators)`` using a one-byte range request."""
+    probe_headers = dict(headers)
+    probe_headers["Range"] = "bytes=0-0"
+    with http_client.get(url, headers=probe_headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        if response.status_code == 206:
+            match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+            if match and match.group(3) != "*":
+                return int(match.group(3)), True, validators
+        total = int(response.headers.get("Content-Length") or 0)
+        return (total if response.status_code == 200 else 0), False, validators
+
+
+def split_ranges(total: int, connections: int, min_segment: int = MIN_SEGMENT_SIZE) -> List[Tuple[int, int]]:
+    """Split ``total`` bytes into at most ``connections`` inclusive byte ranges."""
+    if total <= 0:
+        return []
+    count = max(1, min(connections, total // max(1, min_segment)))
+    size = -(-total // count)
+    return [(start, min(start + size, total) - 1) for start in range(0, total, size)]
+
+
+class _Progress:
+    def __init__(
+        self,
+        total: int,
+        callback: Optional[ProgressCallback],
+        done: int = 0,
+        throttle: Optional[Throttle] = None,
+    ) -> None:
+        self.total = total
+        self.done = done
+        self.callback = callback
+        self.throttle = throttle
+        self.aborted = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, count: int) -> float:
+        """Count ``count`` bytes; returns how long the caller should pause."""
+        with self._lock:
+            self.done += count
+            done = self.done
+        if self.callback:
+            self.callback(done, self.total)
+        return self.throttle(count) if self.throttle else 0.0
+
+
+class _ResumeState:
+    """Per-range completion offsets persisted next to the ``.part`` file."""
+
+    def __init__(self, filepath: str, data: Dict[str, Any]) -> None:
+        self.path = state_path(filepath)
+        self.data = data
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    @classmethod
+    def load(cls, filepath: str) -> Optional["_ResumeState"]:
+        try:
+            with open(state_path(filepath), "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get("ranges"), list):
+            return None
+        return cls(filepath, data)
+
+    def matches(self, total: int, validators: Dict[str, Optional[str]]) -> bool:
+        if self.data.get("total") != total:
+            return False
+        for key in ("etag", "last_modified"):
+            old, new = self.data.get(key), validators.get(key)
+            if old and new:
+                return old == new
+        return False
+
+    @property
+    def ranges(self) -> List[List[int]]:
+        return self.data["ranges"]
+
+    def completed_bytes(self) -> int:
+        return sum(entry[2] for entry in self.ranges)
+
+    def advance(self, index: int, count: int) -> None:
+        with self._lock:
+            self.ranges[index][2] += count
+        if time.monotonic() - self._saved_at >= STATE_SAVE_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            payload = json.dumps(self.data)
+            self._saved_at = time.monotonic()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                fh.write(payload)
+            os.replace(tmp_path, self.path)
+
+    def discard(self) -> None:
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _if_range_value(validators: Dict[str, Optional[str]]) -> Optional[str]:
+    etag = validators.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return validators.get("last_modified")
+
+
+def _fetch_range(
+    url: str,
+    headers: Dict[str, str],
+    part: str,
+    index: int,
+    state: _ResumeState,
+    progress: _Progress,
+    timeout: float,
+) -> None:
+    start, end, done = state.ranges[index]
+    offset = start + done
+    if offset > end:
+        return
+    range_headers = dict(headers)
+    range_headers["Range"] = f"bytes={offset}-{end}"
+    if_range = _if_range_value(state.data)
+    if if_range:
+        range_headers["If-Range"] = if_range
+    remaining = end - offset + 1
+    try:
+        with http_client.get(url, headers=range_headers, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                if done:
+                    raise ResourceChanged(f"Server returned the full file for resumed range {offset}-{end}")
+                raise RangeNotSupported(f"Server ignored range {start}-{end}")
+            with open(part, "r+b") as fh:
+                fh.seek(offset)
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    if progress.aborted.is_set():
+                        raise IOError("Segmented download aborted")
+                    if not chunk:
+                        continue
+                    chunk = chunk[:remaining]
+                    fh.write(chunk)
+                    remaining -= len(chunk)
+                    state.advance(index, len(chunk))
+                    pause = progress.add(len(chunk))
+                    if remaining <= 0:
+                        break
+                    if pause > 0:
+                        time.sleep(pause)
+    finally:
+        state.save()
+    if remaining > 0:
+        raise IOError(f"Range {start}-{end} ended {remaining} bytes early")
+
+
+def _fetch_single(
+    url: str,
+    headers: Dict[str, str],
+    filepath: str,
+    progress_callback: Optional[ProgressCallback],
+    timeout: float,
+    throttle: Optional[Throttle] = None,
+) -> int:
+    part = part_path(filepath)
+    with http_client.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        progress = _Progress(int(response.headers.get("content-length") or 0), progress_callback, throttle=throttle)
+        with open(part, "wb") as fh:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                fh.write(chunk)
+                pause = progress.add(len(chunk))
+                if pause > 0:
+                    time.sleep(pause)
+    os.replace(part, filepath)
+    return progress.done
+
+
+def _fetch_ranged(
+    url: str,
+    headers: Dict[str, str],
+    filepath: str,
+    total: int,
+    validators: Dict[str, Optional[str]],
+    connections: int,
+    progress_callback: Optional[ProgressCallback],
+    timeout: float,
+    throttle: Optional[Throttle] = None,
+) -> int:
+    part = part_path(filepath)
+    state = _prepare_ranged(url, filepath, total, validators, connections)
+    progress = _Progress(total, progress_callback, done=state.completed_bytes(), throttle=throttle)
+    with ThreadPoolExecutor(max_workers=len(state.ranges), thread_name_prefix="segment") as pool:
+        futures = [
+            pool.submit(_fetch_range, url, headers, part, index, state, progress, timeout)
+            for index in range(len(state.ranges))
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            progress.aborted.set()
+            raise
+
+    return _finish_ranged(filepath, state, total)
+
+
+def _prepare_ranged(
+    url: str,
+    filepath: str,
+    total: int,
+    validators: Dict[str, Optional[str]],
+    connections: int,
+) -> _ResumeState:
+    """Resume state for ``filepath``, reusing a matching ``.part`` or starting a new one."""
+    part = part_path(filepath)
+    state = _ResumeState.load(filepath)
+    resumable = (
+        state is not None
+        and state.matches(total, validators)
+        and os.path.exists(part)
+        and os.path.getsize(part) == total
+    )
+    if state is None or not resumable:
+        state = _ResumeState(
+            filepath,
+            {
+                "url": url,
+                "total": total,
+                "etag": validators.get("etag"),
+                "last_modified": validators.get("last_modified"),
+                "ranges": [[start, end, 0] for start, end in split_ranges(total, connections)],
+            },
+        )
+        with open(part, "wb") as fh:
+            fh.truncate(total)
+        state.save()
+    return state
+
+
+def _finish_ranged(filepath: str, state: _ResumeState, total: int) -> int:
+    part = part_path(filepath)
+    if os.path.getsize(part) != total or state.completed_bytes() != total:
+        raise IOError("Segmented download size mismatch")
+    os.replace(part, filepath)
+    state.discard()
+    return total
+
+
+class _BridgedProgress:
+    """Byte counter for the event loop; the callback runs on the bridge thread.
+
+    Updates that arrive while a callback is still queued are folded into it,
+    so a slow callback delays progress reports but never the transfer.
+    """
+
+    def __init__(
+        self,
+        total: int,
+        callback: Optional[ProgressCallback],
+        done: int = 0,
+        throttle: Optional[Throttle] = None,
+    ) -> None:
+        self.total = total
+        self.done = done
+        self.callback = callback
+        self.throttle = throttle
+        self._queued = False
+
+    def add(self, count: int) -> float:
+        """Count ``count`` bytes; returns how long the caller should pause."""
+        self.done += count
+        if self.callback and not self._queued:
+            self._queued = True
+            async_http.bridge(self._deliver)
+        return self.throttle(count) if self.throttle else 0.0
+
+    def _deliver(self) -> None:
+        self._queued = False
+        if self.callback:
+            self.callback(self.done, self.total)
+
+
+async def _probe_async(url: str, headers: Dict[str, str], timeout: float) -> Tuple[int, bool, Dict[str, str]]:
+    probe_headers = dict(headers)
+    probe_headers["Range"] = "bytes=0-0"
+    async with await async_http.open_url(url, probe_headers, timeout) as response:
+        validators = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+        }
+        if response.status == 206:
+            match = _CONTENT_RANGE_RE.match(response.headers.get("content-range", ""))
+            if match and match.group(3) != "*":
+                return int(match.group(3)), True, validators
+        total = response.content_length or 0
+        return (total if response.status == 200 else 0), False, validators
+
+
+async def _copy_async(
+    response: async_http.Response,
+    fd: int,
+    offset: int,
+    limit: Optional[int],
+    on_written: Callable[[int], None],
+    progress: _BridgedProgress,
+) -> int:
+    """Copy the body to ``fd`` at ``offset`` in ASYNC_WRITE_BUFFER-sized writes; returns bytes written."""
+    buffer = bytearray()
+    written = 0
+    remaining = limit
+    async for chunk in response.iter_chunks():
+        if remaining is not None:
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        buffer += chunk
+        pause = progress.add(len(chunk))
+        if len(buffer) >= async_http.ASYNC_WRITE_BUFFER or remaining == 0:
+            await async_http.write_at(fd, bytes(buffer), offset + written)
+            written += len(buffer)
+            on_written(len(buffer))
+            buffer.clear()
+        if remaining == 0:
+            break
+        if pause > 0:
+            await asyncio.sleep(pause)
+    if buffer:
+        await async_http.write_at(fd, bytes(buffer), offset + written)
+        written += len(buffer)
+        on_written(len(buffer))
+    return written
+
+
+async def _fetch_range_async(
+    url: str,
+    headers: Dict[str, str],
+    fd: int,
+    index: int,
+    state: _ResumeState,
+    progress: _BridgedProgress,
+    timeout: float,
+) -> None:
+    start, end, done = state.ranges[index]
+    offset = start + done
+    if offset > end:
+        return
+    range_headers = dict(headers)
+    range_headers["Range"] = f"bytes={offset}-{end}"
+    if_range = _if_range_value(state.data)
+    if if_range:
+        range_headers["If-Range"] = if_range
+    expected = end - offset + 1
+    try:
+        async with await async_http.open_url(url, range_headers, timeout) as response:
+            if response.status != 206:
+                if done:
+                    raise ResourceChanged(f"Server returned the full file for resumed range {offset}-{end}")
+                raise RangeNotSupported(f"Server ignored range {start}-{end}")
+            written = await _copy_async(
+                response, fd, offset, expected, lambda count: state.advance(index, count), progress
+            )
+    finally:
+        state.save()
+    if written < expected:
+        raise IOError(f"Range {start}-{end} ended {expected - written} bytes early")
+
+
+async def _fetch_ranged_async(
+    url: str,
+    headers: Dict[str, str],
+    filepath: str,
+    total: int,
+    validators: Dict[str, Optional[str]],
+    connections: int,
+    progress_callback: Optional[ProgressCallback],
+    timeout: float,
+    throttle: Optional[Throttle] = None,
+) -> int:
+    state = _prepare_ranged(url, filepath, total, validators, connections)
+    progress = _BridgedProgress(total, progress_callback, done=state.completed_bytes(), throttle=throttle)
+    fd = os.open(part_path(filepath), os.O_WRONLY)
+    try:
+        tasks = [
+            asyncio.ensure_future(_fetch_range_async(url, headers, fd, index, state, progress, timeout))
+            for index in range(len(state.ranges))
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    finally:
+        os.close(fd)
+    return _finish_ranged(filepath, state, total)
+
+
+async def _fetch_single_async(
+    url: str,
+    headers: Dict[str, str],
+    filepath: str,
+    progress_callback: Optional[ProgressCallback],
+    timeout: float,
+    throttle: Optional[Throttle] = None,
+) -> int:
+    part = part_path(filepath)
+    async with await async_http.open_url(url, headers, timeout) as response:
+        progress = _BridgedProgress(response.content_length or 0, progress_callback, throttle=throttle)
+        fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            await _copy_async(response, fd, 0, None, lambda count: None, progress)
+        finally:
+            os.close(fd)
+    os.replace(part, filepath)
+    return progress.done
+
+
+async def _download_async(
+    url: str,
+    filepath: str,
+    headers: Dict[str, str],
+    connections: int,
+    progress_callback: Optional[ProgressCallback],
+    timeout: float,
+    throttle: Optional[Throttle] = None,
+) -> int:
+    try:
+        total, ranged, validators = await _probe_async(url, headers, timeout)
+    except OSError:
+        total, ranged, validators = 0, False, {}
+
+    if not ranged or total <= 0:
+        _ResumeState(filepath, {}).discard()
+        return await _fetch_single_async(url, headers, filepath, progress_callback, timeout, throttle)
+
+    try:
+        return await _fetch_ranged_async(
+            url, headers, filepath, total, validators, connections, progress_callback, timeout, throttle
+        )
+    except ResourceChanged:
+        _ResumeState(filepath, {}).discard()
+        return await _fetch_ranged_async(
+            url, headers, filepath, total, validators, connections, progress_callback, timeout, throttle
+        )
+    except RangeNotSupported:
+        _ResumeState(filepath, {}).discard()
+        return await _fetch_single_async(url, headers, filepath, progress_callback, timeout, throttle)
+
+
+def download_file(
+    url: str,
+    filepath: str,
+    headers: Optional[Dict[str, str]] = None,
+    connections: int = 4,
+    progress_callback: Optional[ProgressCallback] = None,
+    timeout: float = 60,
+    throttle: Optional[Throttle] = None,
+) -> int:
+    """Download ``url`` to ``filepath`` over up to ``connections`` parallel ranges.
+
+    Data is written to ``<filepath>.part`` with a JSON sidecar of per-range
+    offsets and the server's ETag/Last-Modified, so a later call for the same
+    path continues where a failed one stopped. Servers without range support
+    get a single large-buffer stream instead. Returns the number of bytes.
+
+    With the asyncio engine the connections run on the shared event loop
+    and this thread only waits; progress callbacks then come from the
+    bridge thread and have all run by the time this returns.
+
+    ``throttle`` is charged with every chunk received and paces the reads
+    by the pause it returns (see :class:`fair_share.BandwidthShaper`).
+    """
+    headers = dict(headers or {})
+    if async_http.is_enabled(url):
+        try:
+            return async_http.run(
+                _download_async(url, filepath, headers, max(1, connections), progress_callback, timeout, throttle)
+            )
+        finally:
+            async_http.wait_for_bridge()
+
+    try:
+        total, ranged, validators = probe(url, headers, timeout=timeout)
+    except requests.RequestException:
+        total, ranged, validators = 0, False, {}
+
+    if not ranged or total <= 0:
+        _ResumeState(filepath, {}).discard()
+        return _fetch_single(url, headers, filepath, progress_callback, timeout, throttle)
+
+    try:
+        return _fetch_ranged(
+            url, headers, filepath, total, validators, max(1, connections), progress_callback, timeout, throttle
+        )
+    except ResourceChanged:
+        _ResumeState(filepath, {}).discard()
+        return _fetch_ranged(
+            url, headers, filepath, total, validators, max(1, connections), progress_callback, timeout, throttle
+        )
+    except RangeNotSupported:
+        _ResumeState(filepath, {}).discard()
+        return _fetch_single(url, headers, filepath, progress_callback, timeout, throttle)
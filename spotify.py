@@ -1,31 +1,260 @@
 import os
-from typing import Optional
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
 
-import requests
-import yt_dlp
-from downloader_utils import resolve_download_path
-from ffmpeg_utils import ensure_ffmpeg, BIN_DIR
-from yt_dlp.utils import DownloadError
+import http_client
+import postprocess
+from downloader_utils import resolve_download_path, yt_dlp
+from ffmpeg_utils import BIN_DIR, wait_for_ffmpeg
+from ttl_cache import PersistentTTLCache
 
-ensure_ffmpeg()
+OEMBED_ENDPOINT = os.environ.get("SPOTIFY_OEMBED_URL", "https://open.spotify.com/oembed")
+SPOTIFY_CLIENT_ID = os.environ.get("SPOTIPY_CLIENT_ID") or os.environ.get("SPOTIFY_CLIENT_ID")
+SPOTIFY_CLIENT_SECRET = os.environ.get("SPOTIPY_CLIENT_SECRET") or os.environ.get("SPOTIFY_CLIENT_SECRET")
+SPOTIFY_TRACK_WORKERS = int(os.environ.get("SPOTIFY_TRACK_WORKERS", 4))
+SPOTIFY_CACHE_PATH = os.environ.get("SPOTIFY_CACHE_PATH", os.path.join("downloads", "spotify_cache.sqlite3"))
+SPOTIFY_METADATA_TTL = float(os.environ.get("SPOTIFY_METADATA_TTL", 7 * 86400))
+SPOTIFY_MATCH_TTL = float(os.environ.get("SPOTIFY_MATCH_TTL", 30 * 86400))
+COLLECTION_KINDS = ("playlist", "album")
 
-OEMBED_ENDPOINT = "https://open.spotify.com/oembed"
+_SPOTIFY_URL_RE = re.compile(
+    r"(?:open\.spotify\.com/(?:intl-[a-z-]+/)?|spotify:)(track|album|playlist)[/:]([A-Za-z0-9]+)",
+    re.IGNORECASE,
+)
+_client = None
+_client_lock = threading.Lock()
+_metadata_cache: Optional[PersistentTTLCache] = None
+_match_cache: Optional[PersistentTTLCache] = None
+_cache_lock = threading.Lock()
+
+
+def parse_spotify_url(spotify_url: str) -> Optional[Tuple[str, str]]:
+    """Return ``(kind, id)`` for track, album and playlist links or URIs."""
+    match = _SPOTIFY_URL_RE.search(spotify_url or '')
+    if not match:
+        return None
+    return match.group(1).lower(), match.group(2)
+
+
+def is_collection_url(spotify_url: str) -> bool:
+    parsed = parse_spotify_url(spotify_url)
+    return bool(parsed and parsed[0] in COLLECTION_KINDS)
+
+
+def track_url(track_id: str) -> str:
+    return f"https://open.spotify.com/track/{track_id}"
+
+
+def _get_caches() -> Tuple[PersistentTTLCache, PersistentTTLCache]:
+    """Track id -> oEmbed-style metadata, and track id -> resolved YouTube video id."""
+    global _metadata_cache, _match_cache
+    with _cache_lock:
+        if _metadata_cache is None:
+            directory = os.path.dirname(SPOTIFY_CACHE_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            _metadata_cache = PersistentTTLCache(
+                SPOTIFY_CACHE_PATH, "track_metadata", maxsize=4096, ttl=SPOTIFY_METADATA_TTL
+            )
+            _match_cache = PersistentTTLCache(
+                SPOTIFY_CACHE_PATH, "youtube_matches", maxsize=4096, ttl=SPOTIFY_MATCH_TTL
+            )
+    return _metadata_cache, _match_cache
+
+
+def get_youtube_match(track_id: Optional[str]) -> Optional[str]:
+    if not track_id:
+        return None
+    return _get_caches()[1].get(track_id)
+
+
+def remember_youtube_match(track_id: Optional[str], video_id: Optional[str]) -> None:
+    if track_id and video_id:
+        _get_caches()[1].set(track_id, video_id)
+
+
+def _get_client():
+    global _client
+    if _client is not None:
+        return _client
+    if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
+        raise RuntimeError("Spotify playlists and albums need SPOTIPY_CLIENT_ID and SPOTIPY_CLIENT_SECRET")
+    import spotipy
+    from spotipy.oauth2 import SpotifyClientCredentials
+
+    with _client_lock:
+        if _client is None:
+            _client = spotipy.Spotify(
+                auth_manager=SpotifyClientCredentials(
+                    client_id=SPOTIFY_CLIENT_ID,
+                    client_secret=SPOTIFY_CLIENT_SECRET,
+                ),
+                requests_timeout=10,
+                retries=3,
+            )
+    return _client
+
+
+def _track_entry(track: dict) -> Optional[dict]:
+    if not track or not track.get('id'):
+        return None
+    artists = ", ".join(artist.get('name') for artist in track.get('artists') or [] if artist.get('name'))
+    title = track.get('name') or ''
+    return {
+        'id': track['id'],
+        'title': title,
+        'artists': artists,
+        'query': f"{artists} - {title}" if artists else title,
+        'duration_ms': track.get('duration_ms'),
+    }
+
+
+def get_collection(spotify_url: str) -> Optional[dict]:
+    """Resolve every track of a playlist or album using paged bulk requests."""
+    parsed = parse_spotify_url(spotify_url)
+    if not parsed or parsed[0] not in COLLECTION_KINDS:
+        return None
+    kind, collection_id = parsed
+    client = _get_client()
+
+    tracks: List[dict] = []
+    if kind == 'playlist':
+        meta = client.playlist(collection_id, fields='name,images')
+        page = client.playlist_items(
+            collection_id,
+            fields='items(track(id,name,duration_ms,artists(name))),next',
+            limit=100,
+            additional_types=('track',),
+        )
+        while page:
+            for item in page.get('items') or []:
+                entry = _track_entry(item.get('track'))
+                if entry:
+                    tracks.append(entry)
+            page = client.next(page) if page.get('next') else None
+    else:
+        meta = client.album(collection_id)
+        page = meta.get('tracks')
+        while page:
+            for item in page.get('items') or []:
+                entry = _track_entry(item)
+                if entry:
+                    tracks.append(entry)
+            page = client.next(page) if page.get('next') else None
+
+    images = meta.get('images') or []
+    thumbnail = images[0].get('url') if images else None
+    metadata_cache = _get_caches()[0]
+    for track in tracks:
+        metadata_cache.set(
+            track['id'],
+            {'query': track['query'], 'title': track['title'], 'thumbnail': thumbnail, 'track_id': track['id']},
+        )
+    return {
+        'kind': kind,
+        'id': collection_id,
+        'title': meta.get('name') or f"Spotify {kind}",
+        'thumbnail': thumbnail,
+        'tracks': tracks,
+    }
+
+
+def download_tracks(
+    tracks: List[dict],
+    download_track: Callable[[dict, Callable[[dict], None]], Optional[str]],
+    on_update: Optional[Callable[[List[dict], bool], None]] = None,
+    workers: int = SPOTIFY_TRACK_WORKERS,
+) -> List[Optional[str]]:
+    """Run ``download_track`` for every track on a bounded pool.
+
+    ``download_track(track, hook)`` receives a yt-dlp progress hook for that
+    track. ``on_update(states, status_changed)`` gets a fresh list of
+    per-track states after each change; ``status_changed`` is false when
+    only a track's progress moved. Returns the resulting file paths in track order (``None`` on
+    failure).
+    """
+    states: List[Dict] = [
+        {'title': track.get('query') or track.get('title'), 'status': 'queued', 'progress': 0}
+        for track in tracks
+    ]
+    lock = threading.Lock()
+
+    def _publish(index: int, **fields) -> None:
+        with lock:
+            if all(states[index].get(key) == value for key, value in fields.items()):
+                return
+            status_changed = fields.get('status', states[index]['status']) != states[index]['status']
+            states[index].update(fields)
+            snapshot = [dict(state) for state in states]
+        if on_update:
+            on_update(snapshot, status_changed)
+
+    def _make_hook(index: int) -> Callable[[dict], None]:
+        def _hook(data: dict) -> None:
+            if data.get('status') == 'downloading':
+                total = data.get('total_bytes') or data.get('total_bytes_estimate')
+                done = data.get('downloaded_bytes') or 0
+                percent = int(done * 90 / total) if total else 1
+                _publish(index, status='downloading', progress=max(1, min(90, percent)))
+            elif data.get('status') == 'finished':
+                _publish(index, status='downloading', progress=90)
+            elif data.get('status') == 'postprocess_queued':
+                _publish(index, status='processing_queued', progress=92)
+            elif data.get('status') == 'postprocessing':
+                _publish(index, status='processing', progress=95)
+        return _hook
+
+    def _run(index: int) -> Optional[str]:
+        _publish(index, status='downloading', progress=1)
+        try:
+            path = download_track(tracks[index], _make_hook(index))
+        except Exception as exc:
+            print(f"Spotify track failed ({states[index]['title']}): {exc}")
+            path = None
+        if path and os.path.exists(path):
+            _publish(index, status='completed', progress=100)
+        else:
+            _publish(index, status='error', progress=0)
+        return path
+
+    results: List[Optional[str]] = [None] * len(tracks)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="spotify-track") as pool:
+        futures = {pool.submit(_run, index): index for index in range(len(tracks))}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
 
 
 def get_track_metadata(spotify_url: str) -> Optional[dict]:
+    parsed = parse_spotify_url(spotify_url)
+    track_id = parsed[1] if parsed and parsed[0] == 'track' else None
+    metadata_cache = _get_caches()[0] if track_id else None
+    if metadata_cache is not None:
+        found, negative, cached = metadata_cache.lookup(track_id)
+        if found:
+            return None if negative else cached
+
     try:
-        response = requests.get(OEMBED_ENDPOINT, params={'url': spotify_url}, timeout=10)
+        response = http_client.get(OEMBED_ENDPOINT, params={'url': spotify_url}, timeout=10)
         response.raise_for_status()
         data = response.json()
         title = data.get('title')
         if not title:
+            if metadata_cache is not None:
+                metadata_cache.set_negative(track_id, None)
             return None
         thumbnail = data.get('thumbnail_url')
-        return {
+        metadata = {
             'query': title,
             'title': title,
-            'thumbnail': thumbnail
+            'thumbnail': thumbnail,
+            'track_id': track_id,
         }
+        if metadata_cache is not None:
+            metadata_cache.set(track_id, metadata)
+        return metadata
     except Exception as exc:
         print(f"Error fetching Spotify metadata: {exc}")
         return None
@@ -36,16 +265,27 @@ def get_track_info(spotify_url: str) -> Optional[str]:
     return metadata['query'] if metadata else None
 
 
-def download_from_youtube(query: str, progress_hook=None) -> Optional[str]:
+def download_from_youtube(
+    query: str,
+    progress_hook=None,
+    output_dir: str = 'downloads',
+    track_id: Optional[str] = None,
+) -> Optional[str]:
     if not query:
         return None
 
+    # A previously resolved match skips the ytsearch round trip entirely.
+    video_id = get_youtube_match(track_id)
+    target = f"https://www.youtube.com/watch?v={video_id}" if video_id else f"ytsearch1:{query}"
     print(f"🔍 Searching and downloading: {query}")
-    os.makedirs('downloads', exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    if not wait_for_ffmpeg():
+        print("Spotify download error: ffmpeg is not available to convert the audio")
+        return None
 
     base_opts = {
         'format': 'bestaudio/best',
-        'outtmpl': 'downloads/%(title)s(-by Alex).%(ext)s',
+        'outtmpl': os.path.join(output_dir, '%(title)s(-by Alex).%(ext)s'),
         'writethumbnail': True,
         'postprocessors': [
             {
@@ -60,6 +300,7 @@ def download_from_youtube(query: str, progress_hook=None) -> Optional[str]:
         'quiet': True,
         'noplaylist': True,
         'overwrites': True,
+        'continuedl': True,
         'ffmpeg_location': str(BIN_DIR),
     }
 
@@ -69,22 +310,30 @@ def download_from_youtube(query: str, progress_hook=None) -> Optional[str]:
     def _run(opts):
         if progress_hook:
             opts['progress_hooks'] = opts.get('progress_hooks', []) + [progress_hook]
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            search_result = ydl.extract_info(f"ytsearch1:{query}", download=True)
-            filepath = resolve_download_path(search_result, ydl, opts.get('outtmpl'))
-            if not filepath and 'entries' in search_result:
+        with postprocess.deferred_youtube_dl(opts) as ydl:
+            search_result = ydl.extract_info(target, download=True)
+            postprocess.finish(ydl, opts.get('progress_hooks'))
+            info = search_result
+            if 'entries' in search_result:
                 entries = search_result.get('entries') or []
-                if not entries:
+                info = entries[0] if entries else None
+            filepath = resolve_download_path(search_result, ydl, opts.get('outtmpl'))
+            if not filepath and info is not search_result:
+                if info is None:
                     return None
-                info = entries[0]
                 filepath = resolve_download_path(info, ydl, opts.get('outtmpl'))
             if not filepath or not os.path.exists(filepath):
                 raise FileNotFoundError(f"Spotify download finished but file missing: {filepath or 'unknown'}")
+            if info and not video_id:
+                remember_youtube_match(track_id, info.get('id'))
             return filepath
 
     try:
         return _run(dict(base_opts))
-    except DownloadError as error:
+    except yt_dlp.utils.DownloadError as error:
+        if video_id:
+            # The remembered video may have been removed; search again next time.
+            _get_caches()[1].pop(track_id)
         if base_opts.get('cookiefile'):
             print(f"Spotify download failed with cookies, retrying without... Error: {error}")
             fallback_opts = dict(base_opts)
@@ -0,0 +1,293 @@
+import os
+import shutil
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+PIN_NAME = ".pin"
+LEFTOVER_SUFFIXES = (".part", ".part.json", ".ytdl", ".webp", ".jpg", ".jpeg", ".png", ".temp")
+
+
+def is_leftover(path: str) -> bool:
+    name = os.path.basename(path).lower()
+    return name.startswith(".") or name.endswith(LEFTOVER_SUFFIXES) or ".part-frag" in name
+
+
+class StorageManager:
+    """Keeps the downloads folder under a byte quota.
+
+    Finished media files are indexed with their size and last time they were
+    served; when the total exceeds ``quota_bytes`` the least recently served
+    files are deleted together with their cache directory. Paths pinned by a
+    running job or an in-flight response are never evicted; a pin inside a
+    cache directory also holds a shared lock on its ``.pin`` file, so other
+    processes sharing ``root`` spare it as well. The index is
+    built once from disk and then kept current through :meth:`track`, so
+    normal requests never walk the folder.
+    """
+
+    def __init__(self, root: str, quota_bytes: int = 0, orphan_age: float = 3600.0) -> None:
+        self.root = os.path.abspath(root)
+        self.quota_bytes = max(0, int(quota_bytes))
+        self.orphan_age = float(orphan_age)
+        self._files: Dict[str, Tuple[int, float]] = {}
+        self._total = 0
+        self._pins: Counter = Counter()
+        self._pin_files: Dict[str, List[IO[str]]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def _key_dir(self, path: str) -> Optional[str]:
+        parent = os.path.dirname(os.path.abspath(path))
+        if os.path.dirname(parent) == self.root:
+            return parent
+        return None
+
+    def _pin_dir(self, path: str) -> Optional[str]:
+        if os.path.dirname(path) == self.root:
+            return path
+        return self._key_dir(path)
+
+    def _lock_dir(self, key_dir: str, exclusive: bool) -> Optional[IO[str]]:
+        """Open and flock ``key_dir``'s pin file.
+
+        A shared lock waits for and creates the directory; an exclusive one
+        raises ``BlockingIOError`` if the directory is pinned anywhere and
+        returns ``None`` if it is gone.
+        """
+        if fcntl is None:
+            return None
+        path = os.path.join(key_dir, PIN_NAME)
+        while True:
+            try:
+                if not exclusive:
+                    os.makedirs(key_dir, exist_ok=True)
+                fh = open(path, "a")
+            except OSError:
+                return None
+            try:
+                fcntl.flock(fh, (fcntl.LOCK_EX | fcntl.LOCK_NB) if exclusive else fcntl.LOCK_SH)
+            except OSError:
+                fh.close()
+                raise
+            # The directory may have been removed while waiting for the lock.
+            try:
+                if os.stat(path).st_ino == os.fstat(fh.fileno()).st_ino:
+                    return fh
+            except OSError:
+                pass
+            fh.close()
+
+    def scan(self) -> None:
+        """Rebuild the index from the cache directories under ``root``."""
+        files: Dict[str, Tuple[int, float]] = {}
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            for child in os.scandir(entry.path):
+                if not child.is_file() or is_leftover(child.path):
+                    continue
+                stat = child.stat()
+                files[os.path.abspath(child.path)] = (stat.st_size, stat.st_atime)
+        with self._lock:
+            # Keep entries tracked while scanning, but drop files another
+            # process has since evicted.
+            for path, entry in self._files.items():
+                if path in files or os.path.exists(path):
+                    files[path] = entry
+            self._files = files
+            self._total = sum(size for size, _ in files.values())
+
+    def track(self, path: str) -> None:
+        path = os.path.abspath(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            previous = self._files.get(path)
+            if previous:
+                self._total -= previous[0]
+            self._files[path] = (size, time.time())
+            self._total += size
+        self.enforce()
+
+    def touch(self, path: str) -> None:
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry:
+                self._files[path] = (entry[0], time.time())
+
+    def pin(self, path: str) -> None:
+        path = os.path.abspath(path)
+        key_dir = self._pin_dir(path)
+        handle = self._lock_dir(key_dir, exclusive=False) if key_dir else None
+        with self._lock:
+            self._pins[path] += 1
+            if handle is not None:
+                self._pin_files[path].append(handle)
+
+    def unpin(self, path: str) -> None:
+        path = os.path.abspath(path)
+        handle = None
+        with self._lock:
+            self._pins[path] -= 1
+            if self._pins[path] <= 0:
+                del self._pins[path]
+            handles = self._pin_files.get(path)
+            if handles:
+                handle = handles.pop()
+            if not handles:
+                self._pin_files.pop(path, None)
+        if handle is not None:
+            handle.close()
+
+    @contextmanager
+    def pinned(self, path: str) -> Iterator[None]:
+        self.pin(path)
+        try:
+            yield
+        finally:
+            self.unpin(path)
+
+    def _is_pinned_locked(self, path: str) -> bool:
+        return path in self._pins or os.path.dirname(path) in self._pins
+
+    def is_pinned(self, path: str) -> bool:
+        with self._lock:
+            return self._is_pinned_locked(os.path.abspath(path))
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total
+
+    def enforce(self) -> List[str]:
+        """Evict least recently served files until the quota is met."""
+        if not self.quota_bytes:
+            return []
+        victims: List[str] = []
+        held: List[IO[str]] = []
+        with self._lock:
+            if self._total <= self.quota_bytes:
+                return []
+            excess = self._total - self.quota_bytes
+            for path, (size, _) in sorted(self._files.items(), key=lambda item: item[1][1]):
+                if excess <= 0:
+                    break
+                if self._is_pinned_locked(path):
+                    continue
+                key_dir = self._key_dir(path)
+                if key_dir:
+                    try:
+                        handle = self._lock_dir(key_dir, exclusive=True)
+                    except OSError:
+                        # Pinned by another process.
+                        continue
+                    if handle is not None:
+                        held.append(handle)
+                victims.append(path)
+                excess -= size
+            for path in victims:
+                self._total -= self._files.pop(path)[0]
+        try:
+            for path in victims:
+                self._remove(path)
+        finally:
+            for handle in held:
+                handle.close()
+        return victims
+
+    def _remove(self, path: str) -> None:
+        key_dir = self._key_dir(path)
+        if key_dir:
+            shutil.rmtree(key_dir, ignore_errors=True)
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def sweep_orphans(self) -> int:
+        """Delete stale partial files, thumbnails and empty cache directories."""
+        cutoff = time.time() - self.orphan_age
+        removed = 0
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            with self._lock:
+                if entry.path in self._pins:
+                    continue
+            try:
+                handle = self._lock_dir(entry.path, exclusive=True)
+            except OSError:
+                # Pinned by another process.
+                continue
+            try:
+                removed += self._sweep_dir(entry.path, cutoff)
+            finally:
+                if handle is not None:
+                    handle.close()
+        return removed
+
+    def _sweep_dir(self, key_dir: str, cutoff: float) -> int:
+        removed = 0
+        remaining = []
+        for child in os.scandir(key_dir):
+            if not child.is_file() or not is_leftover(child.path) or child.name in (".complete", PIN_NAME):
+                remaining.append(child.name)
+                continue
+            try:
+                if child.stat().st_mtime < cutoff:
+                    os.remove(child.path)
+                    removed += 1
+                    continue
+            except OSError:
+                pass
+            remaining.append(child.name)
+        if remaining in ([], [PIN_NAME]):
+            try:
+                if remaining:
+                    os.remove(os.path.join(key_dir, PIN_NAME))
+                os.rmdir(key_dir)
+            except OSError:
+                pass
+        return removed
+
+    def start_sweeper(self, interval: float) -> None:
+        """Index the folder, then sweep, re-index and enforce every ``interval`` seconds.
+
+        Re-indexing picks up files written by other processes sharing ``root``.
+        """
+        if self._sweeper is not None:
+            return
+
+        def _loop() -> None:
+            self.scan()
+            self.enforce()
+            while interval > 0:
+                time.sleep(interval)
+                try:
+                    self.sweep_orphans()
+                    self.scan()
+                    self.enforce()
+                except Exception as exc:
+                    print(f"Storage sweep failed: {exc}")
+
+        self._sweeper = threading.Thread(target=_loop, name="storage-sweeper", daemon=True)
+        self._sweeper.start()
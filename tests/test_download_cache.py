@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+import pytest
+
+from download_cache import DownloadCache, make_cache_key
+
+
+def _write(directory: str, name: str = "video.mp4") -> str:
+    path = f"{directory}/{name}"
+    with open(path, "wb") as fh:
+        fh.write(b"media")
+    return path
+
+
+def test_concurrent_fetches_run_the_producer_once(tmp_path) -> None:
+    cache = DownloadCache(str(tmp_path))
+    key = make_cache_key("https://example.com/v", "best")
+    calls = []
+
+    def producer() -> str:
+        calls.append(1)
+        time.sleep(0.2)
+        return _write(cache.directory_for(key))
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.fetch(key, producer))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(set(results)) == 1 and len(results) == 5
+    assert not cache.in_flight(key)
+
+
+def test_waiters_share_the_producer_error_and_the_next_fetch_retries(tmp_path) -> None:
+    cache = DownloadCache(str(tmp_path))
+    key = make_cache_key("https://example.com/v", "best")
+    started = threading.Event()
+    errors = []
+
+    def failing() -> str:
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("boom")
+
+    def waiter() -> None:
+        started.wait()
+        try:
+            cache.fetch(key, lambda: pytest.fail("second producer ran"))
+        except RuntimeError as exc:
+            errors.append(str(exc))
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    with pytest.raises(RuntimeError):
+        cache.fetch(key, failing)
+    thread.join()
+
+    assert errors == ["boom"]
+    assert cache.fetch(key, lambda: _write(cache.directory_for(key))).endswith("video.mp4")
+
+
+def test_stored_entries_survive_a_new_instance(tmp_path) -> None:
+    key = make_cache_key("https://example.com/v", "best")
+    first = DownloadCache(str(tmp_path))
+    path = first.fetch(key, lambda: _write(first.directory_for(key)))
+
+    second = DownloadCache(str(tmp_path))
+    assert second.lookup(key) == path
+    second.invalidate(key)
+    assert second.lookup(key) is None
+
+
+def test_files_outside_the_keys_directory_are_not_cached(tmp_path) -> None:
+    cache = DownloadCache(str(tmp_path))
+    key = make_cache_key("https://example.com/v", "137")
+    other = make_cache_key("https://example.com/v", "api-direct")
+    os.makedirs(cache.directory_for(other))
+
+    path = cache.fetch(key, lambda: _write(cache.directory_for(other)))
+    assert os.path.exists(path)
+    assert cache.lookup(key) is None
+
+
+def test_keys_differ_by_format_and_postprocessing() -> None:
+    url = "https://www.youtube.com/watch?v=abc&utm_source=x"
+    assert make_cache_key(url, "best") == make_cache_key("https://youtube.com/watch?v=abc", "best")
+    assert make_cache_key(url, "best") != make_cache_key(url, "137")
+    assert make_cache_key(url, "best", ["a"]) != make_cache_key(url, "best", ["b"])
+
+
+def test_claim_across_processes_is_exclusive_until_released(tmp_path) -> None:
+    # Two instances on one root stand in for two processes: flock locks
+    # conflict between separate open files even within one process.
+    key = make_cache_key("https://example.com/v", "best")
+    first = DownloadCache(str(tmp_path))
+    second = DownloadCache(str(tmp_path))
+
+    flight = first.claim(key, across_processes=True)
+    assert flight is not None
+    assert second.claim(key, across_processes=True) is None
+    assert not second.in_flight(key)
+
+    first.release(key, flight)
+    other = second.claim(key, across_processes=True)
+    assert other is not None
+    second.release(key, other)
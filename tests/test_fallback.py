@@ -0,0 +1,77 @@
+from fallback import StrategyMemory, domain_of, is_strategy_failure
+
+STRATEGIES = ["cookies", "no_cookies", "api"]
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _memory(clock: FakeClock) -> StrategyMemory:
+    return StrategyMemory(ttl=600, failure_threshold=2, cooldown=60, clock=clock)
+
+
+def test_domain_of_strips_common_prefixes() -> None:
+    assert domain_of("https://www.youtube.com/watch?v=x") == "youtube.com"
+    assert domain_of("https://music.youtube.com/watch?v=x") == "youtube.com"
+    assert domain_of("not a url") == ""
+
+
+def test_plan_keeps_the_callers_order_without_history() -> None:
+    memory = _memory(FakeClock())
+    assert memory.plan("example.com", STRATEGIES) == (STRATEGIES, [])
+
+
+def test_recent_success_goes_first_and_recent_failure_last() -> None:
+    clock = FakeClock()
+    memory = _memory(clock)
+    memory.record_failure("example.com", "cookies")
+    memory.record_success("example.com", "api")
+
+    assert memory.plan("example.com", STRATEGIES)[0] == ["api", "no_cookies", "cookies"]
+    assert memory.recently_succeeded("example.com", "api")
+    # Other domains are unaffected.
+    assert memory.plan("other.com", STRATEGIES)[0] == STRATEGIES
+
+    clock.now += 601
+    assert memory.plan("example.com", STRATEGIES)[0] == STRATEGIES
+    assert not memory.recently_succeeded("example.com", "api")
+
+
+def test_circuit_opens_after_repeated_failures_and_half_opens_after_cooldown() -> None:
+    clock = FakeClock()
+    memory = _memory(clock)
+    memory.record_failure("example.com", "cookies")
+    assert memory.plan("example.com", STRATEGIES)[1] == []
+    memory.record_failure("example.com", "cookies")
+
+    assert memory.plan("example.com", STRATEGIES) == (["no_cookies", "api"], ["cookies"])
+
+    clock.now += 61
+    ordered, skipped = memory.plan("example.com", STRATEGIES)
+    assert skipped == [] and ordered[-1] == "cookies"
+    memory.record_success("example.com", "cookies")
+    assert memory.plan("example.com", STRATEGIES) == (STRATEGIES, [])
+
+
+def test_plan_falls_back_to_every_strategy_when_all_circuits_are_open() -> None:
+    memory = _memory(FakeClock())
+    for strategy in STRATEGIES:
+        memory.record_failure("example.com", strategy)
+        memory.record_failure("example.com", strategy)
+
+    assert memory.plan("example.com", STRATEGIES) == (STRATEGIES, [])
+
+
+def test_only_refusals_count_against_a_strategy() -> None:
+    assert is_strategy_failure(RuntimeError("ERROR: [youtube] x: Sign in to confirm you're not a bot"))
+    assert is_strategy_failure(RuntimeError("ERROR: unable to download video data: HTTP Error 403: Forbidden"))
+    assert is_strategy_failure(RuntimeError("ERROR: HTTP Error 429: Too Many Requests"))
+    assert not is_strategy_failure(RuntimeError("ERROR: [youtube] x: Video unavailable"))
+    assert not is_strategy_failure(RuntimeError("ERROR: [youtube] x: Private video. Sign in if you've been granted access"))
+    assert not is_strategy_failure(RuntimeError("ERROR: 'foo' is not a valid URL"))
+    assert not is_strategy_failure(FileNotFoundError("Download finished but file missing: x.mp4"))
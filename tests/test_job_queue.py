@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Callable, List
+
+import pytest
+
+from job_queue import JobScheduler, QueueFullError
+
+
+def _wait_until(predicate: Callable[[], bool], timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def test_lower_priority_values_run_first() -> None:
+    scheduler = JobScheduler(workers=1)
+    gate = threading.Event()
+    order: List[str] = []
+    scheduler.submit("blocker", gate.wait)
+    _wait_until(lambda: scheduler.active_count() == 1)
+
+    scheduler.submit("prefetch", order.append, "prefetch", priority=2000)
+    scheduler.submit("batch", order.append, "batch", priority=1000)
+    scheduler.submit("interactive", order.append, "interactive", priority=0)
+    assert scheduler.position("interactive") == 1
+    gate.set()
+    _wait_until(lambda: len(order) == 3)
+
+    assert order == ["interactive", "batch", "prefetch"]
+
+
+def test_client_limit_lets_other_clients_go_first() -> None:
+    scheduler = JobScheduler(workers=2, client_limit=1)
+    gate = threading.Event()
+    started: List[str] = []
+
+    def job(name: str) -> None:
+        started.append(name)
+        gate.wait()
+
+    scheduler.submit("a1", job, "a1", client="a")
+    scheduler.submit("a2", job, "a2", client="a")
+    scheduler.submit("b1", job, "b1", client="b")
+    _wait_until(lambda: len(started) == 2)
+    time.sleep(0.05)
+
+    assert sorted(started) == ["a1", "b1"]
+    assert scheduler.position("a2") == 1
+    gate.set()
+    _wait_until(lambda: len(started) == 3)
+
+
+def test_client_queue_limit_rejects_extra_jobs() -> None:
+    scheduler = JobScheduler(workers=1, client_queue_limit=1)
+    gate = threading.Event()
+    scheduler.submit("running", gate.wait, client="a")
+    _wait_until(lambda: scheduler.active_count() == 1)
+    scheduler.submit("queued", gate.wait, client="a")
+
+    with pytest.raises(QueueFullError):
+        scheduler.submit("rejected", gate.wait, client="a")
+    scheduler.submit("other", gate.wait, client="b")
+    gate.set()
+
+
+def test_reserved_workers_stay_free_for_interactive_jobs() -> None:
+    scheduler = JobScheduler(workers=2, reserved_workers=1, reserve_below=1000)
+    gate = threading.Event()
+    started: List[str] = []
+
+    def job(name: str) -> None:
+        started.append(name)
+        gate.wait()
+
+    scheduler.submit("batch1", job, "batch1", priority=1000)
+    scheduler.submit("batch2", job, "batch2", priority=1000)
+    _wait_until(lambda: started == ["batch1"])
+    assert scheduler.idle_slots(1000) == 0
+    assert scheduler.idle_slots(0) == 0
+
+    scheduler.submit("interactive", job, "interactive", priority=0)
+    _wait_until(lambda: "interactive" in started)
+    time.sleep(0.05)
+
+    assert "batch2" not in started
+    gate.set()
+    _wait_until(lambda: len(started) == 3)
+
+
+def test_blocking_lends_the_slot_to_another_job() -> None:
+    scheduler = JobScheduler(workers=1)
+    gate = threading.Event()
+    done = threading.Event()
+
+    def waits_on_other_stage() -> None:
+        with scheduler.blocking():
+            gate.wait()
+
+    scheduler.submit("first", waits_on_other_stage)
+    scheduler.submit("second", done.set)
+
+    assert done.wait(2.0)
+    gate.set()
@@ -0,0 +1,110 @@
+import time
+from typing import Any, Dict, Optional
+
+from job_store import JobStore, SharedJobStore
+
+
+def _summarize(parent: Dict[str, Any], children: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    done = sum(1 for child in children.values() if child["status"] == "completed")
+    if done == len(children):
+        return {"status": "completed", "progress": 100}
+    return {"progress": int(100 * done / len(children))}
+
+
+def test_durable_fields_survive_a_restart(tmp_path) -> None:
+    db_path = str(tmp_path / "jobs.sqlite3")
+    store = JobStore(db_path=db_path)
+    parent = store.create(status="downloading")
+    child = store.create(status="queued", source_url="https://example.com/v", parent_id=parent)
+    items = [{"id": "t1", "status": "completed", "progress": 100}]
+    store.update(parent, items=items)
+    store.update(child, progress=40)
+
+    reloaded = JobStore(db_path=db_path)
+    assert reloaded.get(child)["parent_id"] == parent
+    assert reloaded.get(parent)["items"] == items
+    # Progress alone is volatile and not written.
+    assert reloaded.get(child)["progress"] == 0
+
+
+def test_update_parent_summarizes_children(tmp_path) -> None:
+    store = JobStore()
+    parent = store.create(status="downloading")
+    children = [store.create(status="queued", parent_id=parent) for _ in range(2)]
+
+    store.update(children[0], status="completed")
+    assert store.update_parent(parent, _summarize)
+    assert store.get(parent)["progress"] == 50
+    store.update(children[1], status="completed")
+    store.update_parent(parent, _summarize)
+    assert store.get(parent)["status"] == "completed"
+
+
+def test_shared_update_parent_summarizes_children(tmp_path) -> None:
+    store = SharedJobStore(str(tmp_path / "jobs.sqlite3"))
+    parent = store.create(status="downloading")
+    children = [store.create(status="queued", parent_id=parent) for _ in range(2)]
+    for child in children:
+        store.update(child, status="completed")
+
+    assert store.update_parent(parent, _summarize)
+    assert store.get(parent)["status"] == "completed"
+    assert not store.update_parent(parent, _summarize)
+
+
+def test_claim_next_takes_priority_then_least_busy_client(tmp_path) -> None:
+    store = SharedJobStore(str(tmp_path / "jobs.sqlite3"))
+    batch = store.create(status="queued", priority=1000, client_id="a")
+    busy = store.create(status="queued", priority=0, client_id="a")
+    idle = store.create(status="queued", priority=0, client_id="b")
+    store.create(status="queued", priority=0, client_id="a")
+
+    first = store.claim_next()
+    assert first["job_id"] == busy
+    # Client "a" now runs a job, so "b" goes next at the same priority.
+    assert store.claim_next()["job_id"] == idle
+    assert store.claim_next(priority_below=1000)["job_id"] not in (batch, busy, idle)
+    assert store.claim_next(priority_below=1000) is None
+    assert store.claim_next()["job_id"] == batch
+    assert store.claim_next() is None
+
+
+def test_claim_next_respects_client_limit(tmp_path) -> None:
+    store = SharedJobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create(status="queued", client_id="a")
+    store.create(status="queued", client_id="a")
+
+    assert store.claim_next(client_limit=1) is not None
+    assert store.claim_next(client_limit=1) is None
+    assert store.claim_next() is not None
+
+
+def test_reclaim_expired_requeues_jobs_but_not_batch_parents(tmp_path) -> None:
+    store = SharedJobStore(str(tmp_path / "jobs.sqlite3"), lease=0.0)
+    parent = store.create(status="downloading")
+    child = store.create(status="queued", source_url="https://example.com/v", parent_id=parent)
+    orphan = store.create(status="queued")
+    assert store.claim_next()["job_id"] == child
+    assert store.claim_next()["job_id"] == orphan
+    time.sleep(0.01)
+
+    assert store.reclaim_expired() == 2
+    assert store.get(child)["status"] == "queued"
+    # Without a source URL the job cannot be retried.
+    assert store.get(orphan)["status"] == "error"
+    assert store.get(parent)["status"] == "downloading"
+
+
+def test_progress_ticks_are_coalesced(tmp_path) -> None:
+    store = SharedJobStore(str(tmp_path / "jobs.sqlite3"))
+    job_id = store.create(status="queued")
+    assert store.update(job_id, status="downloading", progress=1)
+    version = store.get(job_id)["version"]
+
+    for percent in range(2, 50):
+        store.update(job_id, status="downloading", progress=percent)
+    assert store.get(job_id)["version"] == version
+
+    store.update(job_id, status="completed", progress=100)
+    job = store.get(job_id)
+    assert (job["status"], job["progress"]) == ("completed", 100)
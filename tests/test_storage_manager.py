@@ -0,0 +1,84 @@
+import os
+import time
+
+from storage_manager import StorageManager
+
+
+def _media(root, name: str, size: int = 100, age: float = 0.0) -> str:
+    directory = root / name
+    directory.mkdir()
+    path = directory / "video.mp4"
+    path.write_bytes(b"x" * size)
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+    return str(path)
+
+
+def test_enforce_evicts_least_recently_served_files(tmp_path) -> None:
+    old = _media(tmp_path, "old", age=60)
+    new = _media(tmp_path, "new")
+    storage = StorageManager(str(tmp_path), quota_bytes=150)
+    storage.scan()
+
+    assert storage.enforce() == [old]
+    assert not os.path.exists(os.path.dirname(old))
+    assert os.path.exists(new)
+    assert storage.total_bytes() == 100
+
+
+def test_enforce_spares_pinned_files(tmp_path) -> None:
+    old = _media(tmp_path, "old", age=60)
+    new = _media(tmp_path, "new")
+    storage = StorageManager(str(tmp_path), quota_bytes=150)
+    storage.scan()
+
+    with storage.pinned(os.path.dirname(old)):
+        assert storage.is_pinned(old)
+        assert storage.enforce() == [new]
+    assert not storage.is_pinned(old)
+
+
+def test_pins_are_seen_by_other_processes(tmp_path) -> None:
+    # A second manager on the same root stands in for another worker.
+    old = _media(tmp_path, "old", age=60)
+    _media(tmp_path, "new")
+    worker = StorageManager(str(tmp_path))
+    storage = StorageManager(str(tmp_path), quota_bytes=150)
+    storage.scan()
+
+    worker.pin(old)
+    assert not storage.is_pinned(old)
+    assert [os.path.basename(os.path.dirname(path)) for path in storage.enforce()] == ["new"]
+    assert storage.sweep_orphans() == 0
+    assert os.path.exists(old)
+
+    worker.unpin(old)
+    storage.scan()
+    storage.quota_bytes = 50
+    assert storage.enforce() == [old]
+
+
+def test_sweep_orphans_removes_stale_leftovers_and_empty_directories(tmp_path) -> None:
+    media = _media(tmp_path, "done")
+    stale = tmp_path / "done" / "video.f137.mp4.part"
+    stale.write_bytes(b"x")
+    past = time.time() - 7200
+    os.utime(stale, (past, past))
+    (tmp_path / "empty").mkdir()
+    storage = StorageManager(str(tmp_path), orphan_age=3600)
+
+    assert storage.sweep_orphans() == 1
+    assert os.path.exists(media)
+    assert not stale.exists()
+    assert not (tmp_path / "empty").exists()
+
+
+def test_pinning_an_unknown_directory_creates_it_until_swept(tmp_path) -> None:
+    storage = StorageManager(str(tmp_path))
+    pending = str(tmp_path / "pending")
+
+    with storage.pinned(pending):
+        storage.sweep_orphans()
+        assert os.path.isdir(pending)
+    storage.sweep_orphans()
+    assert not os.path.exists(pending)
@@ -0,0 +1,140 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire after a time-to-live.
+
+    Failures can be cached with ``set_negative`` so that repeated lookups for a
+    broken URL do not redo the expensive work until ``negative_ttl`` passes.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600.0, negative_ttl: float = 60.0) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self.negative_ttl = float(negative_ttl)
+        self._data: "OrderedDict[Hashable, Tuple[float, bool, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, key: Hashable, value: Any, ttl: float, negative: bool) -> None:
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, negative, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._put(key, value, self.ttl if ttl is None else ttl, False)
+
+    def set_negative(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._put(key, value, self.negative_ttl if ttl is None else ttl, True)
+
+    def lookup(self, key: Hashable) -> Tuple[bool, bool, Any]:
+        """Return ``(found, negative, value)`` for ``key``."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return False, False, None
+            expires, negative, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return False, False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, negative, value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        found, negative, value = self.lookup(key)
+        if not found or negative:
+            return default
+        return value
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class PersistentTTLCache(TTLCache):
+    """TTLCache backed by a SQLite table so entries survive restarts.
+
+    Values must be JSON-serialisable. The in-memory LRU answers hot keys;
+    misses fall through to SQLite, and writes go to both.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        table: str,
+        maxsize: int = 1024,
+        ttl: float = 86400.0,
+        negative_ttl: float = 300.0,
+    ) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl, negative_ttl=negative_ttl)
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table}")
+        self.table = table
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY, value TEXT, negative INTEGER, expires_at REAL)"
+            )
+            self._db.execute(f"DELETE FROM {table} WHERE expires_at < ?", (time.time(),))
+
+    def _put(self, key: Hashable, value: Any, ttl: float, negative: bool) -> None:
+        super()._put(key, value, ttl, negative)
+        if ttl <= 0:
+            return
+        with self._db_lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+                (str(key), json.dumps(value), int(negative), time.time() + ttl),
+            )
+
+    def lookup(self, key: Hashable) -> Tuple[bool, bool, Any]:
+        found, negative, value = super().lookup(key)
+        if found:
+            return found, negative, value
+        with self._db_lock:
+            row = self._db.execute(
+                f"SELECT value, negative, expires_at FROM {self.table} WHERE key = ?",
+                (str(key),),
+            ).fetchone()
+        if row is None:
+            return False, False, None
+        raw, negative, expires_at = row
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            self.pop(key)
+            return False, False, None
+        value = json.loads(raw)
+        # Promote into memory for the rest of its lifetime.
+        TTLCache._put(self, key, value, remaining, bool(negative))
+        return True, bool(negative), value
+
+    def pop(self, key: Hashable) -> None:
+        super().pop(key)
+        with self._db_lock:
+            self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (str(key),))
@@ -0,0 +1,62 @@
+import os
+import zipfile
+from typing import Dict, Iterable, Iterator, List
+
+ZIP_STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def unique_arcname(filepath: str, seen: Dict[str, int]) -> str:
+    """Archive name for ``filepath``, numbered when ``seen`` already has it."""
+    name = os.path.basename(filepath)
+    count = seen.get(name, 0)
+    seen[name] = count + 1
+    if count:
+        stem, ext = os.path.splitext(name)
+        name = f"{stem} ({count}){ext}"
+    return name
+
+
+class _Sink:
+    """Write-only, unseekable file object whose output the caller drains."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(filepaths: Iterable[str], chunk_size: int = ZIP_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield an uncompressed ZIP archive of ``filepaths`` piece by piece.
+
+    ``filepaths`` may be lazy: each file is opened when the iterable
+    produces it, and at most one chunk is buffered at a time, so the archive
+    never exists in memory or on disk. Because the output cannot seek back,
+    zipfile writes each member's CRC and sizes in a data descriptor after
+    its data.
+    """
+    sink = _Sink()
+    seen: Dict[str, int] = {}
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for filepath in filepaths:
+            # from_file records the size up front, which decides ZIP64.
+            info = zipfile.ZipInfo.from_file(filepath, arcname=unique_arcname(filepath, seen))
+            info.compress_type = zipfile.ZIP_STORED
+            with open(filepath, "rb") as source, archive.open(info, "w") as member:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    member.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()